@@ -0,0 +1,137 @@
+import collections
+import sys
+import numpy as np
+
+# Risoluzione per feature degli input AI: vettori nella stessa cella condividono le predizioni AI.
+# Le regole non passano dalla cache: sono valutate sempre sui valori esatti (una cella non attraversa una soglia).
+QUANTUM = {
+    'Soil_moisture_pct': 0.1,
+    'Temperature_C': 0.1,
+    'Humidity_pct': 0.1,
+    'Nitrogen_mg_kg': 1.0,
+    'Phosphorus_mg_kg': 1.0,
+    'Potassium_mg_kg': 1.0,
+    'pH': 0.01,
+    'Temp_min_C': 0.1,
+    'Temp_max_C': 0.1,
+    # Feature di tendenza (solo con GREENFIELD_ROLLING_FEATURES=1)
+    'moisture_slope': 0.01,
+    'et_cum_mm': 0.1,
+    'temp_ewma': 0.1,
+}
+ADVICE_CACHE_SIZE = 200_000
+NAN_CELL = np.iinfo(np.int32).min  # cella riservata ai valori mancanti
+COST_ALPHA = 0.1
+
+# Esito AI di una lettura impacchettato in 4 bit
+AI_BITS = {'irrigation': 1, 'fertilization': 2, 'energy': 4}
+AI_VALID = 8
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def pack_ai(ai):
+    packed = np.full(len(ai['irrigation']), AI_VALID, dtype=np.uint8)
+    for key, bit in AI_BITS.items():
+        packed |= np.where(np.asarray(ai[key]) == 1, bit, 0).astype(np.uint8)
+    return packed
+
+
+def unpack_ai(packed):
+    """Ricostruisce il dizionario di array 0/1 atteso da build_advice_packet."""
+    return {key: ((packed & bit) != 0).astype(np.int8) for key, bit in AI_BITS.items()}
+
+
+class AdviceCache:
+    """
+    Cache LRU condivisa da tutti i sensori: vettore di feature quantizzato -> predizioni
+    AI impacchettate. Le voci valgono per una sola versione di (configurazione, modelli):
+    al cambio la cache viene svuotata.
+    """
+    def __init__(self, columns=None, quantum=None, maxsize=ADVICE_CACHE_SIZE):
+        quantum = dict(QUANTUM, **(quantum or {}))
+        self.columns = list(columns or quantum)
+        self.quantum = np.array([quantum[c] for c in self.columns])
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.cost_s = 0.0  # secondi medi per lettura calcolata
+
+    def __len__(self):
+        return len(self.entries)
+
+    def ensure_version(self, version):
+        """Svuota la cache se configurazione o modelli sono cambiati."""
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+
+    def keys_for(self, readings):
+        """Chiavi (bytes) dei vettori quantizzati, una per lettura."""
+        values = np.array([[_to_float(r.get(c)) for c in self.columns] for r in readings]).reshape(len(readings), -1)
+        cells = np.round(values / self.quantum)
+        cells = np.where(np.isnan(cells), NAN_CELL, cells).astype(np.int32)
+        return np.ascontiguousarray(cells).view(np.dtype((np.void, cells.shape[1] * 4))).ravel().tolist()
+
+    def lookup(self, keys):
+        """(hit, packed): packed è valido dove hit è True."""
+        packed = np.zeros(len(keys), dtype=np.uint8)
+        hit = np.zeros(len(keys), dtype=bool)
+        entries = self.entries
+        for i, key in enumerate(keys):
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+                packed[i] = value
+                hit[i] = True
+        n_hit = int(hit.sum())
+        self.hits += n_hit
+        self.misses += len(keys) - n_hit
+        return hit, packed
+
+    def store(self, keys, packed):
+        entries = self.entries
+        for key, value in zip(keys, packed.tolist()):
+            entries[key] = value
+            entries.move_to_end(key)
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def record_cost(self, computed, seconds):
+        if computed:
+            per_reading = seconds / computed
+            self.cost_s = per_reading if self.cost_s == 0 else (1 - COST_ALPHA) * self.cost_s + COST_ALPHA * per_reading
+
+    def memory_bytes(self):
+        """Stima: chiave bytes + nodo dell'OrderedDict (il valore è un int piccolo condiviso)."""
+        if not self.entries:
+            return 0
+        key_bytes = sys.getsizeof(next(iter(self.entries)))
+        return len(self.entries) * (key_bytes + 100)
+
+    def snapshot(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'memory_bytes': self.memory_bytes(),
+            'latency_saved_s': round(self.hits * self.cost_s, 3),
+        }
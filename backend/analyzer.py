@@ -1,20 +1,35 @@
 import json
+import threading
 import time
 import os
 import pandas as pd
 import numpy as np
-from confluent_kafka import Consumer, Producer
+from message_bus import get_bus
+from degradation import DegradationController, MODE_FULL, MODE_LATEST_ONLY
+from suppression import ChangeSuppressor
+from advice_cache import AdviceCache, pack_ai, unpack_ai
+from checkpoint import CheckpointManager, DeliveryTracker
+from control_plane import CONTROL_TOPIC, ConfigSnapshot, ControlPlane
+from thresholds import ThresholdTable
+from window_aggregation import is_window, window_to_reading
+from rolling_features import ROLLING_FEATURES, RollingFeatureStore, rolling_frame
+from model_registry import ModelWatcher, artifact, load_analyzer_models, read_current
+import profiling
 from pipeline import DataCleaner, FeatureEngineer, ModelEstimator
-from strategies_model import LogisticRegressionStrategy, RuleBasedStrategy
+from strategies_model import LogisticRegressionStrategy, RuleBasedStrategy, SGDLogisticStrategy, TreeEnsembleStrategy
 from data_loader import load_dataset_robust
 
-# Configurazione Kafka
-KAFKA_CONF = {
-    'bootstrap.servers': 'localhost:9092', 
-    'group.id': 'analyzer-brain-v1', 
-    'auto.offset.reset': 'latest'
-}
-producer = Producer({'bootstrap.servers': 'localhost:9092'})
+# Configurazione Bus (Kafka o trasporto locale, vedi message_bus.py)
+GROUP_ID = 'analyzer-brain-v1'
+CONTROL_GROUP_ID = 'analyzer-control-v1'  # system-settings su un consumer proprio (piano di controllo)
+MODELS_GROUP_ID = 'analyzer-models-v1'    # notifiche del registro dei modelli (model-updates)
+bus = get_bus()
+
+CONSUME_BATCH = 500          # messaggi letti per giro del loop
+LATEST_WINDOW_S = 1.0        # in LATEST_ONLY: finestra in cui si tiene solo l'ultima lettura per sensore
+LATEST_MAX_BATCH = 50_000
+METRICS_TOPIC = 'system-metrics'
+METRICS_INTERVAL_S = 5.0
 
 # Stato Interno
 SYSTEM_CONFIG = {
@@ -23,6 +38,9 @@ SYSTEM_CONFIG = {
     "email": "agronomo@greenfield.it"
 }
 SETTINGS_UPDATED = False # Flag: False = usa default hardcoded, True = usa SYSTEM_CONFIG
+CONFIG_VERSION = 0       # incrementata a ogni system-settings
+MODEL_VERSION = 0        # incrementata a ogni ricaricamento dei modelli
+AI_ERRORS = 0            # errori di inferenza AI: dopo uno scambio di modelli decidono il rollback
 
 
 # 1. SETUP & TRAINING (Eseguito all'avvio del servizio)
@@ -36,7 +54,77 @@ rule_irr = RuleBasedStrategy('Irrigation')
 rule_fert = RuleBasedStrategy('Fertilization')
 rule_en = RuleBasedStrategy('Energy')
 
-pipe_irr, pipe_fert, pipe_en = None, None, None
+# Modelli AI: 'logreg' (batch), 'gbt'/'rf' (alberi compilati) oppure 'sgd' (online, partial_fit). Con 'sgd' e
+# GREENFIELD_ONLINE_LEARNING=1 i modelli seguono le etichette delle regole batch per batch.
+AI_STRATEGY = os.environ.get("GREENFIELD_AI_STRATEGY", "logreg")
+ONLINE_LEARNING = os.environ.get("GREENFIELD_ONLINE_LEARNING", "0") == "1"
+ONLINE_UPDATES_PER_VERSION = 20  # aggiornamenti online prima di invalidare la cache degli esiti
+REFIT_EPOCHS = 3                 # epoche di warm start per il re-fit SGD dopo un cambio soglie
+AI_TARGETS = (('irrigation', 'Irrigation'), ('fertilization', 'Fertilization'), ('energy', 'Energy'))
+THRESHOLD_KEYS = ("moisture_threshold", "temp_min", "temp_max", "n_threshold", "p_threshold", "k_threshold")
+
+# Feature di tendenza per sensore (pendenza umidità, ET cumulata, EWMA temperatura): sempre calcolate e
+# incluse negli advice; con GREENFIELD_ROLLING_FEATURES=1 entrano anche negli input dei modelli AI
+ROLLING_AI = os.environ.get("GREENFIELD_ROLLING_FEATURES", "0") == "1"
+AI_FEATURES = FEATURES + ROLLING_FEATURES if ROLLING_AI else FEATURES
+TREND_DEAD_BANDS = {'moisture_slope': 0.5, 'et_cum_mm': 1.0, 'temp_ewma': 0.2} if ROLLING_AI else {}
+rolling = RollingFeatureStore()
+
+# {chiave: (strategia, pipeline)}, sostituito in blocco (scambio atomico) dal re-fit in background
+# o da una nuova versione del registro dei modelli
+AI_MODELS = None
+DF_TRAIN = None
+REGISTRY_VERSION = None  # versione del registro caricata all'avvio (None = modelli addestrati qui)
+_model_lock = threading.Lock()
+CANARY_ROWS = 256        # righe del dataset su cui si valida una nuova versione prima dello scambio
+CANARY_TOLERANCE = 0.05  # accordo con le regole al massimo così peggiore dei modelli in uso
+
+# Letture invariate (entro le dead-band) per sensore: heartbeat invece di ricalcolare
+suppressor = ChangeSuppressor({**TREND_DEAD_BANDS, **SYSTEM_CONFIG.get("dead_bands", {})})
+
+# Commit manuali: offset committati a lotti, solo ad advice consegnati, insieme allo stato in memoria
+checkpoints = CheckpointManager('analyzer')
+delivery = DeliveryTracker()
+
+def make_ai_strategy():
+    if AI_STRATEGY == 'sgd':
+        return SGDLogisticStrategy()
+    if AI_STRATEGY in ('gbt', 'rf'):
+        return TreeEnsembleStrategy(AI_STRATEGY)
+    return LogisticRegressionStrategy(max_iter=500)
+
+def train_ai_models(df_train, rules, previous=None):
+    """
+    Addestra le tre pipeline AI sulle etichette delle strategie a regole 'rules'.
+    Le strategie online ripartono da una copia dei pesi precedenti (warm start).
+    """
+    models = {}
+    for key, target in AI_TARGETS:
+        labels = rules[key].predict(df_train)
+        old = previous[key][0] if previous is not None else None
+        if hasattr(old, 'clone'):
+            with _model_lock:
+                strategy = old.clone()
+            strategy.fit_epochs(df_train[AI_FEATURES], labels, REFIT_EPOCHS)
+        else:
+            strategy = make_ai_strategy()
+            strategy.train(df_train[AI_FEATURES], labels)
+        models[key] = strategy
+    return build_pipelines(models)
+
+def build_pipelines(strategies):
+    return {key: (strategies[key], DataCleaner(FeatureEngineer(ModelEstimator(strategies[key], AI_FEATURES, target))))
+            for key, target in AI_TARGETS}
+
+def load_registry_models(manifest):
+    """Modelli AI di una versione del registro (artefatto di model_registry.save_analyzer_models)."""
+    saved = load_analyzer_models(artifact(manifest, 'models'))
+    if list(saved['features']) != list(AI_FEATURES):
+        raise ValueError(f"feature del modello {saved['features']} diverse da quelle in uso {AI_FEATURES}")
+    missing = [key for key, _ in AI_TARGETS if key not in saved['strategies']]
+    if missing:
+        raise ValueError(f"strategie mancanti: {missing}")
+    return build_pipelines(saved['strategies'])
 
 try:
     csv_path = "dataset/enriched_tomato_irrigation_dataset.csv"
@@ -44,118 +132,525 @@ try:
     
     df_raw = load_dataset_robust(csv_path)
     cleaner = DataCleaner(FeatureEngineer())
-    df_train = cleaner.handle(df_raw).fillna(0)
-
-    # Training AI
-    strat_irr = LogisticRegressionStrategy(max_iter=500)
-    strat_fert = LogisticRegressionStrategy(max_iter=500)
-    strat_en = LogisticRegressionStrategy(max_iter=500)
-
-    print("   ...Addestramento Logistic Regression...")
-    strat_irr.train(df_train[FEATURES], rule_irr.predict(df_train))
-    strat_fert.train(df_train[FEATURES], rule_fert.predict(df_train))
-    strat_en.train(df_train[FEATURES], rule_en.predict(df_train))
-
-    # Creazione Pipeline
-    pipe_irr = DataCleaner(FeatureEngineer(ModelEstimator(strat_irr, FEATURES, "Irrigation")))
-    pipe_fert = DataCleaner(FeatureEngineer(ModelEstimator(strat_fert, FEATURES, "Fertilization")))
-    pipe_en = DataCleaner(FeatureEngineer(ModelEstimator(strat_en, FEATURES, "Energy")))
+    DF_TRAIN = cleaner.handle(df_raw).fillna(0)
+    if ROLLING_AI:
+        DF_TRAIN = DF_TRAIN.assign(**rolling_frame(DF_TRAIN))  # righe del CSV come serie di un sensore
+
+    # Versione corrente del registro dei modelli, se presente: nessun training all'avvio
+    manifest = read_current('analyzer')
+    if manifest is not None:
+        try:
+            AI_MODELS = load_registry_models(manifest)
+            REGISTRY_VERSION = manifest['version']
+            print(f"   ...Modelli AI dal registro (versione {REGISTRY_VERSION})")
+        except Exception as e:
+            print(f"⚠️ Versione {manifest['version']} del registro non utilizzabile ({e}): training")
+
+    # Training AI + Creazione Pipeline
+    if AI_MODELS is None:
+        print(f"   ...Addestramento modelli AI ({AI_STRATEGY})...")
+        AI_MODELS = train_ai_models(DF_TRAIN, {'irrigation': rule_irr, 'fertilization': rule_fert, 'energy': rule_en})
     print("✅ ANALYZER: Modelli pronti e operativi.")
 
 except Exception as e:
     print(f"❌ Errore critico nel Training: {e}")
 
 
-# 2. LOOP DI ELABORAZIONE (Event Loop)
+# 2. LOGICA DI ANALISI (Vettorizzata: una riga o un intero batch)
 
-def main():
-    global SETTINGS_UPDATED, SYSTEM_CONFIG
-    consumer = Consumer(KAFKA_CONF)
-    # Ascolta i dati dei sensori E i comandi di configurazione
-    consumer.subscribe(['sensor-data', 'system-settings'])
-    
-    print("🟢 ANALYZER: In ascolto su Kafka...")
+AI_INPUT_COLS = AI_FEATURES + ['Temp_min_C', 'Temp_max_C']
+
+# Esiti per vettore di feature quantizzato (+ soglie risolte), condivisi da tutti i sensori del processo
+advice_cache = AdviceCache(AI_INPUT_COLS)
+
+def rule_thresholds():
+    """Soglie correnti delle strategie a regole condivise (il default globale della tabella)."""
+    return {"moisture_threshold": rule_irr.m_thr, "temp_min": rule_en.tmin_thr, "temp_max": rule_en.tmax_thr,
+            "n_threshold": rule_fert.n_thr, "p_threshold": rule_fert.p_thr, "k_threshold": rule_fert.k_thr}
+
+# Soglie per (sensore/campo, fase colturale): riga (*, *) = soglie globali, le altre sono override parziali
+threshold_table = ThresholdTable(rule_thresholds())
+
+# Piano di controllo: configurazione e tabella soglie in uno snapshot immutabile, costruito da un thread
+# dedicato e adottato dal percorso dati al confine di ogni batch (adopt_snapshot)
+control = ControlPlane(ConfigSnapshot(0, SYSTEM_CONFIG, SETTINGS_UPDATED, CONFIG_VERSION, threshold_table))
+
+def apply_config(config, irr=None, fert=None, en=None):
+    """Applica le soglie configurate dall'utente alle strategie a regole (di default quelle condivise)."""
+    shared = irr is None
+    irr, fert, en = irr or rule_irr, fert or rule_fert, en or rule_en
+    irr.m_thr = config["moisture_threshold"]
+    en.tmin_thr = config["temp_min"]
+    en.tmax_thr = config["temp_max"]
+    fert.n_thr = config["n_threshold"]
+    fert.p_thr = config["p_threshold"]
+    fert.k_thr = config["k_threshold"]
+    if shared:
+        threshold_table.set_default(config)
+
+def configured_rules(config):
+    """Strategie a regole indipendenti con le soglie di 'config' (etichette per il re-fit)."""
+    rules = {key: RuleBasedStrategy(target) for key, target in AI_TARGETS}
+    apply_config(config, rules['irrigation'], rules['fertilization'], rules['energy'])
+    return rules
+
+def _numeric_column(df, col):
+    if col in df.columns:
+        return pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy(dtype=float)
+    return np.zeros(len(df))
+
+def _raw_column(df, col, fallback=None):
+    """Colonna numerica con NaN dove manca il valore (i confronti delle regole risultano falsi)."""
+    if col not in df.columns and fallback is not None:
+        col = fallback
+    if col in df.columns:
+        return pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+    return np.full(len(df), np.nan)
+
+def evaluate_rules(df, thresholds=None):
+    """
+    Valuta le regole su tutto il DataFrame con le soglie di ogni riga (matrice di
+    threshold_table.lookup, di default risolta da sensor_id e Crop_stage).
+    Restituisce array 0/1 per ogni attuatore.
+    """
+    if thresholds is None:
+        thresholds = threshold_table.lookup(_object_column(df, 'sensor_id', 'sensor'), _object_column(df, 'Crop_stage'))
+    thr = {c: threshold_table.column(thresholds, c) for c in threshold_table.columns}
+    with np.errstate(invalid='ignore'):
+        return {
+            'irrigation': (_raw_column(df, 'Soil_moisture_pct') < thr['moisture_threshold']).astype(np.int8),
+            'energy': ((_raw_column(df, 'Temp_min_C', 'Temperature_C') < thr['temp_min'])
+                       | (_raw_column(df, 'Temp_max_C', 'Temperature_C') > thr['temp_max'])).astype(np.int8),
+            'N': (_numeric_column(df, 'Nitrogen_mg_kg') < thr['n_threshold']).astype(np.int8),
+            'P': (_numeric_column(df, 'Phosphorus_mg_kg') < thr['p_threshold']).astype(np.int8),
+            'K': (_numeric_column(df, 'Potassium_mg_kg') < thr['k_threshold']).astype(np.int8),
+        }
+
+def _object_column(df, col, default=None):
+    return df[col].tolist() if col in df.columns else [default] * len(df)
+
+def evaluate_ai(df, models=None):
+    """
+    Esegue le tre pipeline AI sul batch. Le righe scartate dal DataCleaner
+    (valori fuori range) risultano OFF. Restituisce None se i modelli non sono pronti.
+    """
+    models = models or AI_MODELS  # una sola lettura: un re-fit concorrente non mescola versioni
+    if models is None:
+        return None
+    df_ai = pd.DataFrame({k: _numeric_column(df, k) for k in AI_INPUT_COLS}, index=df.index)
+    out = {}
+    for key, target in AI_TARGETS:
+        pred = models[key][1].handle(df_ai)[f"{target}_Predicted"]
+        out[key] = pred.reindex(df_ai.index, fill_value=0).to_numpy(dtype=np.int8)
+    return out
+
+def ai_labels(models=None):
+    """Motivo mostrato per ogni esito AI, dalla strategia installata (es. 'AI (SGD)')."""
+    models = models or AI_MODELS
+    return {key: f"AI ({models[key][0].name})" if models else 'AI' for key, _ in AI_TARGETS}
+
+def build_advice_packet(data, rules, ai, i, config=None, settings_updated=False, mode=MODE_FULL, thresholds=None,
+                        labels=None):
+    """
+    Costruisce il pacchetto 'system-advice' per la riga i del batch valutato.
+    thresholds: soglie della riga (dict) se diverse da quelle globali delle strategie a regole.
+    labels: motivi degli esiti AI (ai_labels(), calcolati una volta per batch).
+    """
+    thr = thresholds or rule_thresholds()
+    res_rules = {
+        'irrigation': {
+            'status': 'ON' if rules['irrigation'][i] == 1 else 'OFF',
+            'reason': f"Soglia attiva: < {thr['moisture_threshold']}%"
+        },
+        'energy': {
+            'status': 'ACTIVE' if rules['energy'][i] == 1 else 'OFF',
+            'reason': f"Range attivo: {thr['temp_min']}-{thr['temp_max']}°C"
+        },
+        'fertilization': {
+            'N': 'LOW' if rules['N'][i] else 'OK',
+            'P': 'LOW' if rules['P'][i] else 'OK',
+            'K': 'LOW' if rules['K'][i] else 'OK',
+            'reason': f"Soglie NPK: {thr['n_threshold']}/{thr['p_threshold']}/{thr['k_threshold']}"
+        }
+    }
+
+    res_ai = {'irrigation': {'status':'OFF'}, 'fertilization': {'N':'OK'}, 'energy': {'status':'OFF'}}
+    if ai is None and mode != MODE_FULL:
+        # AI saltata per smaltire il ritardo: il frontend mostra il motivo
+        for block in res_ai.values():
+            block['reason'] = f"AI sospesa ({mode})"
+    if ai is not None:
+        labels = labels or ai_labels()
+        res_ai['irrigation'] = {'status': 'ON' if ai['irrigation'][i]==1 else 'OFF', 'reason': labels['irrigation']}
+        res_ai['energy'] = {'status': 'ACTIVE' if ai['energy'][i]==1 else 'OFF', 'reason': labels['energy']}
+        res_ai['fertilization'] = {'N': 'CHECK' if ai['fertilization'][i]==1 else 'OK', 'P':'OK', 'K':'OK',
+                                   'reason': labels['fertilization']}
+
+    config = SYSTEM_CONFIG if config is None else config
+    if thresholds is not None:
+        config = {**config, **thresholds}
+    packet = {
+        'ts': data.get('ts', data.get('_ts', time.time())),
+        'sensor_id': data.get('sensor_id', 'sensor'),
+        'rules': res_rules,
+        'ai': res_ai,
+        'config': config,
+        'settings_updated': settings_updated,
+        'mode': mode
+    }
+    if ROLLING_FEATURES[0] in data:
+        packet['trend'] = {k: round(data[k], 3) for k in ROLLING_FEATURES}
+    return packet
+
+def latest_per_sensor(readings):
+    """Tiene solo l'ultima lettura di ogni sensore (ordine di arrivo)."""
+    latest = {}
+    for data in readings:
+        latest[data.get('sensor_id', 'sensor')] = data
+    return list(latest.values())
+
+def reading_age(data, now=None):
+    """Secondi trascorsi dalla generazione della lettura (None se senza timestamp)."""
+    try:
+        return (time.time() if now is None else now) - float(data.get('_ts', data.get('ts')))
+    except (TypeError, ValueError):
+        return None
+
+# 2b. AGGIORNAMENTO DEI MODELLI (online a batch, re-fit in background al cambio soglie)
 
+_online_updates = 0
+_refit = {'config': None, 'thread': None}
+_refit_lock = threading.Lock()
+
+def online_update(df, rules):
+    """partial_fit delle strategie online sul batch, con le regole correnti come etichette."""
+    global _online_updates, MODEL_VERSION
+    models = AI_MODELS
+    if models is None or not all(hasattr(m[0], 'partial_fit') for m in models.values()):
+        return
+    df_ai = pd.DataFrame({k: _numeric_column(df, k) for k in AI_INPUT_COLS}, index=df.index)
+    kept = DataCleaner().handle(df_ai)  # stessi filtri di range delle pipeline
+    if kept.empty:
+        return
+    pos = df.index.get_indexer(kept.index)
+    labels = {
+        'irrigation': rules['irrigation'][pos],
+        'energy': rules['energy'][pos],
+        'fertilization': (rules['N'] | rules['P'] | rules['K'])[pos],
+    }
+    with _model_lock:
+        for key, (strategy, _) in models.items():
+            strategy.partial_fit(kept[AI_FEATURES], labels[key])
+    _online_updates += 1
+    if _online_updates % ONLINE_UPDATES_PER_VERSION == 0:
+        MODEL_VERSION += 1  # gli esiti in cache risalgono ai pesi precedenti
+
+def request_refit(config):
+    """Riallinea i modelli AI alle nuove soglie in background: il consumo continua con i modelli attuali."""
+    if DF_TRAIN is None:
+        return
+    with _refit_lock:
+        _refit['config'] = dict(config)
+        if _refit['thread'] is None:
+            _refit['thread'] = threading.Thread(target=_refit_worker, name='ai-refit', daemon=True)
+            _refit['thread'].start()
+
+def _refit_worker():
     while True:
-        msg = consumer.poll(0.1)
-        if msg is None: continue
-        if msg.error(): continue
-
-        topic = msg.topic()
-        payload = json.loads(msg.value().decode('utf-8'))
-
-        # A. GESTIONE CAMBIO SETTINGS (Evento asincrono) 
-        if topic == 'system-settings':
-            print(f"⚙️ RICEVUTO AGGIORNAMENTO CONFIG: {payload}")
-            SYSTEM_CONFIG.update(payload)
-            SETTINGS_UPDATED = True
-            
+        with _refit_lock:
+            config, _refit['config'] = _refit['config'], None
+            if config is None:  # nessuna richiesta più recente
+                _refit['thread'] = None
+                return
+        t0 = time.perf_counter()
+        base = AI_MODELS
+        models = train_ai_models(DF_TRAIN, configured_rules(config), base)
+        # Scambio tramite il watcher del registro (stesso lock degli scambi di versione), solo se durante
+        # il training non è arrivata un'altra versione: altrimenti si rifà il re-fit sopra quella
+        if not model_watcher.replace(models, f"re-fit sulle soglie ({AI_STRATEGY})", expected=lambda: AI_MODELS is base):
+            with _refit_lock:
+                if _refit['config'] is None:
+                    _refit['config'] = config
             continue
+        print(f"🔁 ANALYZER: modelli AI riallineati alle nuove soglie in {time.perf_counter() - t0:.2f}s "
+              f"(versione {MODEL_VERSION})")
+
+def validate_models(models):
+    """
+    Canary di una nuova versione: accordo con le regole correnti su CANARY_ROWS righe del dataset,
+    per attuatore, confrontato con quello dei modelli in uso. ValueError se peggiora oltre la tolleranza.
+    """
+    if DF_TRAIN is None or DF_TRAIN.empty:
+        raise ValueError("nessun dataset per il canary")
+    df = DF_TRAIN.sample(n=min(CANARY_ROWS, len(DF_TRAIN)), random_state=0)
+    rules = evaluate_rules(df)
+    expected = {'irrigation': rules['irrigation'], 'energy': rules['energy'],
+                'fertilization': rules['N'] | rules['P'] | rules['K']}
+    new = evaluate_ai(df, models)
+    current = evaluate_ai(df, AI_MODELS) if AI_MODELS is not None else None
+    report = {'rows': len(df)}
+    for key, _ in AI_TARGETS:
+        agreement = float((new[key] == expected[key]).mean())
+        baseline = float((current[key] == expected[key]).mean()) if current is not None else 0.0
+        report[key] = {'agreement': round(agreement, 4), 'current': round(baseline, 4)}
+        if agreement < baseline - CANARY_TOLERANCE:
+            raise ValueError(f"{key}: accordo con le regole {agreement:.3f} contro {baseline:.3f} dei modelli in uso")
+    return report
+
+def install_models(models):
+    """
+    Scambio atomico fra due batch: evaluate_ai legge AI_MODELS una volta per batch.
+    Chiamata solo da model_watcher (versioni del registro, rollback e re-fit), sotto il suo lock.
+    """
+    global AI_MODELS, MODEL_VERSION
+    previous, AI_MODELS = AI_MODELS, models
+    MODEL_VERSION += 1  # gli esiti in cache sono dei modelli precedenti
+    return previous
+
+# Registro dei modelli: nuove versioni caricate e validate in background, poi scambiate (rollback se
+# l'inferenza inizia a fallire subito dopo)
+model_watcher = ModelWatcher('analyzer', load_registry_models, validate_models, install_models,
+                             errors=lambda: AI_ERRORS)
+model_watcher.version = REGISTRY_VERSION
+
+def build_heartbeat(data, advice_ts, mode=MODE_FULL):
+    """Pacchetto leggero per una lettura invariata: l'advice con ts advice_ts resta valido."""
+    return {
+        'ts': data.get('ts', data.get('_ts', time.time())),
+        'sensor_id': data.get('sensor_id', 'sensor'),
+        'heartbeat': True,
+        'advice_ts': advice_ts,
+        'mode': mode
+    }
+
+def process_readings(readings, mode=MODE_FULL):
+    """
+    Valuta un gruppo di letture in un solo passaggio vettoriale e pubblica, in ordine,
+    un advice per ogni lettura cambiata e un heartbeat per quelle entro le dead-band.
+    """
+    global AI_ERRORS
+    cpu0 = time.thread_time()
+    # 0. Stato di tendenza per sensore: ogni lettura lo aggiorna, anche quelle che diventeranno heartbeat
+    #    (in LATEST_ONLY le letture scartate non arrivano qui)
+    with profiling.stage('analyzer.rolling'):
+        trends = rolling.update_readings(readings).tolist()
+    for data, row in zip(readings, trends):
+        data.update(zip(ROLLING_FEATURES, row))
 
-        # B. ELABORAZIONE DATI SENSORE 
-        if topic == 'sensor-data':
-            data = payload
-            
-            # 1. Applica Configurazioni (Se aggiornate dall'utente)
-            if SETTINGS_UPDATED:
-                rule_irr.m_thr = SYSTEM_CONFIG["moisture_threshold"]
-                rule_en.tmin_thr = SYSTEM_CONFIG["temp_min"]
-                rule_en.tmax_thr = SYSTEM_CONFIG["temp_max"]
-                rule_fert.n_thr = SYSTEM_CONFIG["n_threshold"]
-                rule_fert.p_thr = SYSTEM_CONFIG["p_threshold"]
-                rule_fert.k_thr = SYSTEM_CONFIG["k_threshold"]
-
-            # 2. Preparazione Dato
-            df_single = pd.DataFrame([data])
-            
-            # 3. Calcolo Regole (Rule Based)
-            res_rules = {
-                'irrigation': {
-                    'status': 'ON' if rule_irr.predict(df_single)[0] == 1 else 'OFF',
-                    'reason': f"Soglia attiva: < {rule_irr.m_thr}%"
-                },
-                'energy': {
-                    'status': 'ACTIVE' if rule_en.predict(df_single)[0] == 1 else 'OFF',
-                    'reason': f"Range attivo: {rule_en.tmin_thr}-{rule_en.tmax_thr}°C"
-                },
-                'fertilization': {
-                    'N': 'LOW' if data.get('Nitrogen_mg_kg',0) < rule_fert.n_thr else 'OK',
-                    'P': 'LOW' if data.get('Phosphorus_mg_kg',0) < rule_fert.p_thr else 'OK',
-                    'K': 'LOW' if data.get('Potassium_mg_kg',0) < rule_fert.k_thr else 'OK',
-                    'reason': f"Soglie NPK: {rule_fert.n_thr}/{rule_fert.p_thr}/{rule_fert.k_thr}"
-                }
-            }
-
-            # 4. Calcolo AI (Machine Learning)
-            res_ai = {'irrigation': {'status':'OFF'}, 'fertilization': {'N':'OK'}, 'energy': {'status':'OFF'}}
-            if pipe_irr:
+    # 1. Applica Configurazioni (Se aggiornate dall'utente)
+    if SETTINGS_UPDATED:
+        apply_config(SYSTEM_CONFIG)
+
+    # Nuove soglie o nuovi modelli (anche dal re-fit in background): nessun esito precedente è valido
+    version = (CONFIG_VERSION, MODEL_VERSION)
+    if version != advice_cache.version:
+        suppressor.invalidate()
+        advice_cache.ensure_version(version)
+
+    # 2. Letture da valutare (le altre riusano l'advice precedente del sensore)
+    compute, advice_ts = suppressor.classify(readings)
+    changed = [data for data, c in zip(readings, compute) if c]
+
+    rules, ai, thr = None, None, None
+    if changed:
+        # 3. Soglie di ogni lettura (sensore/campo + fase colturale)
+        with profiling.stage('analyzer.thresholds'):
+            thr = threshold_table.lookup_readings(changed)
+
+        # 4. Preparazione Dati
+        with profiling.stage('analyzer.dataframe'):
+            df = pd.DataFrame(changed)
+
+        # 5. Calcolo Regole (Rule Based): sempre sui valori esatti, vettoriale
+        with profiling.stage('analyzer.rules'):
+            rules = evaluate_rules(df, thr)
+
+        # 6. Calcolo AI (Machine Learning), saltato nelle modalità degradate. Predizioni già note per lo
+        #    stesso vettore quantizzato (cache condivisa fra i sensori), il modello solo per le altre
+        if mode == MODE_FULL and AI_MODELS is not None:
+            keys = advice_cache.keys_for(changed)
+            hit, packed = advice_cache.lookup(keys)
+            miss = np.flatnonzero(~hit)
+            if miss.size:
+                t0 = time.perf_counter()
                 try:
-                    # Fix per colonne mancanti nel df singolo
-                    cols_needed = FEATURES + ['Temp_min_C', 'Temp_max_C']
-                    df_ai = pd.DataFrame({k: [float(data.get(k, 0))] for k in cols_needed})
-                    
-                    p_irr = pipe_irr.handle(df_ai)["Irrigation_Predicted"].iloc[0]
-                    p_fert = pipe_fert.handle(df_ai)["Fertilization_Predicted"].iloc[0]
-                    p_en = pipe_en.handle(df_ai)["Energy_Predicted"].iloc[0]
-
-                    res_ai['irrigation'] = {'status': 'ON' if p_irr==1 else 'OFF', 'reason': 'AI (LogReg)'}
-                    res_ai['energy'] = {'status': 'ACTIVE' if p_en==1 else 'OFF', 'reason': 'AI (LogReg)'}
-                    res_ai['fertilization'] = {'N': 'CHECK' if p_fert==1 else 'OK', 'P':'OK', 'K':'OK', 'reason': 'AI (LogReg)'}
+                    with profiling.stage('analyzer.ai'):
+                        miss_ai = evaluate_ai(df.iloc[miss])
                 except Exception as e:
+                    AI_ERRORS += 1
+                    miss_ai = None
                     print(f"⚠️ Errore AI Inference: {e}")
+                if miss_ai is not None:
+                    packed[miss] = pack_ai(miss_ai)
+                    advice_cache.store([keys[i] for i in miss], packed[miss])
+                    advice_cache.record_cost(miss.size, time.perf_counter() - t0)
+                    hit[miss] = True
+            if hit.all():
+                ai = unpack_ai(packed)
+            if ONLINE_LEARNING:
+                with profiling.stage('analyzer.online_update'):
+                    online_update(df, rules)
+
+    # 7. Pubblicazione Risultati (System Advice), al topic che il server ascolta
+    per_row = thr is not None and threshold_table.overrides > 0
+    labels = ai_labels() if ai is not None else None
+    j = 0
+    for i, data in enumerate(readings):
+        with profiling.stage('analyzer.json_encode'):
+            if compute[i]:
+                row_thr = dict(zip(threshold_table.columns, thr[j].tolist())) if per_row else None
+                packet = build_advice_packet(data, rules, ai, j, SYSTEM_CONFIG, SETTINGS_UPDATED, mode, row_thr,
+                                             labels)
+                j += 1
+            else:
+                packet = build_heartbeat(data, float(advice_ts[i]), mode)
+            encoded = json.dumps(packet).encode('utf-8')
+        with profiling.stage('analyzer.publish'):
+            delivery.publish(bus, 'system-advice', encoded)
+    with profiling.stage('analyzer.publish'):
+        bus.flush()
+    suppressor.record_cost(len(changed), time.thread_time() - cpu0)
+
+def _consume_window(subscription, messages):
+    """LATEST_ONLY: continua a leggere per LATEST_WINDOW_S, così il filtro per sensore scarta di più."""
+    deadline = time.monotonic() + LATEST_WINDOW_S
+    while len(messages) < LATEST_MAX_BATCH:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        more = subscription.consume(CONSUME_BATCH, remaining)
+        if not more:
+            break
+        messages.extend(more)
+    return messages
+
+def _use_snapshot(snapshot):
+    global SYSTEM_CONFIG, SETTINGS_UPDATED, CONFIG_VERSION, threshold_table
+    SYSTEM_CONFIG = dict(snapshot.config)
+    SETTINGS_UPDATED = snapshot.settings_updated
+    CONFIG_VERSION = snapshot.config_version
+    threshold_table = snapshot.thresholds
+    if SETTINGS_UPDATED:
+        apply_config(SYSTEM_CONFIG)
+
+def adopt_snapshot(snapshot):
+    """
+    Confine di batch: adotta l'ultimo snapshot del piano di controllo (config, soglie, dead-band)
+    se diverso da quello in uso. Restituisce True se la configurazione è cambiata.
+    """
+    previous = control.applied
+    if snapshot is previous:
+        return False
+    _use_snapshot(snapshot)
+    if snapshot.dead_bands != previous.dead_bands:
+        suppressor.set_bands({**TREND_DEAD_BANDS, **snapshot.dead_bands})
+    if snapshot.invalidate is None:
+        suppressor.invalidate()
+    elif snapshot.invalidate:
+        suppressor.invalidate(snapshot.invalidate)
+    # Modelli AI addestrati sulle soglie precedenti: re-fit senza fermare il consumo
+    if SETTINGS_UPDATED and (not previous.settings_updated
+                             or any(previous.config.get(k) != snapshot.config.get(k) for k in THRESHOLD_KEYS)):
+        request_refit(SYSTEM_CONFIG)
+    control.acknowledge(snapshot)
+    checkpoints.mark_dirty()
+    return True
+
+def publish_metrics(controller):
+    metrics = {'service': 'analyzer', 'group': GROUP_ID, 'ts': time.time(), **controller.snapshot(),
+               'suppression': suppressor.snapshot(), 'advice_cache': advice_cache.snapshot(),
+               'thresholds': threshold_table.snapshot(), 'rolling': rolling.snapshot(),
+               'checkpoint': checkpoints.snapshot(), 'delivery': delivery.snapshot(), 'control': control.snapshot(),
+               'models': model_watcher.snapshot()}
+    bus.publish(METRICS_TOPIC, json.dumps(metrics).encode('utf-8'))
+
+def checkpoint_state():
+    """Stato da salvare con gli offset: configurazione utente e ultima lettura valutata per sensore."""
+    return {'control': control.applied, 'suppressor': suppressor, 'rolling': rolling}
+
+def restore_state(state):
+    global suppressor, rolling
+    snapshot = state.get('control')
+    if snapshot is None:  # checkpoint precedente al piano di controllo
+        snapshot = ConfigSnapshot(0, state['config'], state['settings_updated'], state['config_version'],
+                                  state.get('thresholds', threshold_table), state['config'].get('dead_bands'))
+    suppressor = state['suppressor']
+    rolling = state.get('rolling', rolling)
+    control.restore(snapshot)
+    _use_snapshot(snapshot)
+    if SETTINGS_UPDATED:
+        request_refit(SYSTEM_CONFIG)
+    # Modelli appena riaddestrati sullo stesso dataset: gli advice della tabella restano validi
+    advice_cache.ensure_version((CONFIG_VERSION, MODEL_VERSION))
+
+def main(stop_event=None, controller=None):
+    # Ripresa dall'ultimo checkpoint (stato + offset), poi ascolta i dati dei sensori; i comandi di
+    # configurazione arrivano dal piano di controllo, che non aspetta le letture in coda
+    state, offsets = checkpoints.load()
+    if state is not None:
+        restore_state(state)
+    checkpoints.offsets = {tp: o for tp, o in checkpoints.offsets.items() if tp[0] != CONTROL_TOPIC}
+    subscription = bus.subscribe(['sensor-data'], GROUP_ID, auto_commit=False, start_offsets=offsets)
+    control_stop = threading.Event()
+    control.start(bus, CONTROL_GROUP_ID, control_stop)
+    model_watcher.start(bus, MODELS_GROUP_ID, control_stop)
+
+    # Profiling: GREENFIELD_PROFILE=1 all'avvio, SIGUSR1 (timer) / SIGUSR2 (campionamento) a runtime
+    if profiling.PROFILE_ENABLED_AT_START:
+        profiling.enable()
+    profiling.install_signal_handlers()
+
+    # Degradazione adattiva: FULL -> RULES_ONLY -> LATEST_ONLY in base a lag ed età delle letture
+    controller = controller or DegradationController()
+    last_metrics = 0.0
+    
+    print("🟢 ANALYZER: In ascolto sul bus...")
+
+    while stop_event is None or not stop_event.is_set():
+        # Confine di batch: eventuale nuova configurazione dal piano di controllo
+        adopt_snapshot(control.current)
+        messages = subscription.consume(CONSUME_BATCH, 0.1)
+        if messages and controller.mode == MODE_LATEST_ONLY:
+            messages = _consume_window(subscription, messages)
+
+        pending = []  # letture del batch, valutate insieme
+        for msg in messages:
+            with profiling.stage('analyzer.json_decode'):
+                payload = json.loads(msg.value.decode('utf-8'))
+
+            # A. DATI SENSORE (evento grezzo o riassunto di finestra del producer)
+            if is_window(payload):
+                payload = window_to_reading(payload)
+                if payload is None:  # ultima lettura della finestra già arrivata grezza
+                    continue
+            pending.append(payload)
+
+        newest_age = reading_age(pending[-1]) if pending else None
+        if pending:
+            t0 = time.perf_counter()
+            mode = controller.mode
+            readings = latest_per_sensor(pending) if mode == MODE_LATEST_ONLY else pending
+            process_readings(readings, mode)
+            controller.record(len(pending), time.perf_counter() - t0, shed=len(pending) - len(readings))
+        checkpoints.track(messages)
+        checkpoints.maybe_commit(subscription, checkpoint_state, delivery)
+
+        # B. Lag e modalità per il prossimo giro, metriche periodiche o al cambio di modalità
+        transitions = controller.transitions
+        controller.observe(subscription.lag(), newest_age)
+        now = time.monotonic()
+        if controller.transitions != transitions:
+            suppressor.invalidate()  # gli advice in tabella sono stati calcolati in un'altra modalità
+        if controller.transitions != transitions or now - last_metrics >= METRICS_INTERVAL_S:
+            publish_metrics(controller)
+            last_metrics = now
 
-            # 5. Pubblicazione Risultato (System Advice)
-            advice_packet = {
-                'ts': data.get('ts', time.time()),
-                'rules': res_rules,
-                'ai': res_ai,
-                'config': SYSTEM_CONFIG,
-                'settings_updated': SETTINGS_UPDATED
-            }
-            
-            # Invia al topic che il server ascolta
-            producer.produce('system-advice', json.dumps(advice_packet).encode('utf-8'))
-            producer.flush()
+    control_stop.set()
+    control.join()
+    model_watcher.join()
+    bus.flush()
+    checkpoints.maybe_commit(subscription, checkpoint_state, delivery, force=True)
+    subscription.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,100 @@
+"""
+Latenza e throughput dei trasporti del message bus (inproc, local, kafka).
+
+    python -m benchmarks.bench_bus --messages 20000
+    python -m benchmarks.bench_bus --backends local,kafka --rate 1000
+"""
+import argparse
+import json
+import struct
+import threading
+import time
+import uuid
+import numpy as np
+
+from message_bus import InProcessBus, LocalBus, KafkaBus
+
+PAYLOAD_BYTES = 700  # dimensione tipica di un pacchetto system-advice
+
+
+def make_bus(name):
+    if name == 'inproc':
+        return InProcessBus()
+    if name == 'local':
+        return LocalBus()
+    return KafkaBus()
+
+
+def run(name, n_messages, rate):
+    bus = make_bus(name)
+    topic = f"bench-{uuid.uuid4().hex[:8]}"
+    sub = bus.subscribe([topic], f"bench-{name}")
+    if name == 'kafka':
+        # Attende l'assegnazione delle partizioni prima di misurare
+        deadline = time.time() + 30
+        while True:
+            bus.publish(topic, struct.pack('!d', 0.0))
+            bus.flush(5)
+            if sub.poll(1.0) is not None:
+                break
+            if time.time() > deadline:
+                raise RuntimeError("Kafka non raggiungibile")
+
+    latencies = np.empty(n_messages)
+    received = 0
+
+    def consumer():
+        nonlocal received
+        while received < n_messages:
+            msg = sub.poll(2.0)
+            if msg is None:
+                break
+            (sent,) = struct.unpack_from('!d', msg.value)
+            if sent == 0.0:
+                continue
+            latencies[received] = time.perf_counter() - sent
+            received += 1
+
+    t = threading.Thread(target=consumer)
+    t.start()
+    pad = b"x" * (PAYLOAD_BYTES - 8)
+    interval = 1.0 / rate if rate else 0.0
+    t0 = time.perf_counter()
+    for _ in range(n_messages):
+        bus.publish(topic, struct.pack('!d', time.perf_counter()) + pad)
+        if interval:
+            time.sleep(interval)
+    bus.flush()
+    t.join()
+    elapsed = time.perf_counter() - t0
+    sub.close()
+    bus.close()
+
+    lat = latencies[:received] * 1e3
+    return {'sent': n_messages, 'received': received, 'msgs_per_s': round(received / elapsed, 1),
+            'latency_ms': {'p50': float(np.percentile(lat, 50)), 'p99': float(np.percentile(lat, 99)),
+                           'max': float(lat.max())} if received else None}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', default="inproc,local,kafka")
+    parser.add_argument('--messages', type=int, default=20_000)
+    parser.add_argument('--rate', type=float, default=0, help="messaggi/s (0 = massima velocità)")
+    parser.add_argument('--json')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.backends.split(','):
+        try:
+            results[name] = run(name, args.messages, args.rate)
+        except Exception as e:
+            results[name] = {'error': f"{type(e).__name__}: {e}"}
+        print(name, json.dumps(results[name]))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
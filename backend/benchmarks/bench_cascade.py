@@ -0,0 +1,128 @@
+"""
+Cascata di visione contro il solo classificatore completo, sulla validazione di PlantVillage
+(stesso split del training). Per ogni immagine si misurano decodifica, triage e modello completo
+una volta sola; le soglie si confrontano poi a parità di predizioni: latenza media, accuratezza,
+quota chiusa dal triage e accuratezza persa. Infine un passaggio reale di CascadeVisionStrategy
+con le soglie di default conferma la stima.
+
+    python -m benchmarks.bench_cascade --limit 2000 --thresholds 0.7,0.8,0.9,0.95
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import strategies_vision
+from strategies_vision import (TF_AVAILABLE, TRIAGE_CONFIDENCE, TRIAGE_NOISE_CONFIDENCE, CascadeVisionStrategy,
+                               DeepLearningVisionStrategy)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_PATH = os.path.join(BACKEND_DIR, "greenfield_agri_brain.h5")
+LABELS_PATH = os.path.join(BACKEND_DIR, "class_indices.json")
+TRIAGE_PATH = os.path.join(BACKEND_DIR, strategies_vision.TRIAGE_MODEL_PATH)
+TRIAGE_LABELS = os.path.join(BACKEND_DIR, strategies_vision.TRIAGE_LABELS_PATH)
+DATASET_DIR = os.path.join(BACKEND_DIR, "PlantVillage")
+
+
+def validation_images(limit):
+    """(percorso, nome classe) della validazione, campione casuale ma ripetibile."""
+    from train_agri_model import list_image_files  # importa TensorFlow: solo dopo i controlli
+    class_indices, _, (files, labels) = list_image_files(DATASET_DIR)
+    names = {idx: name for name, idx in class_indices.items()}
+    pairs = [(f, names[label]) for f, label in zip(files, labels)]
+    random.Random(42).shuffle(pairs)
+    return pairs[:limit] if limit else pairs
+
+
+def measure(cascade, images):
+    """Tempi e predizioni per immagine: decodifica, triage, completo."""
+    rows = []
+    for path, truth in images:
+        t0 = time.perf_counter()
+        img = cascade.full.load_image(path)
+        t1 = time.perf_counter()
+        triage = cascade.triage_scores(img)
+        t2 = time.perf_counter()
+        full_idx, _ = cascade.full.predict_image(img)
+        t3 = time.perf_counter()
+        top = int(np.argmax(triage))
+        rows.append({'truth': truth, 'full': cascade.labels_map.get(int(full_idx)), 'triage_top': top,
+                     'triage_conf': float(triage[top]), 'decode_ms': (t1 - t0) * 1000,
+                     'triage_ms': (t2 - t1) * 1000, 'full_ms': (t3 - t2) * 1000})
+    return rows
+
+
+def simulate(cascade, rows, confidence, noise_confidence):
+    """Esito della cascata con le soglie date, dalle misure di measure()."""
+    noise = strategies_vision.TRIAGE_NOISE_CLASS
+    latency, correct, triaged = [], 0, 0
+    for r in rows:
+        idx = cascade.to_full[r['triage_top']]
+        name = cascade.labels_map.get(idx) if idx is not None else None
+        threshold = noise_confidence if name == noise else confidence
+        if name is not None and r['triage_conf'] >= threshold:
+            triaged += 1
+            latency.append(r['decode_ms'] + r['triage_ms'])
+            correct += name == r['truth']
+        else:
+            latency.append(r['decode_ms'] + r['triage_ms'] + r['full_ms'])
+            correct += r['full'] == r['truth']
+    return {'confidence': confidence, 'noise_confidence': noise_confidence,
+            'latency_ms_avg': round(float(np.mean(latency)), 2),
+            'latency_ms_p99': round(float(np.percentile(latency, 99)), 2),
+            'accuracy': round(correct / len(rows), 4), 'triaged_pct': round(100.0 * triaged / len(rows), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--limit', type=int, default=2000, help="immagini di validazione (0 = tutte)")
+    parser.add_argument('--thresholds', default='0.6,0.7,0.8,0.9,0.95,0.99',
+                        help="soglie di confidenza del triage per le classi sane")
+    parser.add_argument('--json')
+    args = parser.parse_args()
+
+    if not TF_AVAILABLE or not os.path.exists(MODEL_PATH):
+        print("❌ Servono TensorFlow e greenfield_agri_brain.h5 per misurare il modello di visione.")
+        sys.exit(1)
+    if not os.path.exists(TRIAGE_PATH):
+        print("❌ Modello di triage assente: python train_agri_model.py --triage")
+        sys.exit(1)
+    if not os.path.isdir(DATASET_DIR):
+        print(f"❌ Dataset {DATASET_DIR} non trovato.")
+        sys.exit(1)
+
+    images = validation_images(args.limit)
+    cascade = CascadeVisionStrategy(DeepLearningVisionStrategy(MODEL_PATH, LABELS_PATH), TRIAGE_PATH, TRIAGE_LABELS)
+    cascade.warm_up()
+    rows = measure(cascade, images)
+
+    full_latency = [r['decode_ms'] + r['full_ms'] for r in rows]
+    baseline = {'latency_ms_avg': round(float(np.mean(full_latency)), 2),
+                'latency_ms_p99': round(float(np.percentile(full_latency, 99)), 2),
+                'accuracy': round(float(np.mean([r['full'] == r['truth'] for r in rows])), 4)}
+    runs = []
+    for threshold in (float(t) for t in args.thresholds.split(',')):
+        run = simulate(cascade, rows, threshold, min(threshold, TRIAGE_NOISE_CONFIDENCE))
+        run['latency_reduction_pct'] = round(100.0 * (1 - run['latency_ms_avg'] / baseline['latency_ms_avg']), 1)
+        run['accuracy_loss'] = round(baseline['accuracy'] - run['accuracy'], 4)
+        runs.append(run)
+
+    # Passaggio reale con le soglie di default (decodifica compresa, come nel gateway)
+    t0 = time.perf_counter()
+    live_correct = sum(cascade.labels_map.get(int(cascade.analyze(path)[0])) == truth for path, truth in images)
+    live = {'confidence': TRIAGE_CONFIDENCE, 'noise_confidence': TRIAGE_NOISE_CONFIDENCE,
+            'latency_ms_avg': round((time.perf_counter() - t0) * 1000 / len(images), 2),
+            'accuracy': round(live_correct / len(images), 4), **cascade.stats()}
+
+    result = {'images': len(rows), 'full_only': baseline, 'cascade': runs, 'cascade_default_live': live}
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
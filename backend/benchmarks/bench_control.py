@@ -0,0 +1,108 @@
+"""
+Latenza impostazione -> effetto con l'analyzer saturo: backlog di letture sul bus in-process,
+poi una serie di system-settings a intervalli regolari. Per ogni modifica si misura quando il
+percorso dati la adotta (piano di controllo) e quando sarebbe arrivata con il vecchio consumer
+unico, in coda alle letture già pubblicate (l'offset dei dati supera la posizione della modifica).
+
+    python -m benchmarks.bench_control --backlog 50000 --changes 5 --gap 0.5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+
+os.environ.setdefault("GREENFIELD_BUS", "inproc")
+
+import numpy as np
+import analyzer
+from benchmarks.synthetic import generate_sensor_events
+from checkpoint import CheckpointManager
+from control_plane import SENT_TS_KEY
+from degradation import DegradationController
+from message_bus import InProcessBus
+
+
+def wait_for(condition, timeout, interval=0.001):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def run(backlog, changes, gap, sensors, degrade, timeout):
+    events = [json.dumps(e).encode('utf-8') for e in generate_sensor_events(backlog, n_sensors=sensors)]
+    bus = InProcessBus(retention=4 * backlog + 1000)
+    analyzer.bus = bus
+    analyzer.checkpoints = CheckpointManager('analyzer', directory=None)
+    # Iscrizioni prima di pubblicare: l'analyzer parte dal primo evento
+    bus.subscribe(['sensor-data'], analyzer.GROUP_ID)
+    bus.subscribe(['system-settings'], analyzer.CONTROL_GROUP_ID)
+    for value in events:
+        bus.publish('sensor-data', value)
+
+    # Soglie infinite: l'analyzer resta in FULL e smaltisce il backlog alla sua velocità massima
+    controller = None if degrade else DegradationController((float('inf'),) * 2, (float('inf'),) * 2)
+    stop = threading.Event()
+    worker = threading.Thread(target=analyzer.main, args=(stop, controller), daemon=True)
+    data_offset = lambda: analyzer.checkpoints.offsets.get(('sensor-data', 0), 0)
+
+    rows = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        worker.start()
+        wait_for(lambda: data_offset() > 0, timeout)
+        for k in range(changes):
+            threshold = 30.0 + k
+            position = len(events)  # letture pubblicate prima della modifica
+            sent = time.monotonic()
+            bus.publish('system-settings', json.dumps({'moisture_threshold': threshold,
+                                                       SENT_TS_KEY: time.time()}).encode('utf-8'))
+            applied = wait_for(lambda: analyzer.SYSTEM_CONFIG.get('moisture_threshold') == threshold, timeout)
+            effect = time.monotonic() - sent
+            rows.append({'change': k, 'sent': sent, 'position': position, 'applied': applied,
+                         'control_ms': round(effect * 1000, 2), 'backlog_at_change': position - data_offset()})
+            time.sleep(max(0.0, gap - effect))
+
+        # Vecchio percorso: la modifica sarebbe stata letta solo dopo tutte le letture precedenti
+        for row in rows:
+            drained = wait_for(lambda: data_offset() >= row['position'], timeout)
+            row['in_band_ms'] = round((time.monotonic() - row['sent']) * 1000, 2) if drained else None
+        stop.set()
+        worker.join()
+
+    control_ms = [r['control_ms'] for r in rows]
+    in_band_ms = [r['in_band_ms'] for r in rows if r['in_band_ms'] is not None]
+    return {
+        'backlog': backlog, 'sensors': sensors, 'changes': changes, 'degrade': degrade,
+        'control_ms_p50': round(float(np.median(control_ms)), 2), 'control_ms_max': max(control_ms),
+        'in_band_ms_p50': round(float(np.median(in_band_ms)), 2) if in_band_ms else None,
+        'in_band_ms_max': max(in_band_ms) if in_band_ms else None,
+        'control_plane': analyzer.control.snapshot(),
+        'changes_detail': [{k: v for k, v in r.items() if k != 'sent'} for r in rows],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backlog', type=int, default=50_000, help="letture in coda prima delle modifiche")
+    parser.add_argument('--changes', type=int, default=5)
+    parser.add_argument('--gap', type=float, default=0.5, help="secondi fra una modifica e la successiva")
+    parser.add_argument('--sensors', type=int, default=1000)
+    parser.add_argument('--degrade', action='store_true', help="degradazione attiva (di default resta in FULL)")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--json')
+    args = parser.parse_args()
+
+    result = run(args.backlog, args.changes, args.gap, args.sensors, args.degrade, args.timeout)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
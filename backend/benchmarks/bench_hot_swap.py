@@ -0,0 +1,193 @@
+"""
+Cambio di modello a caldo sotto carico: l'analyzer consuma un flusso costante di letture dal bus
+in-process e a metà del flusso viene pubblicata nel registro una nuova versione dei modelli AI.
+Si misurano i tempi dello scambio (caricamento, canary, installazione), le letture senza advice
+(devono essere zero) e la latenza lettura -> advice prima, durante e dopo lo scambio.
+Con --vision (servono TensorFlow e il modello .h5) lo stesso per il pool di repliche del gateway.
+
+    python -m benchmarks.bench_hot_swap --rate 2000 --seconds 10 --strategy sgd
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+REGISTRY = tempfile.mkdtemp(prefix='greenfield-registry-')
+os.environ.setdefault("GREENFIELD_BUS", "inproc")
+os.environ["GREENFIELD_MODEL_REGISTRY"] = REGISTRY
+
+import numpy as np
+import analyzer
+import model_registry
+from benchmarks.synthetic import generate_sensor_events
+from checkpoint import CheckpointManager
+from degradation import DegradationController
+from message_bus import InProcessBus
+
+
+def percentiles(samples):
+    if not samples:
+        return {'n': 0}
+    values = np.array(samples)
+    return {'n': len(values), 'p50_ms': round(float(np.percentile(values, 50)), 2),
+            'p99_ms': round(float(np.percentile(values, 99)), 2), 'max_ms': round(float(values.max()), 2)}
+
+
+def export_models(strategy, path):
+    """Nuova versione dei modelli AI con un'altra strategia, addestrata sulle stesse etichette (regole in uso)."""
+    previous = analyzer.AI_STRATEGY
+    analyzer.AI_STRATEGY = strategy
+    rules = {'irrigation': analyzer.rule_irr, 'fertilization': analyzer.rule_fert, 'energy': analyzer.rule_en}
+    try:
+        models = analyzer.train_ai_models(analyzer.DF_TRAIN, rules)
+    finally:
+        analyzer.AI_STRATEGY = previous
+    model_registry.save_analyzer_models({key: m[0] for key, m in models.items()}, analyzer.AI_FEATURES, path)
+
+
+def run_analyzer(rate, seconds, sensors, strategy):
+    artifact = os.path.join(REGISTRY, 'models.pkl')
+    export_models(strategy, artifact)
+    events = generate_sensor_events(int(rate * seconds), n_sensors=sensors)
+
+    bus = InProcessBus(retention=2 * len(events) + 1000)
+    analyzer.bus = bus
+    analyzer.checkpoints = CheckpointManager('analyzer', directory=None)
+    advice = bus.subscribe(['system-advice'], 'bench-advice')
+    controller = DegradationController((float('inf'),) * 2, (float('inf'),) * 2)
+    stop = threading.Event()
+    worker = threading.Thread(target=analyzer.main, args=(stop, controller), daemon=True)
+
+    received = []  # (istante di ricezione, latenza ms)
+    def collect():
+        while not stop.is_set() or advice.lag():
+            for msg in advice.consume(1000, 0.1):
+                now = time.time()
+                received.append((now, (now - json.loads(msg.value)['ts']) * 1000))
+    collector = threading.Thread(target=collect, daemon=True)
+
+    swap = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        worker.start()
+        collector.start()
+        time.sleep(0.5)
+        interval = 1.0 / rate
+        t0 = time.time()
+        for i, event in enumerate(events):
+            target = t0 + i * interval
+            delay = target - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if i == len(events) // 2:
+                swap['published'] = time.time()
+                model_registry.publish('analyzer', {'models': artifact}, bus=bus)
+            event['_ts'] = time.time()
+            bus.publish('sensor-data', json.dumps(event).encode('utf-8'))
+        deadline = time.time() + 30
+        while len(received) < len(events) and time.time() < deadline:
+            time.sleep(0.05)
+        stop.set()
+        worker.join()
+        collector.join()
+
+    watcher = analyzer.model_watcher.snapshot()
+    load_ms, canary_ms = watcher['load_ms_last'] or 0.0, watcher['canary_ms_last'] or 0.0
+    swapped = swap['published'] + (load_ms + canary_ms) / 1000 + 0.5  # + notifica e primo batch sui modelli nuovi
+    windows = {'before': [], 'during': [], 'after': []}
+    for ts, latency in received:
+        key = 'before' if ts < swap['published'] else 'during' if ts < swapped else 'after'
+        windows[key].append(latency)
+    return {
+        'readings': len(events), 'advice': len(received), 'missing': len(events) - len(received),
+        'rate': rate, 'strategy': strategy, 'swapped_to': watcher['version'], 'swaps': watcher['swaps'],
+        'load_ms': load_ms, 'canary_ms': canary_ms, 'install_ms': watcher['install_ms_max'],
+        'canary': watcher['last_canary'], 'rejected': watcher['last_error'],
+        'latency': {key: percentiles(values) for key, values in windows.items()},
+    }
+
+
+def run_vision(clients, seconds, replicas):
+    from strategies_vision import TF_AVAILABLE
+    from vision_pool import VisionWorkerPool
+    model, labels = 'greenfield_agri_brain.h5', 'class_indices.json'
+    if not TF_AVAILABLE or not os.path.exists(model):
+        return {'skipped': "servono TensorFlow e greenfield_agri_brain.h5"}
+    images = model_registry.canary_images(limit=32)
+    payloads = [open(path, 'rb').read() for path in images]
+    pool = VisionWorkerPool(model, labels, replicas=replicas).start()
+    pool.wait_ready()
+    watcher = model_registry.ModelWatcher(
+        'vision', lambda m: pool.stage(model_registry.artifact(m, 'model'), model_registry.artifact(m, 'labels'),
+                                       m['version'], images[:model_registry.CANARY_IMAGES]),
+        lambda g: model_registry.check_vision_canary(pool.canary_results(g), g.labels_map),
+        pool.install, discard=pool.discard, errors=lambda: pool.failed)
+
+    stop = threading.Event()
+    samples, errors = [], []
+    def client(k):
+        i = k
+        while not stop.is_set():
+            t0 = time.time()
+            try:
+                pool.analyze_bytes(payloads[i % len(payloads)])
+                samples.append((t0, (time.time() - t0) * 1000))
+            except Exception as e:
+                errors.append(repr(e))
+            i += clients
+    threads = [threading.Thread(target=client, args=(k,), daemon=True) for k in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds / 2)
+    published = time.time()
+    model_registry.publish('vision', {'model': model, 'labels': labels}, bus=InProcessBus())
+    watcher.check()
+    swapped = time.time()
+    time.sleep(seconds / 2)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    pool.close()
+
+    windows = {'before': [], 'during': [], 'after': []}
+    for ts, latency in samples:
+        key = 'before' if ts < published else 'during' if ts < swapped else 'after'
+        windows[key].append(latency)
+    snapshot = watcher.snapshot()
+    return {'replicas': replicas, 'clients': clients, 'requests': len(samples), 'errors': len(errors),
+            'load_ms': snapshot['load_ms_last'], 'canary_ms': snapshot['canary_ms_last'],
+            'install_ms': snapshot['install_ms_max'], 'canary': snapshot['last_canary'],
+            'latency': {key: percentiles(values) for key, values in windows.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=float, default=2000, help="letture al secondo")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--sensors', type=int, default=1000)
+    parser.add_argument('--strategy', default='sgd', choices=('logreg', 'sgd', 'gbt', 'rf'),
+                        help="strategia della nuova versione dei modelli AI")
+    parser.add_argument('--vision', action='store_true', help="anche il pool di repliche di visione")
+    parser.add_argument('--replicas', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--json')
+    args = parser.parse_args()
+
+    try:
+        result = {'analyzer': run_analyzer(args.rate, args.seconds, args.sensors, args.strategy)}
+        if args.vision:
+            result['vision'] = run_vision(args.clients, args.seconds, args.replicas)
+    finally:
+        shutil.rmtree(REGISTRY, ignore_errors=True)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
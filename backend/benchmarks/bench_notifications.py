@@ -0,0 +1,135 @@
+"""
+Benchmark del notification consumer contro il server SMTP locale (debug_server.py).
+
+    python -m benchmarks.bench_notifications --keys 5000 --messages 20
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import smtplib
+import socket
+import time
+
+from aiosmtpd.controller import Controller
+from debug_server import DebugHandler
+import notification_consumer as nc
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def synthetic_advice(n_keys, n_messages, flip_prob=0.15, seed=42):
+    """Pacchetti 'system-advice' interlacciati per n_keys sensori con stati che cambiano a caso."""
+    rng = random.Random(seed)
+    state = [[False] * 5 for _ in range(n_keys)]
+    packets = []
+    for step in range(n_messages):
+        for k in range(n_keys):
+            s = state[k]
+            for f in range(5):
+                if rng.random() < flip_prob:
+                    s[f] = not s[f]
+            packets.append({
+                'ts': 1_700_000_000 + step * 5,
+                'sensor_id': f"field-{k:05d}",
+                'rules': {
+                    'irrigation': {'status': 'ON' if s[0] else 'OFF'},
+                    'energy': {'status': 'ACTIVE' if s[1] else 'OFF'},
+                    'fertilization': {'N': 'LOW' if s[2] else 'OK', 'P': 'LOW' if s[3] else 'OK',
+                                      'K': 'LOW' if s[4] else 'OK'},
+                },
+                'config': {'email': f"agronomo{k % 20}@greenfield.it"},
+            })
+    return packets
+
+
+def bench_state_machines(packets, batch_size):
+    table = nc.AlertStateTable()
+    reports = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        for i in range(0, len(packets), batch_size):
+            reports.extend(table.process_batch(packets[i:i + batch_size]))
+        elapsed = time.perf_counter() - t0
+    return table, reports, elapsed
+
+
+def state_bytes(table):
+    return sum(getattr(table, name).nbytes for name in
+               ('last', 'countdown', 'reasons', 'hist_mask', 'hist_ts', 'hist_count'))
+
+
+def bench_delivery(reports, port, pool_size, window_s):
+    dispatcher = nc.MailDispatcher(host='localhost', port=port, pool_size=pool_size, window_s=window_s)
+    t0 = time.perf_counter()
+    for rep in reports:
+        dispatcher.submit(rep)
+    dispatcher.close()
+    return dispatcher, time.perf_counter() - t0
+
+
+def bench_legacy_delivery(reports, port):
+    """Comportamento precedente: una connessione SMTP nuova per ogni report, in linea."""
+    t0 = time.perf_counter()
+    for rep in reports:
+        msg = nc.build_email(rep.recipient, [rep]).as_string()
+        server = smtplib.SMTP('localhost', port)
+        server.sendmail(nc.SENDER_EMAIL, rep.recipient, msg)
+        server.quit()
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=20, help="messaggi per chiave")
+    parser.add_argument('--batch', type=int, default=nc.CONSUME_BATCH)
+    parser.add_argument('--pool-size', type=int, default=nc.SMTP_POOL_SIZE)
+    parser.add_argument('--window', type=float, default=0.5)
+    parser.add_argument('--legacy-sample', type=int, default=500)
+    parser.add_argument('--json', help="salva i risultati in questo file")
+    args = parser.parse_args()
+
+    packets = synthetic_advice(args.keys, args.messages)
+    table, reports, t_sm = bench_state_machines(packets, args.batch)
+
+    handler = DebugHandler(quiet=True)
+    port = free_port()
+    controller = Controller(handler, hostname='localhost', port=port)
+    controller.start()
+    try:
+        dispatcher, t_pool = bench_delivery(reports, port, args.pool_size, args.window)
+        emails_pooled = handler.received
+        sample = reports[:args.legacy_sample]
+        t_legacy = bench_legacy_delivery(sample, port) if sample else 0.0
+    finally:
+        controller.stop()
+
+    results = {
+        'keys': len(table),
+        'messages': len(packets),
+        'state_machine_msgs_per_s': round(len(packets) / t_sm, 1),
+        'state_table_bytes': state_bytes(table),
+        'reports': len(reports),
+        'pooled': {
+            'emails_sent': dispatcher.sent, 'emails_received': emails_pooled, 'failed': dispatcher.failed,
+            'elapsed_s': round(t_pool, 3), 'reports_per_s': round(len(reports) / t_pool, 1),
+        },
+        'legacy_per_report_connection': {
+            'reports': len(sample), 'elapsed_s': round(t_legacy, 3),
+            'reports_per_s': round(len(sample) / t_legacy, 1) if t_legacy else None,
+        },
+    }
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
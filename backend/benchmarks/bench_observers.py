@@ -0,0 +1,94 @@
+"""
+Confronto memoria/throughput tra l'AdvisorObserver riga-per-riga (storico in lista
+di dict) e il percorso a blocchi con storico circolare colonnare.
+
+    python -m benchmarks.bench_observers --rows 1000000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from data_loader import load_dataset_robust
+from observers import SensorDataSource, AdvisorObserver, Observer
+from pipeline import DataCleaner, FeatureEngineer, ModelEstimator
+from strategies_model import LogisticRegressionStrategy
+
+
+class LegacyAdvisorObserver(Observer):
+    """Implementazione precedente: DataFrame di una riga e storico illimitato in lista."""
+    def __init__(self, pipeline, target_name):
+        self.pipeline = pipeline
+        self.target_name = target_name
+        self.history = []
+
+    def update(self, row):
+        result = self.pipeline.handle(pd.DataFrame([row]))
+        self.history.append(result.iloc[0].to_dict())
+
+    def get_history_df(self):
+        return pd.DataFrame(self.history)
+
+
+def build_pipeline(target='Irrigation'):
+    prep = DataCleaner(FeatureEngineer())
+    df_train = prep.handle(load_dataset_robust("dataset/enriched_tomato_irrigation_dataset.csv"))
+    df_test = load_dataset_robust("dataset/data_test.csv")
+    features = [c for c in df_train.columns if c in prep.handle(df_test.head()).columns
+                and c not in ['Irrigation', 'Fertilization', 'Energy', 'Crop_stage', 'Precipitation_mm']]
+    strategy = LogisticRegressionStrategy(max_iter=2000)
+    strategy.train(df_train[features], df_train[target])
+    return DataCleaner(FeatureEngineer(ModelEstimator(strategy, features, target))), df_test
+
+
+def run(make_observer, df, batch_size):
+    """Un passaggio cronometrato e uno (separato) sotto tracemalloc per il picco di memoria."""
+    source = SensorDataSource()
+    source.attach(make_observer())
+    t0 = time.perf_counter()
+    source.stream(df, limit=None, batch_size=batch_size)
+    elapsed = time.perf_counter() - t0
+
+    observer = make_observer()
+    source = SensorDataSource()
+    source.attach(observer)
+    tracemalloc.start()
+    source.stream(df, limit=None, batch_size=batch_size)
+    hist = observer.get_history_df()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'rows': len(df), 'elapsed_s': round(elapsed, 3), 'rows_per_s': round(len(df) / elapsed, 1),
+            'peak_mb': round(peak / 2**20, 1), 'history_rows': len(hist)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--legacy-rows', type=int, default=2_000, help="il percorso legacy è ~ms/riga")
+    parser.add_argument('--batch', type=int, default=10_000)
+    parser.add_argument('--capacity', type=int, default=100_000)
+    parser.add_argument('--json')
+    args = parser.parse_args()
+
+    pipeline, df_test = build_pipeline()
+    reps = int(np.ceil(args.rows / len(df_test)))
+    df_big = pd.concat([df_test] * reps, ignore_index=True).iloc[:args.rows]
+
+    legacy = run(lambda: LegacyAdvisorObserver(pipeline, 'Irrigation'), df_big.iloc[:args.legacy_rows], 1)
+    legacy['extrapolated_s_for_all_rows'] = round(legacy['elapsed_s'] * args.rows / legacy['rows'], 1)
+    legacy['extrapolated_peak_mb_for_all_rows'] = round(legacy['peak_mb'] * args.rows / legacy['rows'], 1)
+    batched = run(lambda: AdvisorObserver(pipeline, 'Irrigation', history_capacity=args.capacity, verbose=False),
+                  df_big, args.batch)
+
+    results = {'legacy_row_by_row': legacy, 'batched_ring_buffer': batched,
+               'batch_size': args.batch, 'history_capacity': args.capacity}
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
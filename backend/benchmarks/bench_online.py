@@ -0,0 +1,112 @@
+"""
+Apprendimento online (SGDLogisticStrategy.partial_fit) contro LogisticRegression
+addestrata a batch sulle stesse etichette delle regole: costo per batch,
+convergenza e tempo di riallineamento dopo un cambio di soglie.
+
+    python -m benchmarks.bench_online --rows 200000 --batch 500
+"""
+import argparse
+import json
+import time
+import numpy as np
+
+from benchmarks.synthetic import generate_sensor_frame
+from pipeline import DataCleaner, FeatureEngineer
+from strategies_model import LogisticRegressionStrategy, RuleBasedStrategy, SGDLogisticStrategy
+
+FEATURES = ['Soil_moisture_pct', 'Temperature_C', 'Humidity_pct',
+            'Nitrogen_mg_kg', 'Phosphorus_mg_kg', 'Potassium_mg_kg', 'pH']
+TARGETS = ('Irrigation', 'Fertilization', 'Energy')
+NEW_THRESHOLDS = {'Irrigation': {'m_thr': 50.0}, 'Fertilization': {'n_thr': 60.0, 'p_thr': 25.0, 'k_thr': 90.0},
+                  'Energy': {'tmin_thr': 16.0, 'tmax_thr': 30.0}}
+
+
+def rule_labels(df, target, overrides=None):
+    rule = RuleBasedStrategy(target)
+    for attr, value in (overrides or {}).items():
+        setattr(rule, attr, value)
+    return np.asarray(rule.predict(df))
+
+
+def accuracy(strategy, X, y):
+    return round(float((strategy.predict(X, FEATURES) == y).mean()), 4)
+
+
+def bench_target(df_train, df_test, target, batch, checkpoints):
+    X_train, X_test = df_train[FEATURES], df_test[FEATURES]
+    y_train, y_test = rule_labels(df_train, target), rule_labels(df_test, target)
+
+    # Riferimento: LogisticRegression addestrata sull'intero set
+    logreg = LogisticRegressionStrategy(max_iter=500)
+    t0 = time.perf_counter()
+    logreg.train(X_train, y_train)
+    logreg_fit_s = time.perf_counter() - t0
+    logreg_pred = logreg.predict(X_test, FEATURES)
+
+    # Online: un solo passaggio sullo stream, un partial_fit per batch
+    online = SGDLogisticStrategy()
+    costs, curve = [], []
+    n_batches = int(np.ceil(len(X_train) / batch))
+    marks = set(np.unique(np.geomspace(1, n_batches, checkpoints).astype(int)))
+    for b in range(n_batches):
+        sl = slice(b * batch, (b + 1) * batch)
+        t0 = time.perf_counter()
+        online.partial_fit(X_train.iloc[sl], y_train[sl])
+        costs.append(time.perf_counter() - t0)
+        if b + 1 in marks:
+            pred = online.predict(X_test, FEATURES)
+            curve.append({'batches': b + 1, 'rows': min((b + 1) * batch, len(X_train)),
+                          'accuracy': round(float((pred == y_test).mean()), 4),
+                          'agreement_with_logreg': round(float((pred == logreg_pred).mean()), 4)})
+
+    # Cambio soglie: LogReg da zero contro warm start SGD (come il re-fit dell'analyzer)
+    y_train2 = rule_labels(df_train, target, NEW_THRESHOLDS[target])
+    y_test2 = rule_labels(df_test, target, NEW_THRESHOLDS[target])
+    logreg2 = LogisticRegressionStrategy(max_iter=500)
+    t0 = time.perf_counter()
+    logreg2.train(X_train, y_train2)
+    logreg_refit_s = time.perf_counter() - t0
+    sgd2 = online.clone()
+    t0 = time.perf_counter()
+    sgd2.fit_epochs(X_train, y_train2, 3)
+    sgd_refit_s = time.perf_counter() - t0
+
+    costs_ms = np.array(costs) * 1000
+    return {
+        'logreg': {'fit_s': round(logreg_fit_s, 3), 'accuracy': accuracy(logreg, X_test, y_test)},
+        'online': {'batch_size': batch, 'batches': n_batches,
+                   'partial_fit_ms_p50': round(float(np.median(costs_ms)), 3),
+                   'partial_fit_ms_p99': round(float(np.percentile(costs_ms, 99)), 3),
+                   'final_accuracy': curve[-1]['accuracy'], 'convergence': curve},
+        'threshold_change': {'logreg_refit_s': round(logreg_refit_s, 3),
+                             'logreg_accuracy': accuracy(logreg2, X_test, y_test2),
+                             'stale_logreg_accuracy': accuracy(logreg, X_test, y_test2),
+                             'sgd_warm_refit_s': round(sgd_refit_s, 3),
+                             'sgd_accuracy': accuracy(sgd2, X_test, y_test2)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--checkpoints', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json')
+    args = parser.parse_args()
+
+    prep = DataCleaner(FeatureEngineer())
+    df = prep.handle(generate_sensor_frame(args.rows, seed=args.seed)).fillna(0).reset_index(drop=True)
+    split = int(len(df) * 0.8)
+    df_train, df_test = df.iloc[:split], df.iloc[split:]
+
+    results = {'rows': len(df), 'targets': {t: bench_target(df_train, df_test, t, args.batch, args.checkpoints)
+                                            for t in TARGETS}}
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
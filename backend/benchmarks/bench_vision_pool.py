@@ -0,0 +1,118 @@
+"""
+Throughput della diagnosi da immagine al crescere delle repliche del modello: richieste
+concorrenti (client in thread, come le richieste Flask) contro il modello nel processo
+del gateway e contro VisionWorkerPool con 1, 2, 4 repliche. Per il modello nel gateway
+si misura anche la prima richiesta a freddo (senza warm-up).
+
+    python -m benchmarks.bench_vision_pool --replicas 1,2,4 --requests 200 --clients 8
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from strategies_vision import TF_AVAILABLE, DeepLearningVisionStrategy
+from vision_pool import VisionWorkerPool
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_PATH = os.path.join(BACKEND_DIR, "greenfield_agri_brain.h5")
+LABELS_PATH = os.path.join(BACKEND_DIR, "class_indices.json")
+
+
+def load_images(pattern):
+    images = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def drive(analyze, images, requests, clients):
+    """Esegue 'requests' analisi con 'clients' thread: req/s e percentili di latenza."""
+    def one(i):
+        t0 = time.perf_counter()
+        analyze(images[i % len(images)])
+        return (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(clients) as ex:
+        latency = list(ex.map(one, range(requests)))
+    elapsed = time.perf_counter() - t0
+    return {
+        'req_s': round(requests / elapsed, 1),
+        'latency_ms_p50': round(float(np.percentile(latency, 50)), 1),
+        'latency_ms_p99': round(float(np.percentile(latency, 99)), 1),
+    }
+
+
+def run_in_process(images, requests, clients):
+    import io
+    t0 = time.perf_counter()
+    strategy = DeepLearningVisionStrategy(MODEL_PATH, LABELS_PATH)
+    load_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    strategy.analyze(io.BytesIO(images[0]))
+    cold_ms = (time.perf_counter() - t0) * 1000
+    result = drive(lambda data: strategy.analyze(io.BytesIO(data)), images, requests, clients)
+    return {'replicas': 0, 'load_ms': round(load_ms, 1), 'first_request_ms': round(cold_ms, 1), **result}
+
+
+def run_pool(replicas, images, requests, clients):
+    t0 = time.perf_counter()
+    pool = VisionWorkerPool(MODEL_PATH, LABELS_PATH, replicas=replicas, max_inflight=max(clients, replicas)).start()
+    try:
+        ready = pool.wait_ready()
+        ready_ms = (time.perf_counter() - t0) * 1000
+        if ready < replicas:
+            return {'replicas': replicas, 'error': f"{ready}/{replicas} repliche pronte"}
+        t0 = time.perf_counter()
+        pool.analyze_bytes(images[0])
+        first_ms = (time.perf_counter() - t0) * 1000
+        result = drive(pool.analyze_bytes, images, requests, clients)
+        health = pool.health()
+    finally:
+        pool.close()
+    return {'replicas': replicas, 'ready_ms': round(ready_ms, 1), 'first_request_ms': round(first_ms, 1),
+            'warmup_ms': [r['warmup_ms'] for r in health['replicas']],
+            'served': [r['served'] for r in health['replicas']], **result}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replicas', default='1,2,4', help="numeri di repliche da provare")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=8, help="richieste concorrenti")
+    parser.add_argument('--images', default=os.path.join(BACKEND_DIR, 'testvisivo', '*'))
+    parser.add_argument('--json')
+    args = parser.parse_args()
+
+    if not TF_AVAILABLE or not os.path.exists(MODEL_PATH):
+        print("❌ Servono TensorFlow e greenfield_agri_brain.h5 per misurare il modello di visione.")
+        sys.exit(1)
+    images = load_images(args.images)
+    if not images:
+        print(f"❌ Nessuna immagine in {args.images}")
+        sys.exit(1)
+
+    rows = [run_in_process(images, args.requests, args.clients)]
+    for replicas in (int(n) for n in args.replicas.split(',')):
+        rows.append(run_pool(replicas, images, args.requests, args.clients))
+    baseline = rows[0]['req_s']
+    for row in rows:
+        if 'req_s' in row:
+            row['speedup'] = round(row['req_s'] / baseline, 2)
+
+    result = {'cpus': os.cpu_count(), 'requests': args.requests, 'clients': args.clients,
+              'images': len(images), 'runs': rows}
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
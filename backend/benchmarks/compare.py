@@ -0,0 +1,55 @@
+"""
+Confronta due file di risultati della suite e segnala le regressioni.
+
+    python -m benchmarks.compare benchmarks/results/abc1234.json benchmarks/results/def5678.json --threshold 0.10
+"""
+import argparse
+import json
+import sys
+
+
+def flatten(results, prefix=""):
+    """{nome: {median_s: ...}} annidati -> {'nome.sotto': median_s}"""
+    out = {}
+    for name, res in results.items():
+        if not isinstance(res, dict):
+            continue
+        if 'median_s' in res:
+            out[prefix + name] = res['median_s']
+        else:
+            out.update(flatten({k: v for k, v in res.items() if isinstance(v, dict)}, prefix + name + "."))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10, help="variazione relativa considerata regressione")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f: base = json.load(f)
+    with open(args.candidate) as f: cand = json.load(f)
+    a, b = flatten(base['results']), flatten(cand['results'])
+
+    print(f"{'BENCHMARK':<32} | {base['commit']:>12} | {cand['commit']:>12} | {'DELTA':>8}")
+    print("-" * 74)
+    regressions = []
+    for name in sorted(set(a) & set(b)):
+        delta = (b[name] - a[name]) / a[name] if a[name] else 0.0
+        flag = ""
+        if delta > args.threshold:
+            flag = "  ⚠️ REGRESSIONE"
+            regressions.append(name)
+        elif delta < -args.threshold:
+            flag = "  🚀"
+        print(f"{name:<32} | {a[name]*1e3:>10.2f}ms | {b[name]*1e3:>10.2f}ms | {delta:>+7.1%}{flag}")
+
+    for name in sorted(set(a) ^ set(b)):
+        print(f"{name:<32} | presente solo in {'baseline' if name in a else 'candidate'}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Suite di benchmark riproducibile per tutti gli stadi del backend.
+I risultati vengono salvati in benchmarks/results/<commit>.json e confrontati con compare.py.
+
+    python -m benchmarks.run_benchmarks --rows 100000
+    python -m benchmarks.run_benchmarks --only rules,logreg --repeat 7
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# I servizi importati dalla suite usano il bus in-process (nessun broker richiesto)
+os.environ.setdefault("GREENFIELD_BUS", "inproc")
+
+from benchmarks.synthetic import generate_sensor_frame, generate_sensor_events, write_synthetic_csv
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+FEATURES = ['Soil_moisture_pct', 'Temperature_C', 'Humidity_pct',
+            'Nitrogen_mg_kg', 'Phosphorus_mg_kg', 'Potassium_mg_kg', 'pH']
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def measure(fn, repeat, items):
+    """Esegue fn() 'repeat' volte (più un warm-up) e restituisce statistiche di tempo."""
+    fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    median = statistics.median(times)
+    return {'items': items, 'repeat': repeat, 'median_s': median, 'min_s': min(times),
+            'max_s': max(times), 'items_per_s': items / median if median > 0 else None}
+
+
+@benchmark("load_dataset_robust")
+def bench_load(ctx):
+    path = os.path.join(ctx['tmp'], "synthetic.csv")
+    write_synthetic_csv(path, ctx['rows'], seed=ctx['seed'])
+    from data_loader import load_dataset_robust
+    with contextlib.redirect_stdout(io.StringIO()):
+        return measure(lambda: load_dataset_robust(path), ctx['repeat'], ctx['rows'])
+
+
+@benchmark("cleaner_feature_engineer")
+def bench_prep(ctx):
+    from pipeline import DataCleaner, FeatureEngineer
+    pipe = DataCleaner(FeatureEngineer())
+    df = ctx['df']
+    return measure(lambda: pipe.handle(df), ctx['repeat'], len(df))
+
+
+@benchmark("rules_predict")
+def bench_rules(ctx):
+    from strategies_model import RuleBasedStrategy
+    rules = [RuleBasedStrategy(t) for t in ('Irrigation', 'Fertilization', 'Energy')]
+    df = ctx['df']
+    return measure(lambda: [r.predict(df) for r in rules], ctx['repeat'], len(df))
+
+
+@benchmark("logreg_predict")
+def bench_logreg(ctx):
+    from strategies_model import LogisticRegressionStrategy, RuleBasedStrategy
+    df = ctx['df']
+    train = df.iloc[:min(len(df), 5000)]
+    strat = LogisticRegressionStrategy(max_iter=500)
+    strat.train(train[FEATURES], RuleBasedStrategy('Irrigation').predict(train))
+    return measure(lambda: strat.predict(df, FEATURES), ctx['repeat'], len(df))
+
+
+@benchmark("vision_analyze")
+def bench_vision(ctx):
+    from strategies_vision import TF_AVAILABLE
+    model_path, json_path, img_dir = "greenfield_agri_brain.h5", "class_indices.json", "testvisivo"
+    if not TF_AVAILABLE or not os.path.exists(model_path):
+        return {'skipped': "TensorFlow o greenfield_agri_brain.h5 non disponibili"}
+    from strategies_vision import DeepLearningVisionStrategy
+    with contextlib.redirect_stdout(io.StringIO()):
+        strat = DeepLearningVisionStrategy(model_path, json_path)
+    images = sorted(os.path.join(img_dir, f) for f in os.listdir(img_dir) if f.endswith('.jpg'))[:8]
+    return measure(lambda: [strat.analyze(p) for p in images], ctx['repeat'], len(images))
+
+
+@benchmark("json_codec")
+def bench_json(ctx):
+    import analyzer
+    events = ctx['events']
+    df = pd.DataFrame(events)
+    rules, ai = analyzer.evaluate_rules(df), analyzer.evaluate_ai(df)
+    packets = [analyzer.build_advice_packet(e, rules, ai, i) for i, e in enumerate(events)]
+    encoded = [json.dumps(p).encode('utf-8') for p in packets]
+    enc = measure(lambda: [json.dumps(p).encode('utf-8') for p in packets], ctx['repeat'], len(packets))
+    dec = measure(lambda: [json.loads(b.decode('utf-8')) for b in encoded], ctx['repeat'], len(encoded))
+    return {'encode': enc, 'decode': dec, 'avg_packet_bytes': sum(map(len, encoded)) / len(encoded)}
+
+
+@benchmark("change_suppression")
+def bench_suppression(ctx):
+    """Dead-band sulle righe reali del dataset (in ordine, un solo sensore): quota di heartbeat e costo del filtro."""
+    from data_loader import load_dataset_robust
+    from suppression import ChangeSuppressor
+    path = "dataset/enriched_tomato_irrigation_dataset.csv"
+    if not os.path.exists(path):
+        return {'skipped': f"{path} non disponibile"}
+    with contextlib.redirect_stdout(io.StringIO()):
+        records = load_dataset_robust(path).to_dict('records')
+
+    def run():
+        suppressor = ChangeSuppressor(max_suppress_s=float('inf'))
+        suppressor.classify(records, now=0.0)
+        return suppressor
+    result = measure(run, ctx['repeat'], len(records))
+    result['suppression_ratio'] = run().snapshot()['suppression_ratio']
+    return result
+
+
+@benchmark("threshold_table")
+def bench_thresholds(ctx):
+    """Tabella soglie con 100k chiavi (sensore, fase): patch massiva, patch singola e ricerca di un batch."""
+    from thresholds import ThresholdTable
+    stages = ['Initial Stage', 'Development Stage', 'Mid stage', 'Last stage']
+    n_keys = 100_000
+    entries = [{'sensor_id': f"field-{i:06d}", 'crop_stage': stages[i % 4], 'moisture_threshold': 30 + i % 30}
+               for i in range(n_keys)]
+    rng = np.random.default_rng(ctx['seed'])
+    batch = [{'sensor_id': f"field-{i:06d}", 'Crop_stage': stages[i % 4]} for i in rng.integers(0, n_keys, 500)]
+    defaults = {'moisture_threshold': 60.0, 'temp_min': 15.0, 'temp_max': 30.0,
+                'n_threshold': 50.0, 'p_threshold': 30.0, 'k_threshold': 100.0}
+
+    table = ThresholdTable(defaults)
+    result = {'bulk_patch': measure(lambda: table.patch(entries), ctx['repeat'], n_keys)}
+    result['single_patch'] = measure(lambda: table.patch([{'sensor_id': "field-000042", 'n_threshold': 70}]),
+                                     ctx['repeat'], 1)
+    result['lookup_batch'] = measure(lambda: table.lookup_readings(batch), ctx['repeat'], len(batch))
+    return result
+
+
+@benchmark("rolling_features")
+def bench_rolling(ctx):
+    """Aggiornamento delle feature di tendenza: batch da 500 letture su 100k sensori già attivi."""
+    from rolling_features import RollingFeatureStore
+    n_sensors, batch = 100_000, 500
+    rng = np.random.default_rng(ctx['seed'])
+    ids = [f"field-{i:06d}" for i in range(n_sensors)]
+    store = RollingFeatureStore()
+    for _ in range(3):
+        store.update(ids, rng.uniform(0, 100, n_sensors), rng.uniform(0, 8, n_sensors), rng.uniform(10, 35, n_sensors))
+    sample = [ids[i] for i in rng.integers(0, n_sensors, batch)]
+    values = (rng.uniform(0, 100, batch), rng.uniform(0, 8, batch), rng.uniform(10, 35, batch))
+    result = measure(lambda: store.update(sample, *values), ctx['repeat'] * 20, batch)
+    result['us_per_reading'] = result['median_s'] / batch * 1e6
+    result['memory_bytes'] = store.memory_bytes()
+    result['bytes_per_sensor'] = store.memory_bytes() / len(store)
+    return result
+
+
+@benchmark("water_balance")
+def bench_water_balance(ctx):
+    """Bilancio idrico FAO-56 su 10k campi x 14 giorni: simulazione e calendario completo per campo."""
+    from water_balance import simulate, plan_readings
+    n_fields, days = 10_000, 14
+    rng = np.random.default_rng(ctx['seed'])
+    moisture, kc = rng.uniform(20, 70, n_fields), rng.uniform(0.4, 1.5, n_fields)
+    et0 = rng.uniform(0, 9, (n_fields, days))
+    rain = np.where(rng.random((n_fields, days)) < 0.2, rng.uniform(0, 30, (n_fields, days)), 0.0)
+    root, thresholds = rng.uniform(0.25, 1.0, n_fields), rng.uniform(30, 65, n_fields)
+    readings = [{'sensor_id': f"field-{i:05d}", 'Crop_stage': 'Mid stage', 'Soil_moisture_pct': moisture[i],
+                 'Reference_ET_mm': et0[i, 0], 'Crop_Coefficient': kc[i]} for i in range(n_fields)]
+    result = {'simulate': measure(lambda: simulate(moisture, et0, kc, root, thresholds, days, rain),
+                                  ctx['repeat'], n_fields * days)}
+    result['plan'] = measure(lambda: plan_readings(readings, thresholds, days), ctx['repeat'], n_fields * days)
+    return result
+
+
+@benchmark("latest_state")
+def bench_latest_state(ctx):
+    """Vista dell'ultimo stato con 50k sensori (lettura + advice): aggiornamento, snapshot completo e delta."""
+    from latest_state import LatestStateView
+    n_sensors = 50_000
+    events = generate_sensor_events(n_sensors, n_sensors=n_sensors, seed=ctx['seed'])
+    raws = [(e['sensor_id'], json.dumps(e).encode('utf-8')) for e in events]
+    advice = json.dumps({'rules': {'irrigation': {'status': 'OK', 'reason': '-'}}, 'ts': 0.0}).encode('utf-8')
+    view = LatestStateView()
+
+    def fill():
+        for sensor_id, raw in raws:
+            view.update_reading(sensor_id, raw)
+            view.update_advice(sensor_id, advice)
+
+    result = {'update': measure(fill, ctx['repeat'], 2 * n_sensors)}
+    result['snapshot_build'] = measure(lambda: view.delta(None), ctx['repeat'], n_sensors)
+    result['snapshot_cached'] = measure(view.snapshot, ctx['repeat'] * 100, 1)
+    since = view.version - 2000  # due versioni per sensore (lettura + advice): gli ultimi 1000 sensori
+    result['delta_1k'] = measure(lambda: view.delta(since), ctx['repeat'] * 10, 1000)
+    body = view.delta(None)[1]
+    result['snapshot_bytes'] = len(body)
+    result['bytes_per_sensor'] = len(body) / n_sensors
+    return result
+
+
+@benchmark("analyzer_end_to_end")
+def bench_analyzer(ctx):
+    """Throughput di analyzer.main sul bus in-process (nessun Kafka, nessuno sleep), sempre in modalità FULL."""
+    import threading
+    import analyzer
+    from checkpoint import CheckpointManager
+    from degradation import DegradationController
+    from message_bus import InProcessBus
+
+    events = [json.dumps(e).encode('utf-8') for e in ctx['events'][:ctx['e2e_events']]]
+
+    def run_once():
+        bus = InProcessBus()
+        saved, analyzer.bus = analyzer.bus, bus
+        # Nessun file di checkpoint: ogni corsa riparte da zero su un bus nuovo
+        analyzer.checkpoints = CheckpointManager('analyzer', directory=None)
+        # Iscrizione del gruppo dell'analyzer prima di pubblicare, così parte dal primo evento
+        bus.subscribe(['sensor-data'], analyzer.GROUP_ID)
+        advice = bus.subscribe(['system-advice'], 'bench')
+        for e in events:
+            bus.publish('sensor-data', e)
+
+        stop = threading.Event()
+        # Soglie infinite: il backlog iniziale non deve attivare la degradazione
+        full_only = DegradationController((float('inf'),) * 2, (float('inf'),) * 2)
+        worker = threading.Thread(target=analyzer.main, args=(stop, full_only), daemon=True)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                worker.start()
+                received = 0
+                while received < len(events):
+                    batch = advice.consume(1000, timeout=30)
+                    if not batch:
+                        raise RuntimeError(f"advice ricevuti {received}/{len(events)}")
+                    received += len(batch)
+        finally:
+            stop.set()
+            worker.join()
+            analyzer.bus = saved
+
+    return measure(run_once, max(1, ctx['repeat'] // 2), len(events))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GreenField benchmark suite")
+    parser.add_argument('--rows', type=int, default=100_000, help="righe sintetiche per i microbenchmark")
+    parser.add_argument('--e2e-events', type=int, default=2_000, help="messaggi per il test end-to-end")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', help="lista di benchmark separati da virgola")
+    parser.add_argument('--output', help="file JSON (default: benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    selected = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"benchmark sconosciuti: {', '.join(sorted(unknown))}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = generate_sensor_frame(args.rows, seed=args.seed)
+        events = generate_sensor_events(max(args.e2e_events, 1000), seed=args.seed)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': time.time(),
+        'params': vars(args),
+        'environment': {
+            'python': sys.version.split()[0], 'platform': platform.platform(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'cpu_count': os.cpu_count(),
+        },
+        'results': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = {'rows': args.rows, 'repeat': args.repeat, 'seed': args.seed, 'df': df,
+               'events': events, 'e2e_events': args.e2e_events, 'tmp': tmp}
+        for name in selected:
+            print(f"⏱️  {name} ...", flush=True)
+            try:
+                res = BENCHMARKS[name](ctx)
+            except Exception as e:
+                res = {'error': f"{type(e).__name__}: {e}"}
+            report['results'][name] = res
+            print(f"   {json.dumps(res, default=float)}")
+
+    out = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2, default=float)
+    print(f"✅ Risultati salvati in {out}")
+
+
+if __name__ == "__main__":
+    main()
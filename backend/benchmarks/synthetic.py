@@ -0,0 +1,54 @@
+import time
+import numpy as np
+import pandas as pd
+
+from data_loader import load_dataset_robust
+
+SOURCE_CSV = "dataset/data_test.csv"
+JITTER = 0.05  # rumore gaussiano relativo alla deviazione standard di ogni colonna
+
+_source_cache = {}
+
+
+def _source(path):
+    if path not in _source_cache:
+        _source_cache[path] = load_dataset_robust(path)
+    return _source_cache[path]
+
+
+def generate_sensor_frame(n_rows, seed=0, source=SOURCE_CSV):
+    """
+    DataFrame sintetico di n_rows righe con le stesse distribuzioni di data_test.csv:
+    bootstrap delle righe reali (mantiene le correlazioni e le etichette SI/NO)
+    più rumore gaussiano sulle colonne numeriche, limitato al range osservato.
+    """
+    base = _source(source)
+    rng = np.random.default_rng(seed)
+    df = base.iloc[rng.integers(0, len(base), n_rows)].reset_index(drop=True)
+
+    for col in base.select_dtypes(include='number').columns:
+        lo, hi, std = base[col].min(), base[col].max(), base[col].std()
+        values = df[col].to_numpy(dtype=float) + rng.normal(0.0, JITTER * std, n_rows)
+        values = np.clip(values, lo, hi)
+        if pd.api.types.is_integer_dtype(base[col]):
+            values = np.round(values).astype(base[col].dtype)
+        df[col] = values
+    return df
+
+
+def generate_sensor_events(n_events, n_sensors=100, seed=0, source=SOURCE_CSV):
+    """Eventi 'sensor-data' (dict) come quelli di producer_sensor, distribuiti su n_sensors."""
+    df = generate_sensor_frame(n_events, seed, source)
+    events = df.to_dict('records')
+    t0 = time.time()
+    for i, event in enumerate(events):
+        event["_event_type"] = "sensor_reading"
+        event["_row_id"] = i
+        event["_ts"] = t0 + i * 0.01
+        event["sensor_id"] = f"field-{i % n_sensors:05d}"
+    return events
+
+
+def write_synthetic_csv(path, n_rows, seed=0, source=SOURCE_CSV):
+    generate_sensor_frame(n_rows, seed, source).to_csv(path, sep=';', index=False)
+    return path
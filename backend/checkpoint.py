@@ -0,0 +1,166 @@
+import collections
+import os
+import pickle
+import threading
+import time
+import numpy as np
+
+# Checkpoint dello stato in memoria + offset (GREENFIELD_CHECKPOINT_DIR vuoto = solo commit degli offset)
+CHECKPOINT_DIR = os.environ.get("GREENFIELD_CHECKPOINT_DIR", "checkpoints") or None
+COMMIT_INTERVAL_S = float(os.environ.get("GREENFIELD_COMMIT_INTERVAL_S", 2.0))
+COMMIT_MAX_MESSAGES = int(os.environ.get("GREENFIELD_COMMIT_MAX_MESSAGES", 20_000))
+DELIVERY_MAX_RETRIES = 3
+CHECKPOINT_FORMAT = 1
+
+
+class DeliveryTracker:
+    """
+    Pubblicazioni in attesa di conferma dal bus (callback on_delivery). Un messaggio
+    rifiutato viene ripubblicato fino a max_retries volte; oltre, i commit si fermano
+    e al riavvio il servizio riparte dall'ultimo checkpoint e rielabora le letture.
+    """
+    def __init__(self, max_retries=DELIVERY_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.outstanding = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def publish(self, bus, topic, value, key=None, attempt=0):
+        with self._lock:
+            self.outstanding += 1
+        bus.publish(topic, value, key, on_delivery=lambda err: self._done(err, bus, topic, value, key, attempt))
+
+    def _done(self, err, bus, topic, value, key, attempt):
+        with self._lock:
+            self.outstanding -= 1
+            if err is None:
+                self.delivered += 1
+                return
+            if attempt < self.max_retries:
+                self.retried += 1
+            else:
+                self.failed += 1
+        if attempt < self.max_retries:
+            self.publish(bus, topic, value, key, attempt + 1)
+        else:
+            print(f"❌ Consegna su {topic} fallita dopo {attempt + 1} tentativi ({err}): commit sospesi")
+
+    def settled(self):
+        """True se tutto ciò che è stato pubblicato è confermato (e nulla è andato perso)."""
+        return self.outstanding == 0 and self.failed == 0
+
+    def snapshot(self):
+        return {'outstanding': self.outstanding, 'delivered': self.delivered,
+                'retried': self.retried, 'failed': self.failed}
+
+
+class CheckpointManager:
+    """
+    Commit manuali a lotti: ogni interval_s (o ogni max_messages) scrive in modo atomico
+    lo stato del servizio insieme agli offset già elaborati, poi li committa sul bus.
+    Al riavvio load() restituisce lo stato e gli offset da cui riprendere, così nessuna
+    lettura viene saltata; quelle successive all'ultimo checkpoint vengono rielaborate.
+    """
+    def __init__(self, name, interval_s=COMMIT_INTERVAL_S, max_messages=COMMIT_MAX_MESSAGES,
+                 directory=CHECKPOINT_DIR):
+        self.name = name
+        self.path = os.path.join(directory, f"{name}.ckpt") if directory else None
+        self.interval_s = interval_s
+        self.max_messages = max_messages
+
+        self.offsets = {}       # (topic, partizione) -> prossimo offset da leggere
+        self.uncommitted = 0    # messaggi elaborati dopo l'ultimo commit
+        self.last_commit = time.monotonic()
+
+        self.commits = 0
+        self.deferred = 0       # commit rimandati per consegne non ancora confermate
+        self.commit_s = 0.0
+        self.max_uncommitted = 0
+        self.checkpoint_bytes = 0
+        self.durations = collections.deque(maxlen=1000)
+
+    def load(self):
+        """(stato, offset) dell'ultimo checkpoint, oppure (None, {}) al primo avvio."""
+        if self.path is None or not os.path.exists(self.path):
+            return None, {}
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Checkpoint {self.path} illeggibile ({e}): si riparte dagli offset del gruppo")
+            return None, {}
+        if data.get('format') != CHECKPOINT_FORMAT:
+            print(f"⚠️ Checkpoint {self.path} in un formato diverso: ignorato")
+            return None, {}
+        self.offsets = dict(data['offsets'])
+        age = time.time() - data['ts']
+        print(f"♻️ {self.name}: ripresa dal checkpoint di {age:.0f}s fa ({len(self.offsets)} partizioni)")
+        return data['state'], dict(self.offsets)
+
+    def track(self, messages):
+        """Registra i messaggi il cui effetto è ormai incluso nello stato in memoria."""
+        for msg in messages:
+            self.offsets[(msg.topic, msg.partition)] = msg.offset + 1
+        self.uncommitted += len(messages)
+
+    def mark_dirty(self):
+        """Stato cambiato senza nuovi messaggi sul topic dei dati (es. configurazione dal piano di controllo)."""
+        self.uncommitted = max(self.uncommitted, 1)
+
+    def due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.uncommitted > 0 and (self.uncommitted >= self.max_messages
+                                         or now - self.last_commit >= self.interval_s)
+
+    def maybe_commit(self, subscription, get_state, delivery=None, force=False):
+        """Checkpoint + commit se è il momento e le consegne del servizio sono tutte confermate."""
+        if not (self.due() or (force and self.uncommitted)):
+            return False
+        if delivery is not None and not delivery.settled():
+            self.deferred += 1
+            return False
+        self.commit(subscription, get_state())
+        return True
+
+    def commit(self, subscription, state):
+        t0 = time.perf_counter()
+        self.save(state)
+        subscription.commit(dict(self.offsets))
+        elapsed = time.perf_counter() - t0
+
+        self.commits += 1
+        self.commit_s += elapsed
+        self.durations.append(elapsed)
+        self.max_uncommitted = max(self.max_uncommitted, self.uncommitted)
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def save(self, state):
+        """Scrittura atomica: file temporaneo + fsync + rename, mai un checkpoint a metà."""
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = pickle.dumps({'format': CHECKPOINT_FORMAT, 'ts': time.time(),
+                             'offsets': dict(self.offsets), 'state': state}, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.checkpoint_bytes = len(data)
+
+    def snapshot(self):
+        ms = np.array(self.durations) * 1000
+        return {
+            'commits': self.commits,
+            'deferred': self.deferred,
+            'uncommitted': self.uncommitted,
+            'max_uncommitted': self.max_uncommitted,
+            'commit_ms_p50': round(float(np.median(ms)), 3) if len(ms) else None,
+            'commit_ms_p99': round(float(np.percentile(ms, 99)), 3) if len(ms) else None,
+            'commit_s_total': round(self.commit_s, 3),
+            'checkpoint_bytes': self.checkpoint_bytes,
+        }
@@ -0,0 +1,192 @@
+import collections
+import json
+import threading
+import time
+import types
+import numpy as np
+from thresholds import ANY, validate_settings
+
+# Piano di controllo: system-settings su un consumer e un thread dedicati, mai in coda alle letture
+CONTROL_TOPIC = 'system-settings'
+CONTROL_BATCH = 200          # messaggi di controllo letti insieme e uniti in un solo snapshot
+CONTROL_POLL_S = 0.05
+SENT_TS_KEY = '_sent_ts'     # istante di invio dal gateway: latenza impostazione -> effetto
+LATENCY_SAMPLES = 1000
+_FROZEN = ('config', 'dead_bands', 'offsets')
+
+
+class ConfigSnapshot:
+    """
+    Configurazione completa vista dal percorso dati, mai modificata dopo la pubblicazione:
+    ogni gruppo di messaggi di controllo produce un nuovo snapshot (con una copia della
+    tabella soglie) che sostituisce il precedente con un solo assegnamento.
+    invalidate: sensori da ricalcolare rispetto all'ultimo snapshot applicato (None = tutti).
+    offsets: posizione sul topic di controllo a cui lo snapshot corrisponde.
+    """
+    def __init__(self, version, config, settings_updated, config_version, thresholds, dead_bands=None,
+                 invalidate=frozenset(), offsets=None, pending_since=None, sent_ts=None):
+        self.version = version
+        self.config = types.MappingProxyType(dict(config))
+        self.settings_updated = settings_updated
+        self.config_version = config_version
+        self.thresholds = thresholds
+        self.dead_bands = types.MappingProxyType(dict(dead_bands or {}))
+        self.invalidate = invalidate
+        self.offsets = types.MappingProxyType(dict(offsets or {}))
+        self.pending_since = pending_since  # ricezione (monotonic) del primo messaggio non ancora applicato
+        self.sent_ts = sent_ts              # invio dal gateway (wall clock) del primo messaggio non applicato
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update({key: dict(state[key]) for key in _FROZEN})
+        state['pending_since'] = state['sent_ts'] = None  # nessuna attesa da misurare dopo un riavvio
+        return state
+
+    def __setstate__(self, state):
+        state.update({key: types.MappingProxyType(state[key]) for key in _FROZEN})
+        self.__dict__.update(state)
+
+
+class ControlPlane:
+    """
+    Consumer dedicato a system-settings in un thread proprio: anche con migliaia di letture
+    in coda, una nuova configurazione diventa effettiva al confine del batch successivo.
+    Il percorso dati legge 'current' una volta per batch e conferma con acknowledge();
+    gli offset del topic di controllo vengono committati solo dopo la conferma.
+    """
+    def __init__(self, snapshot, batch=CONTROL_BATCH, poll_s=CONTROL_POLL_S):
+        self.current = snapshot
+        self.applied = snapshot
+        self.batch = batch
+        self.poll_s = poll_s
+        self._touched = []   # (versione, sensori | None) delle patch non ancora applicate
+        self._committed = snapshot.version
+        self._thread = None
+
+        self.messages = 0
+        self.rejected = 0
+        self.snapshots = 0
+        self.build_s = 0.0
+        self.effect_ms = collections.deque(maxlen=LATENCY_SAMPLES)      # ricezione -> effetto
+        self.end_to_end_ms = collections.deque(maxlen=LATENCY_SAMPLES)  # invio dal gateway -> effetto
+
+    def restore(self, snapshot):
+        """Snapshot del checkpoint, già applicato dal percorso dati (da chiamare prima di start)."""
+        self.current = self.applied = snapshot
+        self._committed = snapshot.version
+
+    def start(self, bus, group_id, stop_event):
+        self._thread = threading.Thread(target=self.run, args=(bus, group_id, stop_event),
+                                        name='control-plane', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self, bus, group_id, stop_event):
+        subscription = bus.subscribe([CONTROL_TOPIC], group_id, auto_commit=False,
+                                     start_offsets=dict(self.current.offsets))
+        while not stop_event.is_set():
+            messages = subscription.consume(self.batch, self.poll_s)
+            if messages:
+                self.current = self.build(self.current, messages)
+            applied = self.applied
+            if applied.version > self._committed and applied.offsets:
+                subscription.commit(dict(applied.offsets))
+                self._committed = applied.version
+        subscription.close()
+
+    def _touch(self, version, sensors):
+        self._touched.append((version, sensors))
+
+    def build(self, base, messages):
+        """Nuovo snapshot da 'base' più un gruppo di messaggi system-settings (al più una copia della tabella)."""
+        t0 = time.perf_counter()
+        version = base.version + 1
+        config, dead_bands, offsets = dict(base.config), dict(base.dead_bands), dict(base.offsets)
+        settings_updated, config_version = base.settings_updated, base.config_version
+        table = None
+        sent = []
+
+        for msg in messages:
+            offsets[(msg.topic, msg.partition)] = msg.offset + 1
+            # Un messaggio non valido si salta (offset avanzato): il thread non deve mai fermarsi
+            try:
+                payload = json.loads(msg.value.decode('utf-8'))
+                validate_settings(payload)
+                sent_ts = payload.pop(SENT_TS_KEY, None)
+                if sent_ts is not None:
+                    sent_ts = float(sent_ts)
+            except (ValueError, TypeError) as e:
+                self.rejected += 1
+                print(f"⚠️ Messaggio di controllo non valido ({e}): ignorato")
+                continue
+            if sent_ts is not None:
+                sent.append(sent_ts)
+
+            # Override per sensore/fase: ricalcolo forzato solo per i sensori coinvolti
+            entries = payload.pop('thresholds', None)
+            if entries:
+                table = table or base.thresholds.copy()
+                sensors = table.patch(entries)
+                self._touch(version, None if ANY in sensors else frozenset(sensors))
+                print(f"⚙️ RICEVUTE {len(entries)} SOGLIE PER SENSORE/FASE ({len(table)} chiavi)")
+            if not payload:
+                continue
+            print(f"⚙️ RICEVUTO AGGIORNAMENTO CONFIG: {payload}")
+            config.update(payload)
+            settings_updated = True
+            config_version += 1  # invalida la cache degli esiti
+            if 'dead_bands' in payload:
+                dead_bands = dict(payload['dead_bands'])
+            # Come apply_config: dal primo aggiornamento le soglie globali vengono tutte da config
+            table = table or base.thresholds.copy()
+            table.set_default(config)
+            self._touch(version, None)  # nuove soglie: nessun advice precedente resta valido
+
+        # Sensori da ricalcolare: tutte le modifiche non ancora confermate dal percorso dati
+        acked = self.applied.version
+        self._touched = [(v, s) for v, s in self._touched if v > acked]
+        invalidate = frozenset()
+        for _, sensors in self._touched:
+            if sensors is None:
+                invalidate = None
+                break
+            invalidate = invalidate | sensors
+
+        waiting = base.version > acked
+        pending_since = base.pending_since if waiting and base.pending_since is not None else time.monotonic()
+        if waiting and base.sent_ts is not None:
+            sent.append(base.sent_ts)
+
+        self.messages += len(messages)
+        self.snapshots += 1
+        self.build_s += time.perf_counter() - t0
+        return ConfigSnapshot(version, config, settings_updated, config_version, table or base.thresholds,
+                              dead_bands, invalidate, offsets, pending_since, min(sent) if sent else None)
+
+    def acknowledge(self, snapshot):
+        """Chiamata dal percorso dati dopo aver adottato 'snapshot' al confine di un batch."""
+        self.applied = snapshot
+        if snapshot.pending_since is not None:
+            self.effect_ms.append((time.monotonic() - snapshot.pending_since) * 1000)
+        if snapshot.sent_ts is not None:
+            self.end_to_end_ms.append((time.time() - snapshot.sent_ts) * 1000)
+
+    def snapshot(self):
+        def pct(samples, q):
+            return round(float(np.percentile(np.array(samples), q)), 3) if samples else None
+        return {
+            'version': self.current.version,
+            'applied_version': self.applied.version,
+            'messages': self.messages,
+            'rejected': self.rejected,
+            'snapshots': self.snapshots,
+            'build_ms_total': round(self.build_s * 1000, 3),
+            'effect_ms_p50': pct(self.effect_ms, 50),
+            'effect_ms_p99': pct(self.effect_ms, 99),
+            'end_to_end_ms_p50': pct(self.end_to_end_ms, 50),
+            'end_to_end_ms_p99': pct(self.end_to_end_ms, 99),
+        }
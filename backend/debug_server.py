@@ -2,7 +2,15 @@ import asyncio
 from aiosmtpd.controller import Controller
 
 class DebugHandler:
+    def __init__(self, quiet=False):
+        self.quiet = quiet  # True nei benchmark: conta le email senza stamparle
+        self.received = 0
+
     async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        if self.quiet:
+            return '250 Message accepted for delivery'
+
         print("\n" + "="*60)
         print("📨 NUOVA EMAIL RICEVUTA DAL SISTEMA")
         print(f"DA: {envelope.mail_from}")
@@ -0,0 +1,101 @@
+import os
+import time
+import collections
+
+# Modalità dell'analyzer, dalla più completa alla più leggera
+MODE_FULL = 'FULL'                # regole + 3 pipeline AI per ogni lettura
+MODE_RULES_ONLY = 'RULES_ONLY'    # solo regole (AI saltata)
+MODE_LATEST_ONLY = 'LATEST_ONLY'  # solo regole sull'ultima lettura per sensore nella finestra
+MODES = (MODE_FULL, MODE_RULES_ONLY, MODE_LATEST_ONLY)
+
+# Soglie (configurabili da ambiente): lag in messaggi e/o età della lettura in secondi
+LAG_RULES_ONLY = int(os.environ.get("GREENFIELD_LAG_RULES_ONLY", 500))
+LAG_LATEST_ONLY = int(os.environ.get("GREENFIELD_LAG_LATEST_ONLY", 5000))
+AGE_RULES_ONLY_S = float(os.environ.get("GREENFIELD_AGE_RULES_ONLY_S", 15))
+AGE_LATEST_ONLY_S = float(os.environ.get("GREENFIELD_AGE_LATEST_ONLY_S", 60))
+RECOVERY_RATIO = 0.5   # si torna indietro solo sotto metà della soglia (isteresi)
+MIN_DWELL_S = 5.0      # permanenza minima in una modalità prima di alleggerire il carico
+RATE_ALPHA = 0.2       # smoothing esponenziale del ritmo di elaborazione
+
+
+class DegradationController:
+    """
+    Sceglie la modalità dell'analyzer dal lag del consumer (messaggi in coda) e
+    dall'età delle letture. Sale di livello subito, scende di un livello alla volta
+    quando lag ed età restano sotto la soglia ridotta per almeno min_dwell_s.
+    Se il trasporto non espone il lag si usa solo l'età (e viceversa).
+    """
+    def __init__(self, lag_thresholds=(LAG_RULES_ONLY, LAG_LATEST_ONLY),
+                 age_thresholds=(AGE_RULES_ONLY_S, AGE_LATEST_ONLY_S),
+                 recovery_ratio=RECOVERY_RATIO, min_dwell_s=MIN_DWELL_S):
+        self.lag_thresholds = (0,) + tuple(lag_thresholds)
+        self.age_thresholds = (0.0,) + tuple(age_thresholds)
+        self.recovery_ratio = recovery_ratio
+        self.min_dwell_s = min_dwell_s
+
+        self.level = 0
+        self.since = time.monotonic()
+        self.lag = None
+        self.age_s = None
+        self.rate = 0.0               # messaggi elaborati al secondo (EWMA)
+        self.processed = collections.Counter()  # per modalità
+        self.shed = 0                 # letture scartate in LATEST_ONLY
+        self.transitions = 0
+        self.history = collections.deque(maxlen=20)
+
+    @property
+    def mode(self):
+        return MODES[self.level]
+
+    def _pressure(self, lag, age_s, scale=1.0):
+        """Livello più alto la cui soglia (scalata) è superata da lag o età."""
+        level = 0
+        for i in range(1, len(MODES)):
+            if (lag is not None and lag >= self.lag_thresholds[i] * scale) or \
+               (age_s is not None and age_s >= self.age_thresholds[i] * scale):
+                level = i
+        return level
+
+    def observe(self, lag, age_s, now=None):
+        """Aggiorna lag ed età osservati e restituisce la modalità da usare per il prossimo batch."""
+        now = time.monotonic() if now is None else now
+        self.lag, self.age_s = lag, age_s
+
+        target = self._pressure(lag, age_s)
+        if target > self.level:
+            self._switch(target, now)
+        elif self.level > 0 and now - self.since >= self.min_dwell_s:
+            # Scende solo se il carico è sotto la soglia ridotta del livello corrente
+            if self._pressure(lag, age_s, self.recovery_ratio) < self.level:
+                self._switch(self.level - 1, now)
+        return self.mode
+
+    def record(self, processed, elapsed_s, shed=0):
+        self.processed[self.mode] += processed
+        self.shed += shed
+        if elapsed_s > 0 and processed:
+            inst = processed / elapsed_s
+            self.rate = inst if self.rate == 0 else (1 - RATE_ALPHA) * self.rate + RATE_ALPHA * inst
+
+    def _switch(self, level, now):
+        old = self.mode
+        self.level = level
+        self.since = now
+        self.transitions += 1
+        self.history.append({'ts': time.time(), 'from': old, 'to': self.mode, 'lag': self.lag,
+                             'age_s': None if self.age_s is None else round(self.age_s, 2)})
+        age = "n/d" if self.age_s is None else f"{self.age_s:.1f}s"
+        print(f"🚦 ANALYZER: modalità {old} -> {self.mode} (lag={self.lag}, età={age})")
+
+    def snapshot(self):
+        return {
+            'mode': self.mode,
+            'lag': self.lag,
+            'age_s': None if self.age_s is None else round(self.age_s, 3),
+            'rate_msg_s': round(self.rate, 1),
+            'eta_s': round(self.lag / self.rate, 1) if self.lag and self.rate else None,
+            'processed': dict(self.processed),
+            'shed': self.shed,
+            'transitions': self.transitions,
+            'recent_transitions': list(self.history),
+        }
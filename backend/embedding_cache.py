@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+EMBEDDING_DTYPE = np.float16  # metà spazio su disco, precisione sufficiente per la testa densa
+GROW_FACTOR = 1.5
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-1 del contenuto: una foto rinominata o spostata non viene ricalcolata."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Embedding del backbone congelato su disco: un array memory-mapped (righe x dim)
+    più un indice JSON hash-immagine -> riga. Ogni backbone ha la sua cartella,
+    così un cambio di pesi non mescola embedding incompatibili.
+    """
+    def __init__(self, cache_dir, dim):
+        self.cache_dir = cache_dir
+        self.dim = dim
+        self.data_path = os.path.join(cache_dir, "embeddings.mmap")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.index = {}
+        capacity = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                meta = json.load(f)
+            if meta['dim'] != dim:
+                raise ValueError(f"Cache {cache_dir} con dimensione {meta['dim']} != {dim}")
+            self.index = meta['index']
+            capacity = meta['capacity']
+        self.array = None
+        self._open(capacity)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def _open(self, capacity):
+        self.capacity = capacity
+        if capacity == 0:
+            self.array = np.zeros((0, self.dim), dtype=EMBEDDING_DTYPE)
+            return
+        mode = 'r+' if os.path.exists(self.data_path) else 'w+'
+        self.array = np.memmap(self.data_path, dtype=EMBEDDING_DTYPE, mode=mode, shape=(capacity, self.dim))
+
+    def _ensure_capacity(self, needed):
+        if needed <= self.capacity:
+            return
+        new_capacity = max(needed, int(self.capacity * GROW_FACTOR), 1024)
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+            del self.array
+        # Estende il file senza riscrivere le righe esistenti
+        with open(self.data_path, 'ab') as f:
+            f.truncate(new_capacity * self.dim * np.dtype(EMBEDDING_DTYPE).itemsize)
+        self._open(new_capacity)
+
+    def missing(self, keys):
+        return [k for k in keys if k not in self.index]
+
+    def put_many(self, keys, embeddings):
+        """Aggiunge gli embedding delle chiavi nuove (quelle già presenti vengono sovrascritte)."""
+        embeddings = np.asarray(embeddings)
+        new_keys = [k for k in keys if k not in self.index]
+        self._ensure_capacity(len(self.index) + len(new_keys))
+        for k in new_keys:
+            self.index[k] = len(self.index)
+        rows = np.fromiter((self.index[k] for k in keys), dtype=np.int64, count=len(keys))
+        self.array[rows] = embeddings.astype(EMBEDDING_DTYPE)
+
+    def get_many(self, keys):
+        rows = np.fromiter((self.index[k] for k in keys), dtype=np.int64, count=len(keys))
+        return np.asarray(self.array[rows], dtype=np.float32)
+
+    def save(self):
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+        tmp = self.index_path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'dim': self.dim, 'capacity': self.capacity, 'index': self.index}, f)
+        os.replace(tmp, self.index_path)
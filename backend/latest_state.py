@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+
+# Vista dell'ultimo stato per sensore servita ai dashboard appena connessi (snapshot + delta)
+SNAPSHOT_EVENT = 'state_snapshot'
+DELTA_EVENT = 'state_delta'
+SNAPSHOT_MAX_AGE_S = 1.0   # snapshot riusato per le connessioni entro questo intervallo (+ delta)
+VERSION_KEY = '_version'
+
+
+def _json(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+class LatestStateView:
+    """
+    Ultima lettura e ultimo advice di ogni sensore, tenuti come JSON già codificato
+    (i byte del messaggio sul bus: nessuna ricodifica per lo snapshot). Ogni aggiornamento
+    incrementa una versione globale e diventa la versione del sensore; il dict resta in
+    ordine di versione, così il delta da una versione costa quanto i sensori cambiati.
+    L'ETag include l'epoca del processo: dopo un riavvio del gateway nessun 304 sbagliato.
+    """
+    def __init__(self, max_age_s=SNAPSHOT_MAX_AGE_S):
+        self.epoch = f"{int(time.time() * 1000):x}"
+        self.version = 0
+        self.max_age_s = max_age_s
+        self.rows = {}      # sensor_id -> (versione, chiave JSON, lettura JSON | None, advice JSON | None)
+        self._lock = threading.Lock()
+        self._cached = None  # (versione, istante, corpo)
+        self.builds = 0
+        self.served = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def etag(self, version=None):
+        return f'"{self.epoch}-{self.version if version is None else version}"'
+
+    def _set(self, sensor_id, reading=None, advice=None):
+        with self._lock:
+            self.version += 1
+            old = self.rows.pop(sensor_id, None)
+            if old is None:
+                old = (0, _json(str(sensor_id)), None, None)
+            self.rows[sensor_id] = (self.version, old[1], reading or old[2], advice or old[3])
+            return self.version
+
+    def update_reading(self, sensor_id, raw):
+        """raw: JSON della lettura (bytes). Restituisce la versione assegnata."""
+        return self._set(sensor_id, reading=raw)
+
+    def update_advice(self, sensor_id, raw):
+        return self._set(sensor_id, advice=raw)
+
+    def parse_since(self, etag):
+        """Versione di un ETag emesso da questa vista, None se di un'altra epoca o non valido."""
+        etag = etag or ''
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        epoch, _, version = etag.strip('"').partition('-')
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def _changed(self, since):
+        """Righe con versione > since, dalla più vecchia (sotto lock: solo scorrimento)."""
+        with self._lock:
+            if since is None or since <= 0:
+                return self.version, list(self.rows.values())
+            out = []
+            for row in reversed(self.rows.values()):
+                if row[0] <= since:
+                    break
+                out.append(row)
+            out.reverse()
+            return self.version, out
+
+    def _encode(self, version, items, since=None):
+        head = b'{"etag":%s,"version":%d,"full":%s,"sensors":{' % (_json(self.etag(version)), version,
+                                                                   b'false' if since else b'true')
+        # Un solo join sull'intero corpo (decine di MB con 50k sensori): nessuna copia intermedia
+        chunks = [head]
+        chunks.extend(b'%s:{"version":%d,"reading":%s,"advice":%s},' % (key, v, reading or b'null', advice or b'null')
+                      for v, key, reading, advice in items)
+        if items:
+            chunks[-1] = chunks[-1][:-1]
+        chunks.append(b'}}')
+        return b''.join(chunks)
+
+    def delta(self, since):
+        """Corpo JSON (bytes) dei sensori cambiati dopo 'since' (tutti se since è None), e la sua versione."""
+        version, items = self._changed(since)
+        return version, self._encode(version, items, since)
+
+    def snapshot(self):
+        """
+        Snapshot completo (versione, corpo JSON), ricostruito al più ogni max_age_s:
+        chi lo riceve da una copia meno recente recupera il resto con delta(versione).
+        """
+        cached = self._cached
+        if cached is None or (cached[0] != self.version and time.monotonic() - cached[1] > self.max_age_s):
+            version, body = self.delta(None)
+            cached = self._cached = (version, time.monotonic(), body)
+            self.builds += 1
+        self.served += 1
+        return cached[0], cached[2]
+
+    def readings(self):
+        """Ultima lettura decodificata di ogni sensore (per le API che lavorano sui dict)."""
+        with self._lock:
+            raws = [row[2] for row in self.rows.values() if row[2] is not None]
+        return [json.loads(raw) for raw in raws]
+
+    def stats(self):
+        cached = self._cached
+        return {'sensors': len(self.rows), 'version': self.version, 'etag': self.etag(),
+                'snapshot_bytes': len(cached[2]) if cached else 0,
+                'snapshot_builds': self.builds, 'snapshots_served': self.served}
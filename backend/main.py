@@ -1,12 +1,34 @@
 import os
+import time
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, confusion_matrix
 from data_loader import load_dataset_robust
-from strategies_model import LogisticRegressionStrategy, RuleBasedStrategy
+from strategies_model import LogisticRegressionStrategy, RuleBasedStrategy, TreeEnsembleStrategy
 from strategies_vision import DeepLearningVisionStrategy, GreenFieldImageAdvisor
 from pipeline import DataCleaner, FeatureEngineer, ModelEstimator
 from observers import SensorDataSource, AdvisorObserver
 
+LATENCY_ROWS = 200  # letture singole per misurare la latenza per messaggio
+
+def benchmark_strategy(strategy, features, target, df_test):
+    """Accuratezza sul test esterno, throughput a batch e latenza media per singola lettura."""
+    pipeline = DataCleaner(FeatureEngineer(ModelEstimator(strategy, features, target)))
+    t0 = time.perf_counter()
+    result_df = pipeline.handle(df_test)
+    batch_s = time.perf_counter() - t0
+
+    n = min(LATENCY_ROWS, len(df_test))
+    t0 = time.perf_counter()
+    for i in range(n):
+        pipeline.handle(df_test.iloc[i:i + 1])
+    row_ms = (time.perf_counter() - t0) / n * 1000
+
+    return {
+        'accuracy': accuracy_score(result_df[target], result_df[f"{target}_Predicted"]),
+        'rows_per_s': len(df_test) / batch_s,
+        'row_ms': row_ms,
+    }
+
 # 1. FUNZIONE: ANALISI DATI TABELLARI (IoT / Sensori)
 def run_tabular_analysis():
     print("\n" + "="*60)
@@ -74,6 +96,18 @@ def run_tabular_analysis():
         
         print(f"\n-> Accuracy Test Esterno: {acc_ext:.2%}")
 
+        # Confronto: LogReg contro ensemble di alberi compilati (stessi dati, stesse feature)
+        candidates = {'LogReg': strategy}
+        for kind in ('gbt', 'rf'):
+            tree_strategy = TreeEnsembleStrategy(kind)
+            tree_strategy.train(X_train, y_train)
+            candidates[f"Alberi ({kind})"] = tree_strategy
+
+        print(f"\n{'Strategia':<14} {'Accuracy':>9} {'righe/s batch':>14} {'ms/lettura':>11}")
+        for name, candidate in candidates.items():
+            stats = benchmark_strategy(candidate, features, target, df_external_test)
+            print(f"{name:<14} {stats['accuracy']:>9.2%} {stats['rows_per_s']:>14,.0f} {stats['row_ms']:>11.2f}")
+
 
 # 2. FUNZIONE: ANALISI VISIVA (Immagini / Visione)
 def run_vision_test():
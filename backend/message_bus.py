@@ -0,0 +1,379 @@
+import collections
+import errno
+import glob
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+
+# Trasporto selezionato per tutti i servizi: 'kafka' (default), 'local' (Unix socket, senza broker)
+# oppure 'inproc' (code in memoria, per test e benchmark in un solo processo)
+BUS_BACKEND = os.environ.get("GREENFIELD_BUS", "kafka")
+KAFKA_BOOTSTRAP = "localhost:9092"
+LOCAL_BUS_DIR = os.environ.get("GREENFIELD_BUS_DIR", "/tmp/greenfield-bus")
+
+INPROC_RETENTION = 100_000  # messaggi conservati per topic dal bus in-process
+
+
+class BusMessage:
+    __slots__ = ('topic', 'value', 'key', 'partition', 'offset')
+
+    def __init__(self, topic, value, key=None, partition=0, offset=-1):
+        self.topic = topic
+        self.value = value
+        self.key = key
+        self.partition = partition
+        self.offset = offset
+
+
+class Subscription(ABC):
+    @abstractmethod
+    def poll(self, timeout=0.1):
+        """Restituisce un BusMessage oppure None allo scadere del timeout."""
+
+    def consume(self, max_messages=500, timeout=0.1):
+        """Fino a max_messages messaggi: attende al massimo 'timeout' solo per il primo."""
+        first = self.poll(timeout)
+        if first is None:
+            return []
+        batch = [first]
+        while len(batch) < max_messages:
+            msg = self.poll(0)
+            if msg is None:
+                break
+            batch.append(msg)
+        return batch
+
+    def lag(self):
+        """Messaggi pubblicati e non ancora letti dal gruppo, None se il trasporto non lo sa."""
+        return None
+
+    def commit(self, offsets):
+        """Commit manuale: offsets = {(topic, partizione): prossimo offset da leggere}."""
+
+    def close(self):
+        pass
+
+
+class MessageBus(ABC):
+    """
+    Publish/subscribe per 'sensor-data', 'system-settings' e 'system-advice' indipendente dal trasporto.
+    on_delivery(err) viene chiamata con err=None a consegna confermata (in flush/publish successivi).
+    Con auto_commit=False il gruppo riparte da start_offsets o dall'ultimo commit() esplicito.
+    """
+    @abstractmethod
+    def publish(self, topic, value: bytes, key=None, on_delivery=None):
+        pass
+
+    @abstractmethod
+    def subscribe(self, topics, group_id, from_beginning=False, auto_commit=True, start_offsets=None) -> Subscription:
+        pass
+
+    def flush(self, timeout=10.0):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+# KAFKA
+
+class KafkaSubscription(Subscription):
+    def __init__(self, consumer):
+        self.consumer = consumer
+
+    @staticmethod
+    def _wrap(msg):
+        return BusMessage(msg.topic(), msg.value(), msg.key(), msg.partition(), msg.offset())
+
+    def poll(self, timeout=0.1):
+        msg = self.consumer.poll(timeout)
+        if msg is None or msg.error():
+            return None
+        return self._wrap(msg)
+
+    def consume(self, max_messages=500, timeout=0.1):
+        return [self._wrap(m) for m in self.consumer.consume(max_messages, timeout) if not m.error()]
+
+    def lag(self):
+        # Watermark in cache (aggiornati dalle statistiche del client): nessuna chiamata al broker
+        total = 0
+        for tp in self.consumer.position(self.consumer.assignment()):
+            _, high = self.consumer.get_watermark_offsets(tp, cached=True)
+            if high < 0 or tp.offset < 0:
+                continue
+            total += max(0, high - tp.offset)
+        return total
+
+    def commit(self, offsets):
+        from confluent_kafka import TopicPartition
+        if offsets:
+            self.consumer.commit(offsets=[TopicPartition(t, p, o) for (t, p), o in offsets.items()],
+                                 asynchronous=False)
+
+    def close(self):
+        self.consumer.close()
+
+
+class KafkaBus(MessageBus):
+    def __init__(self, bootstrap=KAFKA_BOOTSTRAP):
+        from confluent_kafka import Producer
+        self.bootstrap = bootstrap
+        self.producer = Producer({'bootstrap.servers': bootstrap})
+
+    def publish(self, topic, value, key=None, on_delivery=None):
+        if on_delivery is None:
+            self.producer.produce(topic, value, key=key)
+        else:
+            self.producer.produce(topic, value, key=key, on_delivery=lambda err, msg: on_delivery(err))
+        self.producer.poll(0)
+
+    def flush(self, timeout=10.0):
+        self.producer.flush(timeout)
+
+    def subscribe(self, topics, group_id, from_beginning=False, auto_commit=True, start_offsets=None):
+        from confluent_kafka import Consumer
+        consumer = Consumer({
+            'bootstrap.servers': self.bootstrap,
+            'group.id': group_id,
+            'auto.offset.reset': 'earliest' if from_beginning else 'latest',
+            'enable.auto.commit': auto_commit,
+            'statistics.interval.ms': 5000,  # aggiorna i watermark in cache usati da lag()
+        })
+        if start_offsets:
+            # Ripresa da checkpoint: le partizioni assegnate partono dagli offset salvati, solo alla prima
+            # assegnazione. Dopo un ribilanciamento vale l'ultimo commit (il checkpoint sarebbe vecchio).
+            pending = dict(start_offsets)
+            def on_assign(c, partitions):
+                for tp in partitions:
+                    tp.offset = pending.pop((tp.topic, tp.partition), tp.offset)
+                c.assign(partitions)
+            consumer.subscribe(list(topics), on_assign=on_assign)
+        else:
+            consumer.subscribe(list(topics))
+        return KafkaSubscription(consumer)
+
+
+# IN-PROCESS (thread-safe, un log per topic e un cursore per gruppo)
+
+class InProcessSubscription(Subscription):
+    def __init__(self, bus, topics, group_id):
+        self.bus = bus
+        self.topics = list(topics)
+        self.group_id = group_id
+
+    def poll(self, timeout=0.1):
+        deadline = time.monotonic() + (timeout or 0)
+        with self.bus.cond:
+            while True:
+                for topic in self.topics:
+                    msg = self.bus._next(topic, self.group_id)
+                    if msg is not None:
+                        return msg
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.bus.cond.wait(remaining)
+
+    def lag(self):
+        with self.bus.cond:
+            return sum(self.bus._pending(topic, self.group_id) for topic in self.topics)
+
+    def commit(self, offsets):
+        with self.bus.cond:
+            for (topic, _), offset in offsets.items():
+                self.bus.committed[(self.group_id, topic)] = offset
+
+
+class InProcessBus(MessageBus):
+    def __init__(self, retention=INPROC_RETENTION):
+        self.cond = threading.Condition()
+        self.logs = collections.defaultdict(lambda: collections.deque(maxlen=retention))
+        self.base = collections.Counter()      # offset del primo messaggio ancora in log
+        self.cursors = {}                      # (gruppo, topic) -> prossimo offset
+        self.committed = {}                    # (gruppo, topic) -> offset del commit manuale
+
+    def publish(self, topic, value, key=None, on_delivery=None):
+        with self.cond:
+            log = self.logs[topic]
+            if len(log) == log.maxlen:
+                self.base[topic] += 1
+            offset = self.base[topic] + len(log)
+            log.append(BusMessage(topic, value, key, 0, offset))
+            self.cond.notify_all()
+        if on_delivery is not None:
+            on_delivery(None)
+
+    def _pending(self, topic, group_id):
+        log = self.logs[topic]
+        pos = max(self.cursors[(group_id, topic)], self.base[topic])
+        return self.base[topic] + len(log) - pos
+
+    def _next(self, topic, group_id):
+        log = self.logs[topic]
+        pos = max(self.cursors[(group_id, topic)], self.base[topic])
+        if pos - self.base[topic] >= len(log):
+            return None
+        self.cursors[(group_id, topic)] = pos + 1
+        return log[pos - self.base[topic]]
+
+    def subscribe(self, topics, group_id, from_beginning=False, auto_commit=True, start_offsets=None):
+        with self.cond:
+            for topic in topics:
+                if start_offsets and (topic, 0) in start_offsets:
+                    self.cursors[(group_id, topic)] = start_offsets[(topic, 0)]
+                elif not auto_commit and (group_id, topic) in self.committed:
+                    # Come un riavvio: si riparte dall'ultimo commit, non da dove si era letto
+                    self.cursors[(group_id, topic)] = self.committed[(group_id, topic)]
+                elif (group_id, topic) not in self.cursors:
+                    start = self.base[topic] if from_beginning else self.base[topic] + len(self.logs[topic])
+                    self.cursors[(group_id, topic)] = start
+        return InProcessSubscription(self, topics, group_id)
+
+
+# LOCALE (Unix datagram socket, senza broker): ogni gruppo di consumer ha un socket per topic
+# in LOCAL_BUS_DIR/<topic>/<gruppo>.sock, i publisher inviano un datagramma a ciascuno.
+# Un solo consumer per gruppo: niente ripartizione del carico fra processi dello stesso gruppo.
+
+_HEADER = struct.Struct('!H')
+
+
+def _listening(path):
+    """True se un processo è ancora legato al socket (connect su un socket orfano viene rifiutata)."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+class LocalSubscription(Subscription):
+    def __init__(self, bus, topics, group_id):
+        self.selector = selectors.DefaultSelector()
+        self.paths = []
+        self.offsets = collections.Counter()
+        for topic in topics:
+            topic_dir = os.path.join(bus.base_dir, topic)
+            os.makedirs(topic_dir, exist_ok=True)
+            path = os.path.join(topic_dir, f"{group_id}.sock")
+            if os.path.exists(path):
+                if _listening(path):
+                    self.close()
+                    raise RuntimeError(f"Gruppo '{group_id}' già in ascolto su {topic}: il bus locale "
+                                       f"non ripartisce il carico fra più consumer dello stesso gruppo")
+                os.unlink(path)  # socket orfano di un consumer terminato
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 2**20)
+            sock.bind(path)
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, topic)
+            self.paths.append(path)
+
+    def poll(self, timeout=0.1):
+        for selector_key, _ in self.selector.select(timeout):
+            try:
+                data = selector_key.fileobj.recv(65536 * 4)
+            except BlockingIOError:
+                continue
+            topic = selector_key.data
+            (klen,) = _HEADER.unpack_from(data)
+            key = data[2:2 + klen] if klen else None
+            offset = self.offsets[topic]
+            self.offsets[topic] += 1
+            return BusMessage(topic, data[2 + klen:], key, 0, offset)
+        return None
+
+    def close(self):
+        for selector_key in list(self.selector.get_map().values()):
+            selector_key.fileobj.close()
+        self.selector.close()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class LocalBus(MessageBus):
+    PEER_REFRESH_S = 1.0
+
+    def __init__(self, base_dir=LOCAL_BUS_DIR, send_timeout=1.0):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.settimeout(send_timeout)  # backpressure limitata se un consumer è fermo
+        self.lock = threading.Lock()
+        self.peers = {}  # topic -> (ts aggiornamento, [percorsi socket])
+        self.dropped = 0
+
+    def _peers(self, topic):
+        now = time.monotonic()
+        cached = self.peers.get(topic)
+        if cached is None or now - cached[0] > self.PEER_REFRESH_S:
+            cached = (now, glob.glob(os.path.join(self.base_dir, topic, "*.sock")))
+            self.peers[topic] = cached
+        return cached[1]
+
+    def publish(self, topic, value, key=None, on_delivery=None):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        key = key or b""
+        data = _HEADER.pack(len(key)) + key + value
+        error = None
+        with self.lock:
+            for path in self._peers(topic):
+                try:
+                    self.sock.sendto(data, path)
+                except FileNotFoundError:
+                    self.peers.pop(topic, None)  # consumer terminato: rilegge la directory
+                except ConnectionRefusedError:
+                    # Socket orfano di un consumer chiuso male: nessuno è in ascolto
+                    self.peers.pop(topic, None)
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                except (socket.timeout, OSError) as e:
+                    code = getattr(e, 'errno', None)
+                    if code == errno.EMSGSIZE:
+                        error = f"messaggio di {len(data)} byte oltre il limite dei datagrammi Unix ({topic})"
+                    elif code in (None, errno.EAGAIN, errno.ENOBUFS):
+                        error = error or f"consumer {path} non riceve: messaggio scartato"
+                    else:
+                        raise
+                    self.dropped += 1
+        if error is not None and on_delivery is None:
+            print(f"❌ Bus locale: {error}")
+        # Datagrammi senza conferma né ritrasmissione: consegna best-effort (at-most-once),
+        # ma un messaggio scartato è segnalato come consegna fallita
+        if on_delivery is not None:
+            on_delivery(error)
+
+    def subscribe(self, topics, group_id, from_beginning=False, auto_commit=True, start_offsets=None):
+        # Nessun log persistente: offset e commit non hanno effetto su questo trasporto
+        return LocalSubscription(self, topics, group_id)
+
+    def close(self):
+        self.sock.close()
+
+
+_buses = {}
+
+
+def get_bus(backend=None):
+    """Bus condiviso dal processo per trasporto, di default quello di GREENFIELD_BUS (kafka | local | inproc)."""
+    backend = backend or BUS_BACKEND
+    if backend not in _buses:
+        if backend == 'kafka':
+            _buses[backend] = KafkaBus()
+        elif backend == 'local':
+            _buses[backend] = LocalBus()
+        elif backend == 'inproc':
+            _buses[backend] = InProcessBus()
+        else:
+            raise ValueError(f"Trasporto sconosciuto: {backend} (kafka | local | inproc)")
+    return _buses[backend]
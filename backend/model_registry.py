@@ -0,0 +1,387 @@
+import argparse
+import collections
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+import numpy as np
+
+# Registro dei modelli: REGISTRY_DIR/<tipo>/<versione>/ con artefatti e manifest, CURRENT = versione da servire.
+# I servizi seguono il puntatore: notifica su MODEL_UPDATES_TOPIC, più un controllo periodico
+# (il bus locale è best-effort e al riavvio la versione corrente si legge dal registro).
+MODEL_UPDATES_TOPIC = 'model-updates'
+REGISTRY_DIR = os.environ.get("GREENFIELD_MODEL_REGISTRY", "model_registry")
+POINTER = 'CURRENT'
+MANIFEST = 'manifest.json'
+KINDS = ('analyzer', 'vision')
+REGISTRY_POLL_S = 5.0
+PROBATION_S = 60.0            # dopo uno scambio: errori in questa finestra riportano alla versione precedente
+PROBATION_MAX_ERRORS = 5
+CANARY_IMAGE_DIR = os.environ.get("GREENFIELD_CANARY_IMAGES", "testvisivo")
+CANARY_IMAGES = 8
+CANARY_MIN_CONFIDENCE = 0.35  # confidenza media minima sul canary (sotto, consult chiede di riscattare la foto)
+SWAP_SAMPLES = 100
+
+
+def kind_dir(kind, registry=REGISTRY_DIR):
+    if kind not in KINDS:
+        raise ValueError(f"Tipo di modello sconosciuto: {kind} ({' | '.join(KINDS)})")
+    return os.path.join(registry, kind)
+
+
+def read_manifest(kind, version, registry=REGISTRY_DIR):
+    with open(os.path.join(kind_dir(kind, registry), version, MANIFEST), 'r') as f:
+        return json.load(f)
+
+
+def read_current(kind, registry=REGISTRY_DIR):
+    """Manifest della versione indicata da CURRENT, None se il registro non ne ha."""
+    try:
+        with open(os.path.join(kind_dir(kind, registry), POINTER), 'r') as f:
+            version = json.load(f)['version']
+        return read_manifest(kind, version, registry)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def artifact(manifest, role):
+    """Percorso assoluto dell'artefatto 'role' ('models', 'model', 'labels') di una versione."""
+    return os.path.abspath(os.path.join(manifest['dir'], manifest['files'][role]))
+
+
+def _point(kind, version, registry):
+    path = os.path.join(kind_dir(kind, registry), POINTER)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'version': version, 'ts': time.time()}, f)
+    os.replace(tmp, path)  # i servizi leggono sempre un puntatore completo
+
+
+def notify(kind, version, bus=None):
+    if bus is None:
+        from message_bus import get_bus
+        bus = get_bus()
+    bus.publish(MODEL_UPDATES_TOPIC, json.dumps({'kind': kind, 'version': version, 'ts': time.time()}).encode('utf-8'))
+    bus.flush()
+
+
+def publish(kind, files, registry=REGISTRY_DIR, bus=None, note=None):
+    """
+    Copia gli artefatti ({ruolo: percorso}) in una nuova versione e la rende corrente.
+    La versione precedente resta nel registro ('previous' nel manifest) per il rollback.
+    """
+    digest = hashlib.sha1()
+    for role in sorted(files):
+        with open(files[role], 'rb') as f:
+            digest.update(f.read())
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{digest.hexdigest()[:8]}"
+    target = os.path.join(kind_dir(kind, registry), version)
+    os.makedirs(target, exist_ok=True)
+    for src in files.values():
+        shutil.copy2(src, target)
+    current = read_current(kind, registry)
+    manifest = {'kind': kind, 'version': version, 'dir': os.path.abspath(target),
+                'files': {role: os.path.basename(src) for role, src in files.items()},
+                'previous': current['version'] if current else None, 'created': time.time(), 'note': note}
+    with open(os.path.join(target, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    _point(kind, version, registry)
+    notify(kind, version, bus)
+    return manifest
+
+
+def rollback(kind, registry=REGISTRY_DIR, bus=None):
+    """Riporta CURRENT alla versione precedente di quella corrente."""
+    current = read_current(kind, registry)
+    if current is None or not current.get('previous'):
+        raise ValueError(f"Nessuna versione precedente per '{kind}'")
+    _point(kind, current['previous'], registry)
+    notify(kind, current['previous'], bus)
+    return read_manifest(kind, current['previous'], registry)
+
+
+# --- Artefatti ---
+
+def save_analyzer_models(models, features, path):
+    """Strategie AI dell'analyzer ({chiave: strategia}) con le feature su cui sono addestrate."""
+    with open(path, 'wb') as f:
+        pickle.dump({'features': list(features), 'strategies': dict(models)}, f)
+
+
+def load_analyzer_models(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def canary_images(directory=CANARY_IMAGE_DIR, limit=CANARY_IMAGES):
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+    return [os.path.join(directory, n) for n in names[:limit]]
+
+
+def check_vision_canary(results, labels_map):
+    """results: [(classe, confidenza)] sulle immagini canary. Solleva ValueError se il modello non è credibile."""
+    if not results:
+        return {'images': 0}
+    idx = np.array([r[0] for r in results])
+    conf = np.array([r[1] for r in results], dtype=float)
+    if (idx < 0).any() or not all(int(i) in labels_map for i in idx):
+        raise ValueError(f"classi non valide sul canary: {sorted(set(idx.tolist()))}")
+    if not np.isfinite(conf).all() or conf.mean() < CANARY_MIN_CONFIDENCE:
+        raise ValueError(f"confidenza media sul canary {conf.mean():.2f} < {CANARY_MIN_CONFIDENCE}")
+    return {'images': len(results), 'mean_confidence': round(float(conf.mean()), 3)}
+
+
+# --- Scambio a caldo nei servizi ---
+
+class ModelWatcher:
+    """
+    Segue CURRENT per un tipo di modello: carica la nuova versione in background, la valida su un
+    batch canary e la installa con uno scambio di riferimento fra una richiesta e l'altra.
+    Se caricamento o canary falliscono resta la versione in uso; se dopo lo scambio il servizio
+    accumula errori (errors()) entro PROBATION_S si torna alla versione precedente, ancora in memoria.
+    Le versioni scartate non vengono ritentate finché il puntatore non cambia; dopo un rollback
+    CURRENT torna alla versione ripristinata, così un riavvio non ricarica quella scartata.
+    Tutti gli scambi (registro, rollback, replace dal servizio) passano dallo stesso lock.
+      load(manifest) -> candidato; validate(candidato) -> report (ValueError = scartato);
+      install(candidato) -> candidato precedente; discard(candidato): rilascio di uno scartato.
+    """
+    def __init__(self, kind, load, validate, install, discard=None, errors=None, registry=REGISTRY_DIR,
+                 poll_s=REGISTRY_POLL_S):
+        self.kind = kind
+        self.load = load
+        self.validate = validate
+        self.install = install
+        self.discard = discard
+        self.errors = errors
+        self.registry = registry
+        self.poll_s = poll_s
+        self.version = None      # None = modello di avvio, fuori dal registro
+        self.modified = None     # modelli in uso derivati dalla versione (es. re-fit locale): motivo
+        self.rejected = set()
+        self._previous = None    # (versione, candidato) fino alla fine della prova
+        self._swapped_at = None
+        self._errors_at_swap = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.swaps = 0
+        self.failures = 0
+        self.rollbacks = 0
+        self.last_error = None
+        self.last_report = None
+        self.timings = collections.deque(maxlen=SWAP_SAMPLES)  # (load, canary, install) in ms
+
+    def start(self, bus, group_id, stop_event):
+        self._thread = threading.Thread(target=self.run, args=(bus, group_id, stop_event),
+                                        name=f'model-watcher-{self.kind}', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self, bus, group_id, stop_event):
+        subscription = bus.subscribe([MODEL_UPDATES_TOPIC], group_id)
+        next_check = 0.0
+        while not stop_event.is_set():
+            nudged = False
+            for msg in subscription.consume(50, 0.5):
+                try:
+                    nudged |= json.loads(msg.value.decode('utf-8')).get('kind') == self.kind
+                except (ValueError, AttributeError):
+                    continue
+            now = time.monotonic()
+            if nudged or now >= next_check:
+                self.check()
+                next_check = now + self.poll_s
+            self.check_probation()
+        subscription.close()
+
+    def check(self):
+        manifest = read_current(self.kind, self.registry)
+        if manifest is None or manifest['version'] == self.version or manifest['version'] in self.rejected:
+            return False
+        return self.swap(manifest)
+
+    def swap(self, manifest):
+        version = manifest['version']
+        with self._lock:
+            candidate = None
+            t0 = time.perf_counter()
+            try:
+                candidate = self.load(manifest)
+                t1 = time.perf_counter()
+                report = self.validate(candidate)
+            except Exception as e:
+                self.rejected.add(version)
+                self.failures += 1
+                self.last_error = f"{version}: {type(e).__name__}: {e}"
+                if candidate is not None and self.discard is not None:
+                    self.discard(candidate)
+                print(f"❌ MODELLI ({self.kind}): versione {version} scartata, resta {self.version or 'avvio'} "
+                      f"({self.last_error})")
+                return False
+            t2 = time.perf_counter()
+            previous = self.install(candidate)
+            t3 = time.perf_counter()
+
+            if self._previous is not None and self.discard is not None:
+                self.discard(self._previous[1])
+            self._previous = (self.version, previous)
+            self.version = version
+            self.modified = None
+            self._swapped_at = time.monotonic()
+            self._errors_at_swap = self.errors() if self.errors else 0
+            self.swaps += 1
+            self.last_report = report
+            self.timings.append(((t1 - t0) * 1000, (t2 - t1) * 1000, (t3 - t2) * 1000))
+            print(f"🔁 MODELLI ({self.kind}): versione {version} attiva (caricamento {(t1 - t0) * 1000:.0f} ms, "
+                  f"canary {(t2 - t1) * 1000:.0f} ms, scambio {(t3 - t2) * 1000:.1f} ms)")
+            return True
+
+    def check_probation(self):
+        if self._previous is None or self.errors is None:
+            return False
+        if time.monotonic() - self._swapped_at > PROBATION_S:
+            if self.discard is not None:
+                self.discard(self._previous[1])
+            self._previous = None  # prova superata: la versione precedente non serve più
+            return False
+        if self.errors() - self._errors_at_swap < PROBATION_MAX_ERRORS:
+            return False
+        return self.rollback()
+
+    def rollback(self):
+        """Reinstalla la versione precedente (scambio inverso, senza ricaricare)."""
+        with self._lock:
+            if self._previous is None:
+                return False
+            bad = self.version
+            version, candidate = self._previous
+            try:
+                discarded = self.install(candidate)
+            except Exception as e:
+                self._previous = None
+                self.last_error = f"rollback a {version or 'avvio'} fallito: {type(e).__name__}: {e}"
+                print(f"❌ MODELLI ({self.kind}): {self.last_error}")
+                return False
+            if self.discard is not None:
+                self.discard(discarded)
+            self._previous = None
+            self.version = version
+            self.modified = None
+            self.rejected.add(bad)
+            self._repoint(bad, version)
+            self.rollbacks += 1
+            self.last_error = f"{bad}: {PROBATION_MAX_ERRORS}+ errori dopo lo scambio"
+            print(f"↩️ MODELLI ({self.kind}): rollback da {bad} a {version or 'avvio'}")
+            return True
+
+    def _repoint(self, bad, version):
+        """CURRENT non resta sulla versione scartata: al riavvio verrebbe caricata senza canary."""
+        current = read_current(self.kind, self.registry)
+        if current is None or current['version'] != bad:
+            return  # il puntatore è già passato a un'altra versione
+        try:
+            if version is not None:
+                _point(self.kind, version, self.registry)
+            else:  # si torna al modello di avvio, fuori dal registro
+                os.remove(os.path.join(kind_dir(self.kind, self.registry), POINTER))
+        except OSError as e:
+            print(f"⚠️ MODELLI ({self.kind}): CURRENT non aggiornato dopo il rollback ({e})")
+
+    def replace(self, candidate, note, expected=None):
+        """
+        Installa un candidato prodotto dal servizio stesso (es. re-fit sulle nuove soglie), serializzato
+        con scambi e rollback. expected(): False se il modello da cui il candidato deriva non è più
+        quello in uso (niente installazione). La versione del registro resta, segnata come modificata,
+        e la prova in corso termina: il rollback ripristinerebbe modelli senza la modifica.
+        """
+        with self._lock:
+            if expected is not None and not expected():
+                return False
+            previous = self.install(candidate)
+            if self.discard is not None:
+                if previous is not None:
+                    self.discard(previous)
+                if self._previous is not None:
+                    self.discard(self._previous[1])
+            self._previous = None
+            self.modified = note
+            return True
+
+    def snapshot(self):
+        timings = np.array(self.timings) if self.timings else None
+        return {
+            'kind': self.kind,
+            'version': self.version,
+            'modified': self.modified,
+            'previous': self._previous[0] if self._previous else None,
+            'in_probation': self._previous is not None,
+            'swaps': self.swaps,
+            'failures': self.failures,
+            'rollbacks': self.rollbacks,
+            'rejected': sorted(self.rejected),
+            'last_error': self.last_error,
+            'last_canary': self.last_report,
+            'load_ms_last': round(float(timings[-1, 0]), 1) if timings is not None else None,
+            'canary_ms_last': round(float(timings[-1, 1]), 1) if timings is not None else None,
+            'install_ms_max': round(float(timings[:, 2].max()), 3) if timings is not None else None,
+        }
+
+
+def _export_analyzer(path, strategy):
+    """Addestra i modelli AI come all'avvio dell'analyzer e li salva come artefatto del registro."""
+    os.environ.setdefault("GREENFIELD_BUS", "inproc")
+    if strategy:
+        os.environ["GREENFIELD_AI_STRATEGY"] = strategy
+    import analyzer
+    if analyzer.AI_MODELS is None:
+        raise SystemExit("❌ Training dei modelli AI fallito")
+    save_analyzer_models({key: m[0] for key, m in analyzer.AI_MODELS.items()}, analyzer.AI_FEATURES, path)
+    print(f"✅ Modelli AI ({analyzer.AI_STRATEGY}) salvati in {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro dei modelli GreenField (scambio a caldo nei servizi)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    pub = sub.add_parser('publish', help="nuova versione corrente")
+    pub.add_argument('kind', choices=KINDS)
+    pub.add_argument('--models', help="analyzer: pickle di save_analyzer_models")
+    pub.add_argument('--model', help="vision: file .h5")
+    pub.add_argument('--labels', default='class_indices.json', help="vision: class_indices.json")
+    pub.add_argument('--note')
+    back = sub.add_parser('rollback', help="CURRENT alla versione precedente")
+    back.add_argument('kind', choices=KINDS)
+    sub.add_parser('status')
+    export = sub.add_parser('export-analyzer', help="addestra e salva i modelli AI dell'analyzer")
+    export.add_argument('path')
+    export.add_argument('--strategy', choices=('logreg', 'sgd', 'gbt', 'rf'))
+    parser.add_argument('--registry', default=REGISTRY_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'publish':
+        files = {'models': args.models} if args.kind == 'analyzer' else {'model': args.model, 'labels': args.labels}
+        if not all(files.values()):
+            parser.error("analyzer richiede --models, vision richiede --model")
+        manifest = publish(args.kind, files, args.registry, note=args.note)
+        print(f"✅ {args.kind}: versione {manifest['version']} corrente (precedente: {manifest['previous']})")
+    elif args.command == 'rollback':
+        manifest = rollback(args.kind, args.registry)
+        print(f"↩️ {args.kind}: versione {manifest['version']} corrente")
+    elif args.command == 'export-analyzer':
+        _export_analyzer(args.path, args.strategy)
+    else:
+        for kind in KINDS:
+            manifest = read_current(kind, args.registry)
+            print(f"{kind}: {manifest['version'] if manifest else '-'}")
+
+
+if __name__ == "__main__":
+    main()
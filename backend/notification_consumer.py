@@ -1,9 +1,13 @@
 import json
+import queue
 import smtplib
+import threading
+import time
+import numpy as np
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from collections import deque
-from kafka import KafkaConsumer
+from message_bus import get_bus
+from checkpoint import CheckpointManager
 from datetime import datetime
 
 # CONFIGURAZIONE EMAIL LOCALE
@@ -11,175 +15,398 @@ SMTP_SERVER = "localhost"
 SMTP_PORT = 1025
 SENDER_EMAIL = "system@greenfield.ai"
 
-# Configurazione Kafka
-BROKER = "localhost:9092"
+# Pool SMTP: connessioni persistenti, retry con backoff esponenziale
+SMTP_POOL_SIZE = 2
+SMTP_MAX_RETRIES = 4
+SMTP_BACKOFF_S = 0.5
+
+# Finestra di raggruppamento: i report per lo stesso destinatario vengono uniti in una sola email
+COALESCE_WINDOW_S = 30.0
+
+# Configurazione Bus
 TOPIC = "system-advice"
+GROUP_ID = "notification-multi-v4"
+
+HISTORY_LEN = 15
+CONSUME_BATCH = 1000
+MONITORING_CYCLES = 10
+
+# Bitmask dello stato di un pacchetto advice (un bit per attuatore/carenza)
+BIT_IRR, BIT_NRG, BIT_N, BIT_P, BIT_K = 1, 2, 4, 8, 16
+BIT_NPK = BIT_N | BIT_P | BIT_K
+IRR_BITS = {'ON': BIT_IRR}
+NRG_BITS = {'ACTIVE': BIT_NRG}
+N_BITS, P_BITS, K_BITS = {'LOW': BIT_N}, {'LOW': BIT_P}, {'LOW': BIT_K}
 
-HISTORY_LEN = 15 
-data_buffer = deque(maxlen=HISTORY_LEN)
+# Motivi di allarme (bitmask) e relativa etichetta nel report
+REASON_IRR, REASON_NRG, REASON_FERT = 1, 2, 4
+REASON_LABELS = {REASON_IRR: "IRRIGAZIONE", REASON_NRG: "ENERGIA", REASON_FERT: "FERTILIZZAZIONE"}
 
-def to_on_off(status):
-    """Converte stati complessi in ON/OFF per il report"""
-    if status in ['ON', 'ACTIVE', 'LOW']: return 'ON'
-    return 'OFF'
+# Tabelle precalcolate sui 32 valori possibili della maschera
+EDGE_REASONS = np.array([(REASON_IRR if m & BIT_IRR else 0) | (REASON_NRG if m & BIT_NRG else 0) |
+                         (REASON_FERT if m & BIT_NPK else 0) for m in range(32)], dtype=np.uint8)
+ROW_CELLS = [" | ".join(f"{'ON' if m & bit else 'OFF':<5}" for bit in (BIT_IRR, BIT_NRG, BIT_N, BIT_P, BIT_K))
+             for m in range(32)]
 
-def format_history_table(buffer):
+
+def decode_mask(payload):
+    """Riduce un pacchetto advice alla sua bitmask (IRR, NRG, N, P, K)."""
+    rules = payload.get('rules', {})
+    fert = rules.get('fertilization', {})
+    return (IRR_BITS.get(rules.get('irrigation', {}).get('status'), 0)
+            | NRG_BITS.get(rules.get('energy', {}).get('status'), 0)
+            | N_BITS.get(fert.get('N'), 0) | P_BITS.get(fert.get('P'), 0) | K_BITS.get(fert.get('K'), 0))
+
+def format_history_table(masks, timestamps):
     """
     Crea la tabella con TUTTE le colonne:
     TIME | IRR | NRG | N | P | K
     """
     header = f"{'TIME':<10} | {'IRR':<5} | {'NRG':<5} | {'N':<5} | {'P':<5} | {'K':<5}"
     rows = [header, "-" * 55]
-    
-    for item in buffer:
-        ts_str = datetime.fromtimestamp(item.get('ts', 0)).strftime('%H:%M:%S')
-        
-        # Dati RAW
-        rules = item.get('rules', {})
-        fert = rules.get('fertilization', {})
-
-        # Conversione stati
-        v_irr = to_on_off(rules.get('irrigation', {}).get('status', 'OFF'))
-        v_nrg = to_on_off(rules.get('energy', {}).get('status', 'OFF'))
-        v_n = to_on_off(fert.get('N', 'OK'))
-        v_p = to_on_off(fert.get('P', 'OK'))
-        v_k = to_on_off(fert.get('K', 'OK'))
-        
-        rows.append(f"{ts_str:<10} | {v_irr:<5} | {v_nrg:<5} | {v_n:<5} | {v_p:<5} | {v_k:<5}")
-        
+    for m, ts in zip(masks, timestamps):
+        ts_str = datetime.fromtimestamp(ts).strftime('%H:%M:%S')
+        rows.append(f"{ts_str:<10} | {ROW_CELLS[m]}")
     return "\n".join(rows)
 
-def send_local_email(recipient, reasons_list, buffer):
-    try:
-        # Uniamo i motivi unici (es. "IRRIGAZIONE, FERTILIZZAZIONE")
-        unique_reasons = list(set(reasons_list))
-        subject_str = " + ".join(unique_reasons)
-        
-        print(f"\n📨 CREAZIONE REPORT CUMULATIVO ({subject_str}) per {recipient}...")
-        
-        table_text = format_history_table(buffer)
-        
-        msg = MIMEMultipart()
-        msg['From'] = SENDER_EMAIL
-        msg['To'] = recipient
-        msg['Subject'] = f"🚨 ALERT MULTIPLO: {subject_str}"
-
-        body = f"""
+def reasons_from_mask(mask):
+    return [label for bit, label in REASON_LABELS.items() if mask & bit]
+
+
+class AlertReport:
+    """Report pronto per l'invio: un sensore, un destinatario, i motivi accumulati."""
+    __slots__ = ('sensor_id', 'recipient', 'reasons', 'table_text', 'ts')
+
+    def __init__(self, sensor_id, recipient, reasons, table_text, ts):
+        self.sensor_id = sensor_id
+        self.recipient = recipient
+        self.reasons = reasons
+        self.table_text = table_text
+        self.ts = ts
+
+
+class AlertStateTable:
+    """
+    Macchine a stati per sensore in una tabella compatta: ogni chiave (sensor_id)
+    ha una riga negli array NumPy con l'ultima bitmask, il countdown di
+    monitoraggio (0 = inattivo), la bitmask dei motivi accumulati e lo storico
+    come ring buffer di maschere + timestamp.
+    """
+    def __init__(self, capacity=1024):
+        self.index = {}
+        self.keys = []
+        self.recipients = []
+        self.last = np.zeros(capacity, dtype=np.uint8)
+        self.countdown = np.zeros(capacity, dtype=np.int16)
+        self.reasons = np.zeros(capacity, dtype=np.uint8)
+        self.hist_mask = np.zeros((capacity, HISTORY_LEN), dtype=np.uint8)
+        self.hist_ts = np.zeros((capacity, HISTORY_LEN), dtype=np.float64)
+        self.hist_count = np.zeros(capacity, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.index)
+
+    def row_for(self, key):
+        row = self.index.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row >= len(self.last):
+                self._grow()
+            self.index[key] = row
+            self.keys.append(key)
+            self.recipients.append(None)
+        return row
+
+    def _grow(self):
+        extra = len(self.last)
+        for name in ('last', 'countdown', 'reasons', 'hist_mask', 'hist_ts', 'hist_count'):
+            arr = getattr(self, name)
+            setattr(self, name, np.concatenate([arr, np.zeros((extra,) + arr.shape[1:], dtype=arr.dtype)]))
+
+    def _ring(self, row, n=HISTORY_LEN):
+        """Ultime n voci (maschere, timestamp) del ring buffer del sensore, dalla più vecchia."""
+        count = int(self.hist_count[row])
+        pos = np.arange(count - min(count, n), count) % HISTORY_LEN
+        return self.hist_mask[row, pos], self.hist_ts[row, pos]
+
+    def history_table(self, row):
+        return format_history_table(*self._ring(row))
+
+    def _report_table(self, row, s_masks, s_ts, start, i):
+        """Storico fino alla lettura i del batch: coda del ring buffer + letture del batch."""
+        lo = max(start, i + 1 - HISTORY_LEN)
+        old_masks, old_ts = self._ring(row, HISTORY_LEN - (i + 1 - lo))
+        return format_history_table(np.concatenate([old_masks, s_masks[lo:i + 1]]),
+                                    np.concatenate([old_ts, s_ts[lo:i + 1]]))
+
+    def process(self, payload):
+        """Aggiorna lo stato del sensore; restituisce un AlertReport quando il monitoraggio termina."""
+        reports = self.process_batch([payload])
+        return reports[0] if reports else None
+
+    def process_batch(self, payloads):
+        """
+        Elabora un blocco di pacchetti advice. Maschere, fronti di salita
+        (mask & (mask ^ prev)) e storico sono calcolati in modo vettorizzato;
+        solo i sensori con un monitoraggio in corso passano dal ciclo Python.
+        """
+        n = len(payloads)
+        if n == 0:
+            return []
+        masks = np.fromiter((decode_mask(p) for p in payloads), dtype=np.uint8, count=n)
+        ts = np.fromiter((p.get('ts', 0) or 0 for p in payloads), dtype=np.float64, count=n)
+        rows = np.fromiter((self.row_for(p.get('sensor_id', 'sensor')) for p in payloads), dtype=np.int64, count=n)
+        heartbeat = np.fromiter((bool(p.get('heartbeat')) for p in payloads), dtype=bool, count=n)
+        for p, r, hb in zip(payloads, rows, heartbeat):
+            if not hb:
+                self.recipients[r] = p.get('config', {}).get('email', 'admin@local')
+
+        # 1. Raggruppa per sensore mantenendo l'ordine di arrivo
+        order = np.argsort(rows, kind='stable')
+        s_rows, s_masks, s_ts = rows[order], masks[order], ts[order]
+        first = np.ones(n, dtype=bool)
+        first[1:] = s_rows[1:] != s_rows[:-1]
+        group_start = np.maximum.accumulate(np.where(first, np.arange(n), 0))
+        rank = np.arange(n) - group_start
+        last_of_group = np.ones(n, dtype=bool)
+        last_of_group[:-1] = first[1:]
+
+        # Heartbeat (lettura invariata): ripete la maschera precedente dello stesso sensore
+        s_hb = heartbeat[order]
+        if s_hb.any():
+            s_masks[first & s_hb] = self.last[s_rows[first & s_hb]]
+            source = np.maximum.accumulate(np.where(first | ~s_hb, np.arange(n), 0))
+            s_masks = s_masks[source]
+
+        # 2. Fronti di salita contro la maschera precedente dello stesso sensore
+        prev = np.empty_like(s_masks)
+        prev[first] = self.last[s_rows[first]]
+        prev[~first] = s_masks[:-1][~first[1:]]
+        rising = s_masks & (s_masks ^ prev)
+        self.last[s_rows[last_of_group]] = s_masks[last_of_group]
+
+        # 3. Macchine a stati: solo sensori con nuovi fronti o monitoraggio già attivo
+        active_rows = np.unique(np.concatenate([s_rows[rising != 0],
+                                                s_rows[self.countdown[s_rows] > 0]]))
+        in_play = np.isin(s_rows, active_rows)
+        edge_reasons = EDGE_REASONS[rising]
+
+        reports = []
+        for i in np.flatnonzero(in_play):
+            row = s_rows[i]
+            new_mask = edge_reasons[i]
+            if new_mask:
+                if self.countdown[row] == 0:
+                    print(f"\n🚨 NUOVO EVENTO RILEVATO [{self.keys[row]}]: {reasons_from_mask(new_mask)}")
+                    self.countdown[row] = MONITORING_CYCLES
+                    self.reasons[row] = new_mask
+                else:
+                    self.reasons[row] |= new_mask
+
+            if self.countdown[row] > 0:
+                self.countdown[row] -= 1
+                if self.countdown[row] == 0:
+                    reports.append(AlertReport(self.keys[row], self.recipients[row],
+                                               reasons_from_mask(int(self.reasons[row])),
+                                               self._report_table(row, s_masks, s_ts, group_start[i], i),
+                                               float(s_ts[i])))
+                    self.reasons[row] = 0
+
+        # 4. Storico: scrittura nel ring buffer (solo le ultime HISTORY_LEN per sensore)
+        seq = self.hist_count[s_rows] + rank
+        counts = np.bincount(s_rows, minlength=len(self.last))
+        group_len = counts[s_rows]
+        keep = rank >= group_len - HISTORY_LEN
+        self.hist_mask[s_rows[keep], seq[keep] % HISTORY_LEN] = s_masks[keep]
+        self.hist_ts[s_rows[keep], seq[keep] % HISTORY_LEN] = s_ts[keep]
+        self.hist_count[s_rows[last_of_group]] = seq[last_of_group] + 1
+
+        return reports
+
+
+def build_email(recipient, reports):
+    """Un'unica email per destinatario con i report di tutti i sensori della finestra."""
+    unique_reasons = sorted({r for rep in reports for r in rep.reasons})
+    subject_str = " + ".join(unique_reasons)
+
+    msg = MIMEMultipart()
+    msg['From'] = SENDER_EMAIL
+    msg['To'] = recipient
+    msg['Subject'] = f"🚨 ALERT MULTIPLO: {subject_str}"
+
+    sections = []
+    for rep in reports:
+        sections.append(f"""
+        SENSORE: {rep.sensor_id}
+        ALLARMI RILEVATI NELLA FINESTRA TEMPORALE:
+        {', '.join(rep.reasons)}
+
+        DETTAGLIO DATI (Ultimi {HISTORY_LEN} cicli):
+        {rep.table_text}
+        """)
+
+    body = f"""
         *** REPORT COMPLETO ATTUATORI ***
         ---------------------------------
         DESTINATARIO: {recipient}
-        ALLARMI RILEVATI NELLA FINESTRA TEMPORALE:
-        {', '.join(unique_reasons)}
-        
+        SENSORI IN ALLARME: {len(reports)}
+
         LEGENDA:
         ON  = Attuatore Attivo / Valvola Aperta / Carenza
         OFF = Parametri OK
-        
-        DETTAGLIO DATI (Ultimi 15 cicli):
-        {table_text}
+        {''.join(sections)}
         """
-        msg.attach(MIMEText(body, 'plain'))
-
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.sendmail(SENDER_EMAIL, recipient, msg.as_string())
-        server.quit()
-        
-        print("✅ EMAIL INVIATA CORRETTAMENTE.")
-        
-    except ConnectionRefusedError:
-        print("❌ ERRORE: Server email locale spento (lancia debug_server.py).")
-    except Exception as e:
-        print(f"❌ Errore generico: {e}")
+    msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+
+class MailDispatcher:
+    """
+    Coda di uscita asincrona: il loop di consumo deposita i report e prosegue.
+    Un thread raggruppa i report per destinatario (COALESCE_WINDOW_S) e un pool di
+    worker, ognuno con una connessione SMTP persistente, li invia con retry/backoff.
+    """
+    def __init__(self, host=SMTP_SERVER, port=SMTP_PORT, pool_size=SMTP_POOL_SIZE,
+                 window_s=COALESCE_WINDOW_S, max_retries=SMTP_MAX_RETRIES, backoff_s=SMTP_BACKOFF_S):
+        self.host, self.port = host, port
+        self.window_s = window_s
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+
+        self.inbox = queue.Queue()
+        self.outbox = queue.Queue()
+        self.pending = {}  # destinatario -> (ts primo report, [report])
+        self._unsent = {}  # id(report) -> report, dalla submit all'esito dell'invio (per il checkpoint)
+        self._unsent_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._flush_now = threading.Event()
+
+        self._threads = [threading.Thread(target=self._coalesce_loop, daemon=True)]
+        self._threads += [threading.Thread(target=self._send_loop, daemon=True) for _ in range(pool_size)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, report):
+        with self._unsent_lock:
+            self._unsent[id(report)] = report
+        self.inbox.put(report)
+
+    def unsent(self):
+        """Report accettati ma non ancora inviati: vanno nel checkpoint e vengono reinviati al riavvio."""
+        with self._unsent_lock:
+            return list(self._unsent.values())
+
+    def _coalesce_loop(self):
+        while not self._stop.is_set():
+            try:
+                rep = self.inbox.get(timeout=0.05)
+                entry = self.pending.setdefault(rep.recipient, (time.monotonic(), []))
+                entry[1].append(rep)
+                self.inbox.task_done()
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            force = self._flush_now.is_set() and self.inbox.empty()
+            for recipient in [r for r, (t0, _) in self.pending.items() if force or now - t0 >= self.window_s]:
+                _, reports = self.pending.pop(recipient)
+                self.outbox.put((recipient, reports))
+            if force:
+                self._flush_now.clear()
+
+    def _connect(self):
+        return smtplib.SMTP(self.host, self.port, timeout=10)
+
+    def _send_loop(self):
+        conn = None
+        while True:
+            item = self.outbox.get()
+            if item is None:
+                break
+            recipient, reports = item
+            msg = build_email(recipient, reports).as_string()
+
+            for attempt in range(self.max_retries + 1):
+                try:
+                    if conn is None:
+                        conn = self._connect()
+                    conn.sendmail(SENDER_EMAIL, recipient, msg)
+                    with self._unsent_lock:  # contatori condivisi fra i pool_size thread di invio
+                        self.sent += 1
+                    break
+                except (smtplib.SMTPException, OSError) as e:
+                    # Connessione caduta o server lento: chiude, attende e riconnette
+                    try:
+                        if conn is not None: conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+                    if attempt == self.max_retries:
+                        with self._unsent_lock:
+                            self.failed += 1
+                        print(f"❌ Invio fallito per {recipient} dopo {attempt + 1} tentativi: {e}")
+                    else:
+                        time.sleep(self.backoff_s * (2 ** attempt))
+            with self._unsent_lock:
+                for rep in reports:
+                    self._unsent.pop(id(rep), None)
+            self.outbox.task_done()
+
+        if conn is not None:
+            try:
+                conn.quit()
+            except Exception:
+                pass
+
+    def flush(self, timeout=30.0):
+        """Invia subito tutto ciò che è in coda (ignora la finestra) e attende la consegna."""
+        self.inbox.join()
+        self._flush_now.set()
+        deadline = time.monotonic() + timeout
+        while (self._flush_now.is_set() or self.pending) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.outbox.join()
+
+    def close(self):
+        self.flush()
+        self._stop.set()
+        for _ in self._threads[1:]:
+            self.outbox.put(None)
+        for t in self._threads:
+            t.join(timeout=5)
+
 
 def main():
-    consumer = KafkaConsumer(
-        TOPIC,
-        bootstrap_servers=BROKER,
-        auto_offset_reset="latest",
-        enable_auto_commit=True,
-        group_id="notification-multi-v4",
-        value_deserializer=lambda v: json.loads(v.decode("utf-8")),
-    )
-
-    print(f"📡 NOTIFICATION CONSUMER (Logic: Simultaneous Triggers)")
+    # Macchine a stati e report non ancora inviati riprendono dall'ultimo checkpoint, insieme agli offset
+    checkpoints = CheckpointManager('notification')
+    state, offsets = checkpoints.load()
+    states = state['states'] if state is not None else AlertStateTable()
+    dispatcher = MailDispatcher()
+    for report in (state['unsent'] if state is not None else []):
+        dispatcher.submit(report)
+    subscription = get_bus().subscribe([TOPIC], GROUP_ID, auto_commit=False, start_offsets=offsets)
+
+    def checkpoint_state():
+        return {'states': states, 'unsent': dispatcher.unsent()}
+
+    print(f"📡 NOTIFICATION CONSUMER (Logic: Per-Sensor State Machines)")
     print(f"   In attesa di dati...")
 
-    # Memoria stati precedenti
-    last_status = {
-        'irrigation': 'OFF', 'energy': 'OFF', 
-        'N': 'OK', 'P': 'OK', 'K': 'OK'
-    }
-    
-    monitoring_active = False
-    monitoring_countdown = 0
-    active_reasons = [] # Lista accumulativa dei motivi
-
-    for msg in consumer:
-        payload = msg.value
-        data_buffer.append(payload)
-        
-        rules = payload.get('rules', {})
-        config = payload.get('config', {})
-        recipient_email = config.get('email', 'admin@local')
-
-        # 1. Estrazione stati ATTUALI
-        curr_irr = rules.get('irrigation', {}).get('status', 'OFF')
-        curr_nrg = rules.get('energy', {}).get('status', 'OFF')
-        fert = rules.get('fertilization', {})
-        curr_n = fert.get('N', 'OK')
-        curr_p = fert.get('P', 'OK')
-        curr_k = fert.get('K', 'OK')
-
-        # 2. Rilevamento TRIGGER (Fronti di Salita)
-        new_triggers = []
-        
-        # Check Irrigazione (OFF -> ON)
-        if curr_irr == 'ON' and last_status['irrigation'] == 'OFF':
-            new_triggers.append("IRRIGAZIONE")
-
-        # Check Energia (OFF -> ACTIVE)
-        if curr_nrg == 'ACTIVE' and last_status['energy'] == 'OFF':
-            new_triggers.append("ENERGIA")
-
-        # Check Fertilizzanti (OK -> LOW)
-        if (curr_n == 'LOW' and last_status['N'] == 'OK') or \
-           (curr_p == 'LOW' and last_status['P'] == 'OK') or \
-           (curr_k == 'LOW' and last_status['K'] == 'OK'):
-            new_triggers.append("FERTILIZZAZIONE")
-
-        # 3. Gestione Macchina a Stati (Senza Reset indesiderati)
-        if new_triggers:
-            if not monitoring_active:
-                # NUOVO ALLARME: Inizia conteggio
-                print(f"\n🚨 NUOVO EVENTO RILEVATO: {new_triggers}")
-                monitoring_active = True
-                monitoring_countdown = 10
-                active_reasons = new_triggers # Inizializza lista motivi
-            else:
-                # GIA' IN MONITORAGGIO: Aggiungi motivo MA NON RESETTARE IL CONTEGGIO
-                print(f"➕ EVENTO SOVRAPPOSTO: {new_triggers} (Aggiunto al report corrente)")
-                active_reasons.extend(new_triggers)
-
-        # 4. Avanzamento Monitoraggio
-        if monitoring_active:
-            print(f"   ⏳ Registrazione combinata... {monitoring_countdown}/10")
-            monitoring_countdown -= 1
-            
-            if monitoring_countdown <= 0:
-                # FINE: Invia email con TUTTI i motivi accumulati
-                send_local_email(recipient_email, active_reasons, data_buffer)
-                
-                # Reset completo
-                monitoring_active = False
-                active_reasons = []
-                print("✅ Ciclo concluso. Torno in ascolto.")
-
-        # 5. Aggiornamento memorie per il prossimo ciclo
-        last_status['irrigation'] = curr_irr
-        last_status['energy'] = curr_nrg
-        last_status['N'] = curr_n
-        last_status['P'] = curr_p
-        last_status['K'] = curr_k
+    try:
+        while True:
+            batch = subscription.consume(CONSUME_BATCH, timeout=0.5)
+            payloads = [json.loads(m.value.decode("utf-8")) for m in batch]
+            for report in states.process_batch(payloads):
+                print(f"📨 Report per {report.recipient} ({report.sensor_id}): {' + '.join(report.reasons)}")
+                dispatcher.submit(report)
+            checkpoints.track(batch)
+            checkpoints.maybe_commit(subscription, checkpoint_state)
+    finally:
+        dispatcher.close()
+        checkpoints.maybe_commit(subscription, checkpoint_state, force=True)
+        subscription.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 from abc import ABC, abstractmethod
 
 class Observer(ABC):
@@ -6,6 +7,11 @@ class Observer(ABC):
     def update(self, row: pd.Series):
         pass
 
+    def update_batch(self, block: pd.DataFrame):
+        """Riceve un blocco di righe. Di default lo inoltra riga per riga a update()."""
+        for _, row in block.iterrows():
+            self.update(row)
+
 class Subject:
     def __init__(self):
         self._observers = []
@@ -20,32 +26,103 @@ class Subject:
         for obs in self._observers:
             obs.update(row)
 
+    def notify_batch(self, block: pd.DataFrame):
+        for obs in self._observers:
+            obs.update_batch(block)
+
 class SensorDataSource(Subject):
     """Trasmette le righe di un DataFrame come aggiornamenti di sensori in tempo reale."""
-    def stream(self, df: pd.DataFrame, limit: int = 10):
-        for i, (_, row) in enumerate(df.iterrows()):
-            self.notify(row)
-            if i + 1 >= limit:
-                break
+    def stream(self, df: pd.DataFrame, limit: int = 10, batch_size: int = 1):
+        """Con batch_size > 1 gli observer ricevono blocchi (viste) del DataFrame invece di singole righe."""
+        n = len(df) if limit is None else min(limit, len(df))
+        if batch_size <= 1:
+            for i in range(n):
+                self.notify(df.iloc[i])
+            return
+        for start in range(0, n, batch_size):
+            self.notify_batch(df.iloc[start:min(start + batch_size, n)])
+
+class ColumnarRingBuffer:
+    """
+    Storico a capacità fissa su colonne NumPy preallocate. Ogni valore è scritto
+    due volte (posizione p e p + capacity): la finestra delle ultime righe è così
+    sempre contigua e get_view() restituisce viste senza copie.
+    Lo schema delle colonne è fissato dal primo blocco ricevuto (bool e interi restano
+    tali). Una colonna viene promossa (es. int -> float64) solo quando un blocco successivo
+    porta valori che il suo tipo non rappresenta: decimali o NaN di una colonna mancante.
+    """
+    def __init__(self, capacity: int = 10_000):
+        self.capacity = capacity
+        self.columns = None
+        self.count = 0  # righe scritte in totale
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _allocate(self, block: pd.DataFrame):
+        self.columns = {}
+        for col in block.columns:
+            dtype = block[col].dtype
+            if not (isinstance(dtype, np.dtype) and dtype.kind in 'biuf'):
+                dtype = object
+            self.columns[col] = np.empty(2 * self.capacity, dtype=dtype)
+
+    def append(self, block: pd.DataFrame):
+        if len(block) == 0:
+            return
+        if self.columns is None:
+            self._allocate(block)
+        cap = self.capacity
+        if len(block) > cap:
+            self.count += len(block) - cap
+            block = block.iloc[-cap:]
+
+        n = len(block)
+        pos = self.count % cap
+        first = min(n, cap - pos)
+        for col, buf in list(self.columns.items()):
+            vals = block[col].to_numpy() if col in block.columns else np.full(n, np.nan)
+            if not np.can_cast(vals.dtype, buf.dtype, casting='safe'):
+                # Promozione una tantum: le righe già scritte passano al tipo comune
+                buf = self.columns[col] = buf.astype(np.result_type(buf.dtype, vals.dtype))
+            buf[pos:pos + first] = vals[:first]
+            buf[pos + cap:pos + cap + first] = vals[:first]
+            if n > first:
+                buf[:n - first] = vals[first:]
+                buf[cap:cap + n - first] = vals[first:]
+        self.count += n
+
+    def get_view(self):
+        if self.columns is None:
+            return {}
+        n = len(self)
+        start = (self.count - n) % self.capacity
+        return {col: buf[start:start + n] for col, buf in self.columns.items()}
 
 class AdvisorObserver(Observer):
-    """Esegue la pipeline esistente per UNA riga in ingresso e stampa la raccomandazione."""
-    def __init__(self, pipeline, target_name: str):
+    """Esegue la pipeline esistente sulle righe in ingresso e stampa la raccomandazione."""
+    def __init__(self, pipeline, target_name: str, history_capacity: int = 10_000, verbose: bool = True):
         self.pipeline = pipeline
         self.target_name = target_name
-        self.history = []
+        self.verbose = verbose
+        self.history = ColumnarRingBuffer(history_capacity)
 
     def update(self, row: pd.Series):
-        df_one = pd.DataFrame([row])          # 1-row dataframe
-        result = self.pipeline.handle(df_one) 
-
-        pred_col = f"{self.target_name}_Predicted"
-        pred = int(result[pred_col].iloc[0])
+        self.update_batch(pd.DataFrame([row]).infer_objects())
 
-        self.history.append(result.iloc[0].to_dict())
+    def update_batch(self, block: pd.DataFrame):
+        result = self.pipeline.handle(block)
+        self.history.append(result)
 
-        action = "SI" if pred == 1 else "NO"
-        print(f"[Observer] {self.target_name} = {action} ({pred})")
+        if self.verbose:
+            for pred in result[f"{self.target_name}_Predicted"].to_numpy():
+                action = "SI" if pred == 1 else "NO"
+                print(f"[Observer] {self.target_name} = {action} ({int(pred)})")
 
     def get_history_df(self):
-        return pd.DataFrame(self.history)
+        """
+        Ultime righe elaborate (al massimo history_capacity). Le colonne sono viste
+        sul buffer circolare: restano valide fino al prossimo update, usare .copy()
+        per conservarle.
+        """
+        return pd.DataFrame(self.history.get_view(), copy=False)
@@ -1,44 +1,106 @@
+import argparse
 import json
 import time
 import pandas as pd
-from kafka import KafkaProducer
-from data_loader import load_dataset_robust 
+from data_loader import load_dataset_robust
+from message_bus import get_bus
+from window_aggregation import WindowAggregator, EDGE_DELTAS, WINDOW_S, encode_summary, is_window
 
 TOPIC = "sensor-data"
-BOOTSTRAP_SERVERS = "localhost:9092"
+SENSOR_ID = "sensor"
+SEND_INTERVAL_S = 5
 
-def build_producer():
-    return KafkaProducer(
-        bootstrap_servers=BOOTSTRAP_SERVERS,
-        value_serializer=lambda v: json.dumps(v).encode("utf-8"),
-        key_serializer=lambda k: k.encode("utf-8") if k else None
-    )
+def build_event(row, idx, ts):
+    event = row.to_dict()
+
+    # Metadati
+    event["_event_type"] = "sensor_reading"
+    event["_row_id"] = int(idx)
+    event["_ts"] = ts
+    event["sensor_id"] = SENSOR_ID
+    return event
+
+def encode(payload):
+    """Eventi grezzi come sempre, riassunti di finestra in JSON compatto."""
+    return encode_summary(payload) if is_window(payload) else json.dumps(payload).encode("utf-8")
+
+def replay_report(df, window_s, deltas):
+    """Traffico del dataset con e senza pre-aggregazione, a tempo simulato (una lettura ogni SEND_INTERVAL_S)."""
+    aggregator = WindowAggregator(window_s, deltas)
+    raw = {'messages': 0, 'bytes': 0}
+    sent = {'messages': 0, 'bytes': 0, 'raw_events': 0, 'summaries': 0}
+
+    def account(payloads):
+        for p in payloads:
+            sent['messages'] += 1
+            sent['bytes'] += len(encode(p))
+            sent['summaries' if is_window(p) else 'raw_events'] += 1
+
+    t0 = time.time()
+    for idx, row in df.iterrows():
+        event = build_event(row, idx, t0 + idx * SEND_INTERVAL_S)
+        raw['messages'] += 1
+        raw['bytes'] += len(json.dumps(event).encode("utf-8"))
+        account(aggregator.add(event))
+    account(aggregator.flush())
+
+    return {
+        'rows': len(df), 'window_s': window_s, 'deltas': deltas,
+        'raw': raw, 'aggregated': sent,
+        'messages_saved': raw['messages'] - sent['messages'],
+        'bytes_saved': raw['bytes'] - sent['bytes'],
+        'messages_saved_pct': round(100 * (1 - sent['messages'] / raw['messages']), 1),
+        'bytes_saved_pct': round(100 * (1 - sent['bytes'] / raw['bytes']), 1),
+    }
+
+def parse_deltas(items, disabled):
+    if disabled:
+        return {}
+    deltas = dict(EDGE_DELTAS)
+    for item in items or []:
+        column, _, value = item.partition('=')
+        deltas[column] = float(value)
+    return deltas
 
 def main():
+    parser = argparse.ArgumentParser(description="GreenField sensor producer")
+    parser.add_argument('--aggregate', action='store_true', help="riassunti per finestra invece di ogni lettura")
+    parser.add_argument('--window', type=float, default=WINDOW_S, help="durata della finestra in secondi")
+    parser.add_argument('--delta', action='append', metavar='COLONNA=VALORE',
+                        help="scostamento oltre cui la lettura parte subito grezza (ripetibile)")
+    parser.add_argument('--no-deltas', action='store_true', help="solo riassunti, nessun evento grezzo")
+    parser.add_argument('--replay', action='store_true', help="stampa byte e messaggi risparmiati sul dataset e termina")
+    args = parser.parse_args()
+
     try:
         df = load_dataset_robust("dataset/data_test.csv")
     except Exception as e:
         print(f"Errore caricamento dati: {e}")
         return
 
-    producer = build_producer()
-    print(f"Producer connected. Streaming {len(df)} rows to topic '{TOPIC}'...")
-
-    for idx, row in df.iterrows():
-        event = row.to_dict()
+    deltas = parse_deltas(args.delta, args.no_deltas)
+    if args.replay:
+        print(json.dumps(replay_report(df, args.window, deltas), indent=2))
+        return
 
-        # Metadati
-        event["_event_type"] = "sensor_reading"
-        event["_row_id"] = int(idx)
-        event["_ts"] = time.time()
+    bus = get_bus()
+    aggregator = WindowAggregator(args.window, deltas) if args.aggregate else None
+    mode = f"window {args.window:g}s" if aggregator else "raw"
+    print(f"Producer connected. Streaming {len(df)} rows to topic '{TOPIC}' ({mode})...")
 
-        producer.send(TOPIC, key="sensor", value=event)
-        print(f"[Producer] sent row={idx}")
-        time.sleep(5) 
+    for idx, row in df.iterrows():
+        event = build_event(row, idx, time.time())
+        payloads = [event] if aggregator is None else aggregator.add(event) + aggregator.flush(time.time())
+        for payload in payloads:
+            bus.publish(TOPIC, encode(payload), key=SENSOR_ID)
+        print(f"[Producer] sent row={idx} ({len(payloads)} msg)")
+        time.sleep(SEND_INTERVAL_S)
 
-    producer.flush()
-    producer.close()
+    if aggregator is not None:
+        for payload in aggregator.flush():
+            bus.publish(TOPIC, encode(payload), key=SENSOR_ID)
+    bus.close()
     print("Streaming completato.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,258 @@
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+# Strumentazione opzionale delle fasi (Handler.handle, ModelStrategy.predict,
+# ImageAnalysisStrategy.analyze): i metodi vengono avvolti solo quando attiva,
+# da spenta i metodi originali sono ripristinati e il costo è nullo.
+PROFILE_ENABLED_AT_START = os.environ.get("GREENFIELD_PROFILE", "0") == "1"
+SAMPLE_INTERVAL_S = 0.005
+SAMPLE_MAX_S = 120
+PROFILE_DIR = os.environ.get("GREENFIELD_PROFILE_DIR", "profiles")
+
+ENABLED = False
+
+_stats = {}
+_lock = threading.Lock()
+_local = threading.local()
+_originals = {}  # (classe, metodo) -> funzione originale
+_NULL = nullcontext()
+
+
+class StageStats:
+    """Contatori di una fase: chiamate, tempo totale, tempo proprio (senza sotto-fasi) e massimo."""
+    __slots__ = ('calls', 'total_ns', 'self_ns', 'max_ns')
+
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.self_ns = 0
+        self.max_ns = 0
+
+    def add(self, elapsed, child):
+        self.calls += 1
+        self.total_ns += elapsed
+        self.self_ns += elapsed - child
+        if elapsed > self.max_ns:
+            self.max_ns = elapsed
+
+    def to_dict(self):
+        calls = self.calls or 1
+        return {
+            'calls': self.calls,
+            'total_ms': round(self.total_ns / 1e6, 3),
+            'self_ms': round(self.self_ns / 1e6, 3),
+            'mean_us': round(self.total_ns / calls / 1e3, 2),
+            'max_ms': round(self.max_ns / 1e6, 3),
+        }
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _record(name, elapsed, child):
+    stats = _stats.get(name)
+    if stats is None:
+        with _lock:
+            stats = _stats.setdefault(name, StageStats())
+    stats.add(elapsed, child)
+
+
+class _Timer:
+    __slots__ = ('name', 't0')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _stack().append(0)
+        self.t0 = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter_ns() - self.t0
+        stack = _stack()
+        child = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        _record(self.name, elapsed, child)
+
+
+def stage(name):
+    """Context manager per fasi non coperte dai wrapper (es. serializzazione JSON)."""
+    return _Timer(name) if ENABLED else _NULL
+
+
+def _timed(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = _stack()
+        stack.append(0)
+        t0 = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter_ns() - t0
+            child = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            _record(name, elapsed, child)
+    return wrapper
+
+
+def _subclasses(base):
+    seen, todo = [], [base]
+    while todo:
+        cls = todo.pop()
+        if cls not in seen:
+            seen.append(cls)
+            todo.extend(cls.__subclasses__())
+    return seen
+
+
+def _targets():
+    """(classe base, metodo) da strumentare. La visione solo se già importata (evita di caricare TensorFlow)."""
+    from pipeline import Handler
+    from strategies_model import ModelStrategy
+    targets = [(Handler, 'handle'), (ModelStrategy, 'predict')]
+    vision = sys.modules.get('strategies_vision')
+    if vision is not None:
+        targets.append((vision.ImageAnalysisStrategy, 'analyze'))
+    return targets
+
+
+def enable():
+    """Avvolge i metodi delle classi (e sottoclassi) già definite. Idempotente."""
+    global ENABLED
+    with _lock:
+        for base, method in _targets():
+            for cls in _subclasses(base):
+                func = cls.__dict__.get(method)
+                if func is None or (cls, method) in _originals or getattr(func, '__isabstractmethod__', False):
+                    continue
+                _originals[(cls, method)] = func
+                setattr(cls, method, _timed(f"{cls.__name__}.{method}", func))
+        ENABLED = True
+
+
+def disable():
+    global ENABLED
+    with _lock:
+        for (cls, method), func in _originals.items():
+            setattr(cls, method, func)
+        _originals.clear()
+        ENABLED = False
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def snapshot():
+    """Statistiche correnti, ordinate per tempo proprio decrescente."""
+    with _lock:
+        items = [(name, s.to_dict()) for name, s in _stats.items()]
+    items.sort(key=lambda kv: kv[1]['self_ms'], reverse=True)
+    return {'enabled': ENABLED, 'stages': dict(items)}
+
+
+def format_report(snap=None):
+    snap = snapshot() if snap is None else snap
+    lines = [f"{'fase':<40} {'chiamate':>9} {'totale ms':>11} {'proprio ms':>11} {'media us':>10} {'max ms':>9}"]
+    for name, s in snap['stages'].items():
+        lines.append(f"{name:<40} {s['calls']:>9} {s['total_ms']:>11.1f} {s['self_ms']:>11.1f} "
+                     f"{s['mean_us']:>10.1f} {s['max_ms']:>9.2f}")
+    return "\n".join(lines)
+
+
+# PROFILER A CAMPIONAMENTO (stack di tutti i thread, formato "collapsed" per flamegraph.pl / speedscope)
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def sample(duration_s, interval_s=SAMPLE_INTERVAL_S):
+    """Campiona gli stack di tutti i thread per duration_s secondi. Restituisce (testo collapsed, n. campioni)."""
+    duration_s = min(float(duration_s), SAMPLE_MAX_S)
+    me = threading.get_ident()
+    counts = collections.Counter()
+    samples = 0
+    deadline = time.monotonic() + duration_s
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            counts[";".join(reversed(stack))] += 1
+        samples += 1
+        time.sleep(interval_s)
+    collapsed = "\n".join(f"{stack} {n}" for stack, n in counts.most_common())
+    return collapsed + "\n", samples
+
+
+def sample_to_file(duration_s, interval_s=SAMPLE_INTERVAL_S, out_dir=PROFILE_DIR):
+    collapsed, samples = sample(duration_s, interval_s)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"profile-{os.getpid()}-{int(time.time())}.folded")
+    with open(path, 'w') as f:
+        f.write(collapsed)
+    return path, samples
+
+
+def start_sampling(duration_s, interval_s=SAMPLE_INTERVAL_S):
+    """Campionamento in un thread separato (per handler di segnale e richieste HTTP)."""
+    def run():
+        path, samples = sample_to_file(duration_s, interval_s)
+        print(f"🔥 PROFILER: {samples} campioni in {path}")
+    t = threading.Thread(target=run, name="profiler-sampler", daemon=True)
+    t.start()
+    return t
+
+
+def install_signal_handlers(sample_s=10):
+    """
+    SIGUSR1: attiva i timer, oppure (se attivi) stampa il report e li disattiva.
+    SIGUSR2: profilo a campionamento di sample_s secondi su file.
+    Solo nel thread principale e su sistemi POSIX.
+    """
+    import signal
+    if not hasattr(signal, 'SIGUSR1') or threading.current_thread() is not threading.main_thread():
+        return False
+
+    toggle_lock = threading.Lock()
+
+    def toggle():
+        with toggle_lock:
+            if ENABLED:
+                print("📊 PROFILER:\n" + format_report())
+                disable()
+            else:
+                reset()
+                enable()
+                print("📊 PROFILER: timer attivi (SIGUSR1 di nuovo per il report)")
+
+    def on_usr1(signum, frame):
+        # Il gestore gira sul thread principale, che può essere dentro _lock (_record, reset):
+        # il lavoro va in un thread a parte, che attende il rilascio invece di bloccare il processo
+        threading.Thread(target=toggle, name="profiler-toggle", daemon=True).start()
+
+    def on_usr2(signum, frame):
+        start_sampling(sample_s)
+
+    signal.signal(signal.SIGUSR1, on_usr1)
+    signal.signal(signal.SIGUSR2, on_usr2)
+    return True
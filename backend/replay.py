@@ -0,0 +1,221 @@
+"""
+REPLAY / BACKFILL OFFLINE DELL'ANALYZER
+
+Rielabora uno storico (CSV oppure un intervallo di offset Kafka) con la stessa
+logica dell'analyzer (Regole + AI), senza sleep né WebSocket, a blocchi vettorizzati.
+
+Esempi:
+    python replay.py --input dataset/data_test.csv --output replay_default.csv
+    python replay.py --input dataset/data_test.csv --config nuove_soglie.json --output replay_new.csv
+    python replay.py --kafka sensor-data:0:0:50000 --output replay_kafka.jsonl
+    python replay.py --diff replay_default.summary.json replay_new.summary.json
+"""
+import argparse
+import json
+import os
+import time
+import pandas as pd
+import numpy as np
+from window_aggregation import is_window, window_to_reading
+
+DEFAULT_BATCH_SIZE = 50000
+# Secondi senza messaggi dopo i quali il replay Kafka si ferma (broker irraggiungibile)
+KAFKA_IDLE_TIMEOUT_S = 30.0
+
+# Colonne di output (0/1) e chiavi del riepilogo ON per target
+RULE_TARGETS = ['irrigation', 'energy', 'N', 'P', 'K']
+AI_TARGETS = ['irrigation', 'energy', 'fertilization']
+
+
+def iter_csv_batches(path, batch_size):
+    from data_loader import load_dataset_robust
+    df = load_dataset_robust(path)
+    for start in range(0, len(df), batch_size):
+        yield df.iloc[start:start + batch_size]
+
+
+def iter_kafka_batches(spec, batch_size, bootstrap="localhost:9092"):
+    """
+    spec = 'topic:partizione:offset_inizio:offset_fine' (fine esclusa, -1 = fino all'high watermark).
+    Si ferma all'high watermark anche se la fine richiesta è oltre, e dopo KAFKA_IDLE_TIMEOUT_S
+    secondi senza messaggi.
+    """
+    from confluent_kafka import Consumer, TopicPartition
+    topic, partition, start, end = spec.split(':')
+    partition, start, end = int(partition), int(start), int(end)
+
+    consumer = Consumer({
+        'bootstrap.servers': bootstrap,
+        'group.id': f"analyzer-replay-{os.getpid()}",
+        'enable.auto.commit': False,
+    })
+    tp = TopicPartition(topic, partition)
+    if end < 0:
+        _, end = consumer.get_watermark_offsets(tp, timeout=10)
+    consumer.assign([TopicPartition(topic, partition, start)])
+
+    rows, offset = [], start
+    idle_since = time.monotonic()
+    try:
+        while offset < end:
+            msgs = consumer.consume(num_messages=min(batch_size, end - offset), timeout=1.0)
+            if not msgs:
+                # Gli ultimi offset possono non arrivare mai (marker transazionali, compaction,
+                # fine oltre l'high watermark): ci si riallinea alla posizione del consumer
+                offset = max(offset, consumer.position([tp])[0].offset)
+                _, high = consumer.get_watermark_offsets(tp, timeout=10)
+                if offset >= high:
+                    if offset < end:
+                        print(f"⚠️ Replay Kafka: fine partizione a {offset}, richiesto fino a {end}")
+                    break
+                if time.monotonic() - idle_since > KAFKA_IDLE_TIMEOUT_S:
+                    print(f"⚠️ Replay Kafka: nessun messaggio da {KAFKA_IDLE_TIMEOUT_S:.0f}s, interrotto a {offset}")
+                    break
+                continue
+            idle_since = time.monotonic()
+            for msg in msgs:
+                if msg.error():
+                    continue
+                offset = msg.offset() + 1
+                if msg.offset() >= end:
+                    continue
+                payload = json.loads(msg.value().decode('utf-8'))
+                # Riassunti di finestra del producer (--aggregate): decodificati come nell'analyzer
+                if is_window(payload):
+                    payload = window_to_reading(payload)
+                    if payload is None:  # ultima lettura della finestra già arrivata grezza
+                        continue
+                rows.append(payload)
+            if len(rows) >= batch_size:
+                yield pd.DataFrame(rows)
+                rows = []
+        if rows:
+            yield pd.DataFrame(rows)
+    finally:
+        consumer.close()
+
+
+def score_batch(df):
+    """Valuta un batch e restituisce un DataFrame compatto di esiti 0/1."""
+    import analyzer
+    rules = analyzer.evaluate_rules(df)
+    ai = analyzer.evaluate_ai(df)
+
+    out = pd.DataFrame(index=df.index)
+    out['ts'] = df['_ts'] if '_ts' in df.columns else df.get('ts', np.nan)
+    out['sensor_id'] = df['sensor_id'] if 'sensor_id' in df.columns else 'sensor'
+    for k in RULE_TARGETS:
+        out[f'rules.{k}'] = rules[k]
+    for k in AI_TARGETS:
+        out[f'ai.{k}'] = ai[k] if ai is not None else 0
+    return out, rules, ai
+
+
+def write_batch(out_path, df, scored, rules, ai, first):
+    if out_path.endswith('.jsonl'):
+        import analyzer
+        mode = 'w' if first else 'a'
+        records = df.to_dict('records')
+        with open(out_path, mode) as f:
+            for i, data in enumerate(records):
+                packet = analyzer.build_advice_packet(data, rules, ai, i)
+                f.write(json.dumps(packet) + "\n")
+    else:
+        scored.to_csv(out_path, mode='w' if first else 'a', header=first, index=False)
+
+
+def run_replay(batches, out_path, config=None):
+    import analyzer
+    refit_s = None
+    if config is not None:
+        analyzer.SYSTEM_CONFIG.update(config)
+        analyzer.apply_config(analyzer.SYSTEM_CONFIG)
+        # Come l'analyzer live: i modelli AI si riaddestrano sulle etichette delle nuove soglie
+        if analyzer.DF_TRAIN is not None and analyzer.AI_MODELS is not None:
+            t_refit = time.perf_counter()
+            analyzer.install_models(analyzer.train_ai_models(
+                analyzer.DF_TRAIN, analyzer.configured_rules(analyzer.SYSTEM_CONFIG), analyzer.AI_MODELS))
+            refit_s = round(time.perf_counter() - t_refit, 3)
+
+    counts = {f'rules.{k}': 0 for k in RULE_TARGETS}
+    counts.update({f'ai.{k}': 0 for k in AI_TARGETS})
+    n_rows = 0
+    t0 = time.perf_counter()
+
+    for df in batches:
+        df = df.reset_index(drop=True)
+        scored, rules, ai = score_batch(df)
+        write_batch(out_path, df, scored, rules, ai, first=(n_rows == 0))
+        for col in counts:
+            counts[col] += int(scored[col].sum())
+        n_rows += len(df)
+
+    elapsed = time.perf_counter() - t0
+    summary = {
+        'rows': n_rows,
+        'elapsed_s': round(elapsed, 3),
+        'refit_s': refit_s,
+        'rows_per_s': round(n_rows / elapsed, 1) if elapsed > 0 else None,
+        'thresholds': {
+            'moisture_threshold': analyzer.rule_irr.m_thr,
+            'temp_min': analyzer.rule_en.tmin_thr, 'temp_max': analyzer.rule_en.tmax_thr,
+            'n_threshold': analyzer.rule_fert.n_thr, 'p_threshold': analyzer.rule_fert.p_thr,
+            'k_threshold': analyzer.rule_fert.k_thr,
+        },
+        'on_counts': counts,
+    }
+    summary_path = os.path.splitext(out_path)[0] + ".summary.json"
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"✅ REPLAY: {n_rows} righe in {elapsed:.2f}s -> {out_path}")
+    print(f"   Riepilogo: {summary_path}")
+    return summary
+
+
+def diff_summaries(path_a, path_b):
+    with open(path_a) as f: a = json.load(f)
+    with open(path_b) as f: b = json.load(f)
+
+    print(f"{'TARGET':<20} | {'A':>8} | {'B':>8} | {'DELTA':>8}")
+    print("-" * 54)
+    for key in a['on_counts']:
+        ca, cb = a['on_counts'][key], b['on_counts'].get(key, 0)
+        print(f"{key:<20} | {ca:>8} | {cb:>8} | {cb - ca:>+8}")
+
+    changed = {k: (a['thresholds'][k], b['thresholds'][k])
+               for k in a['thresholds'] if a['thresholds'][k] != b['thresholds'].get(k)}
+    if changed:
+        print("\nSoglie modificate: " + ", ".join(f"{k}: {va} -> {vb}" for k, (va, vb) in changed.items()))
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay offline dell'analyzer (Regole + AI)")
+    src = parser.add_mutually_exclusive_group()
+    src.add_argument('--input', help="CSV storico da rielaborare")
+    src.add_argument('--kafka', help="topic:partizione:offset_inizio:offset_fine")
+    parser.add_argument('--config', help="JSON con le soglie (stesso formato di /api/settings)")
+    parser.add_argument('--output', default="replay_advice.csv", help=".csv (esiti 0/1) oppure .jsonl (pacchetti advice)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--diff', nargs=2, metavar=('A', 'B'), help="Confronta due riepiloghi .summary.json")
+    args = parser.parse_args()
+
+    if args.diff:
+        diff_summaries(*args.diff)
+        return
+
+    config = None
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+
+    if args.kafka:
+        batches = iter_kafka_batches(args.kafka, args.batch_size)
+    else:
+        batches = iter_csv_batches(args.input or "dataset/data_test.csv", args.batch_size)
+    run_replay(batches, args.output, config)
+
+
+if __name__ == "__main__":
+    main()
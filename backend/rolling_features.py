@@ -0,0 +1,159 @@
+import numpy as np
+
+# Feature di tendenza per sensore, aggiornate in O(1) a ogni lettura
+ROLLING_WINDOW = 12        # letture usate per la pendenza dell'umidità
+TEMP_EWMA_ALPHA = 0.2
+WETTING_RISE_PCT = 5.0     # risalita dell'umidità che azzera l'ET cumulata (irrigazione o pioggia)
+ROLLING_FEATURES = ['moisture_slope', 'et_cum_mm', 'temp_ewma']
+
+
+def _float_column(readings, key):
+    out = np.full(len(readings), np.nan)
+    for i, r in enumerate(readings):
+        v = r.get(key)
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[i] = v
+    return out
+
+
+class RollingFeatureStore:
+    """
+    Stato di tendenza per sensore in array NumPy preallocati (una riga per sensore):
+    ring buffer delle ultime 'window' umidità con le somme della regressione lineare
+    (pendenza in %/lettura senza ripercorrere il buffer), ET cumulata dall'ultima
+    bagnatura ed EWMA della temperatura. Memoria: (window + 8) float64 per sensore.
+    """
+    def __init__(self, window=ROLLING_WINDOW, alpha=TEMP_EWMA_ALPHA, wetting_rise=WETTING_RISE_PCT, capacity=1024):
+        self.window = window
+        self.alpha = alpha
+        self.wetting_rise = wetting_rise
+        self.rows = {}
+        self.capacity = 0
+        self.updates = 0
+        self._grow(capacity)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        def more(name, fill, shape=(), dtype=np.float64):
+            block = np.full((extra,) + shape, fill, dtype=dtype)
+            old = getattr(self, name, None)
+            setattr(self, name, block if old is None else np.concatenate([old, block]))
+        more('ring', np.nan, (self.window,))
+        more('pos', 0, dtype=np.int32)
+        more('count', 0, dtype=np.int32)
+        more('s_y', 0.0)        # somma delle umidità nella finestra
+        more('s_ky', 0.0)       # somma di k * umidità, k = 0 per la più vecchia
+        more('last_moisture', np.nan)
+        more('et_cum', 0.0)
+        more('temp_ewma', np.nan)
+        self.capacity = capacity
+
+    def _rows_for(self, sensor_ids):
+        rows = np.empty(len(sensor_ids), dtype=np.intp)
+        index = self.rows
+        for i, sensor_id in enumerate(sensor_ids):
+            row = index.get(sensor_id)
+            if row is None:
+                row = index[sensor_id] = len(index)
+            rows[i] = row
+        if len(index) > self.capacity:
+            self._grow(max(len(index), 2 * self.capacity))
+        return rows
+
+    def update(self, sensor_ids, moisture, et, temperature):
+        """
+        Aggiorna lo stato con un batch di letture (in ordine di arrivo) e restituisce,
+        per ogni lettura, le feature (n, 3) subito dopo averla inclusa. Le letture dello
+        stesso sensore sono applicate a turni: al turno r la r-esima di ogni sensore.
+        """
+        n = len(sensor_ids)
+        out = np.zeros((n, len(ROLLING_FEATURES)))
+        if n == 0:
+            return out
+        rows = self._rows_for(sensor_ids)
+        moisture, et, temperature = (np.asarray(a, dtype=float) for a in (moisture, et, temperature))
+
+        order = np.argsort(rows, kind='stable')
+        s_rows = rows[order]
+        first = np.ones(n, dtype=bool)
+        first[1:] = s_rows[1:] != s_rows[:-1]
+        rank = np.empty(n, dtype=np.intp)
+        rank[order] = np.arange(n) - np.maximum.accumulate(np.where(first, np.arange(n), 0))
+
+        for r in range(int(rank.max()) + 1):
+            idx = np.flatnonzero(rank == r)  # al più una lettura per sensore
+            out[idx] = self._step(rows[idx], moisture[idx], et[idx], temperature[idx])
+        self.updates += n
+        return out
+
+    def update_readings(self, readings):
+        return self.update([r.get('sensor_id', 'sensor') for r in readings],
+                           _float_column(readings, 'Soil_moisture_pct'),
+                           _float_column(readings, 'Evapotranspiration_mm'),
+                           _float_column(readings, 'Temperature_C'))
+
+    def _step(self, rows, moisture, et, temperature):
+        w = self.window
+        # 1. Umidità: ring buffer + somme della regressione (solo letture con umidità valida)
+        ok = ~np.isnan(moisture)
+        r, y = rows[ok], moisture[ok]
+        cnt, pos = self.count[r], self.pos[r]
+        full = cnt == w
+        old = np.where(full, self.ring[r, pos], 0.0)
+        # Finestra piena: tutte le k scalano di uno, la più vecchia esce, la nuova entra con k = w-1
+        self.s_ky[r] = np.where(full, self.s_ky[r] - (self.s_y[r] - old) + (w - 1) * y, self.s_ky[r] + cnt * y)
+        self.s_y[r] += y - old
+        self.ring[r, pos] = y
+        self.pos[r] = (pos + 1) % w
+        self.count[r] = np.minimum(cnt + 1, w)
+
+        # A ogni giro completo del buffer le somme vengono ricalcolate (niente deriva numerica)
+        wrap = r[(self.pos[r] == 0) & (self.count[r] == w)]
+        if wrap.size:
+            self.s_y[wrap] = self.ring[wrap].sum(axis=1)
+            self.s_ky[wrap] = self.ring[wrap] @ np.arange(w)
+
+        # 2. ET cumulata dall'ultima bagnatura (risalita dell'umidità oltre wetting_rise)
+        with np.errstate(invalid='ignore'):
+            wet = (y - self.last_moisture[r]) >= self.wetting_rise
+        self.et_cum[r[wet]] = 0.0
+        self.last_moisture[r] = y
+        self.et_cum[rows] += np.nan_to_num(et)
+
+        # 3. EWMA della temperatura (il primo valore inizializza la media)
+        t_ok = ~np.isnan(temperature)
+        tr, t = rows[t_ok], temperature[t_ok]
+        prev = self.temp_ewma[tr]
+        self.temp_ewma[tr] = np.where(np.isnan(prev), t, self.alpha * t + (1 - self.alpha) * prev)
+
+        return np.column_stack([self.slope(rows), self.et_cum[rows], np.nan_to_num(self.temp_ewma[rows])])
+
+    def slope(self, rows):
+        """Pendenza ai minimi quadrati dell'umidità sulle letture in finestra (0 con meno di due letture)."""
+        m = self.count[rows].astype(float)
+        s_x = m * (m - 1) / 2
+        s_xx = (m - 1) * m * (2 * m - 1) / 6
+        den = m * s_xx - s_x ** 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(den > 0, (m * self.s_ky[rows] - s_x * self.s_y[rows]) / den, 0.0)
+
+    def memory_bytes(self):
+        return sum(getattr(self, name).nbytes for name in
+                   ('ring', 'pos', 'count', 's_y', 's_ky', 'last_moisture', 'et_cum', 'temp_ewma'))
+
+    def snapshot(self):
+        return {'sensors': len(self.rows), 'capacity': self.capacity, 'updates': self.updates,
+                'window': self.window, 'memory_bytes': self.memory_bytes()}
+
+
+def rolling_frame(df, sensor_col='sensor_id'):
+    """Feature di tendenza per un DataFrame storico in ordine temporale (es. il set di training)."""
+    n = len(df)
+    sensors = df[sensor_col].tolist() if sensor_col in df.columns else ['train'] * n
+    col = lambda c: df[c].to_numpy(dtype=float) if c in df.columns else np.full(n, np.nan)
+    feats = RollingFeatureStore().update(sensors, col('Soil_moisture_pct'), col('Evapotranspiration_mm'),
+                                         col('Temperature_C'))
+    return {name: feats[:, j] for j, name in enumerate(ROLLING_FEATURES)}
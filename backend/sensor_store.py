@@ -0,0 +1,166 @@
+import sqlite3
+import threading
+import time
+
+# Risoluzioni dei rollup pre-aggregati (nome -> ampiezza bucket in secondi)
+ROLLUPS = {'1m': 60, '1h': 3600}
+
+# Oltre questo intervallo le query "auto" passano dai bucket da 1 minuto a quelli orari
+AUTO_1M_MAX_SPAN_S = 2 * 24 * 3600
+
+# Le letture grezze vengono potate dopo una settimana (i rollup restano)
+RAW_RETENTION_S = 7 * 24 * 3600
+
+FLUSH_MAX_PENDING = 500
+FLUSH_INTERVAL_S = 1.0
+
+
+def extract_reading(payload):
+    """Estrae (sensor_id, ts, {metrica: valore}) da un evento 'sensor-data'."""
+    sensor_id = str(payload.get('sensor_id', 'sensor'))
+    ts = float(payload.get('_ts') or payload.get('ts') or time.time())
+    values = {}
+    for k, v in payload.items():
+        if k.startswith('_') or k in ('ts', 'sensor_id') or isinstance(v, bool):
+            continue
+        if isinstance(v, (int, float)):
+            values[k] = float(v)
+    return sensor_id, ts, values
+
+
+class SensorHistoryStore:
+    """
+    Storico time-series delle letture sensori su SQLite (WAL).
+    Le righe sono partizionate per (sensor_id, metrica, tempo) e ad ogni flush
+    vengono aggiornati i rollup 1m/1h (min/max/somma/conteggio), così le query
+    sui cruscotti leggono solo i bucket pre-aggregati.
+    """
+    def __init__(self, db_path="sensor_history.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.time()
+        self._last_prune = 0.0
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS raw (
+                sensor_id TEXT NOT NULL, metric TEXT NOT NULL, ts REAL NOT NULL, value REAL NOT NULL,
+                PRIMARY KEY (sensor_id, metric, ts)
+            ) WITHOUT ROWID""")
+        for name in ROLLUPS:
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS rollup_{name} (
+                    sensor_id TEXT NOT NULL, metric TEXT NOT NULL, bucket INTEGER NOT NULL,
+                    n INTEGER NOT NULL, total REAL NOT NULL, vmin REAL NOT NULL, vmax REAL NOT NULL,
+                    PRIMARY KEY (sensor_id, metric, bucket)
+                ) WITHOUT ROWID""")
+        self.conn.commit()
+
+    # SCRITTURA
+
+    def append(self, sensor_id, ts, values):
+        """Accoda una lettura; la scrittura su disco avviene a blocchi in flush()."""
+        with self._lock:
+            self._pending.append((sensor_id, ts, values))
+            if len(self._pending) >= FLUSH_MAX_PENDING:
+                self._flush_locked()
+
+    def append_event(self, payload):
+        sensor_id, ts, values = extract_reading(payload)
+        if values:
+            self.append(sensor_id, ts, values)
+
+    def maybe_flush(self):
+        """Da chiamare periodicamente dal loop di consumo."""
+        if self._pending and time.time() - self._last_flush >= FLUSH_INTERVAL_S:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.time()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+
+        # Pre-aggregazione in memoria: un solo upsert per bucket anche con molte letture.
+        # Nei rollup entrano solo le righe grezze nuove: una lettura riconsegnata dal bus
+        # (stesso sensore, metrica e ts) viene ignorata e non raddoppia n/total
+        deltas = {name: {} for name in ROLLUPS}
+        with self.conn:
+            cur = self.conn.cursor()
+            for sensor_id, ts, values in pending:
+                for metric, value in values.items():
+                    cur.execute("INSERT OR IGNORE INTO raw VALUES (?, ?, ?, ?)", (sensor_id, metric, ts, value))
+                    if cur.rowcount != 1:
+                        continue
+                    for name, width in ROLLUPS.items():
+                        key = (sensor_id, metric, int(ts // width) * width)
+                        agg = deltas[name].get(key)
+                        if agg is None:
+                            deltas[name][key] = [1, value, value, value]
+                        else:
+                            agg[0] += 1
+                            agg[1] += value
+                            if value < agg[2]: agg[2] = value
+                            if value > agg[3]: agg[3] = value
+
+            for name, agg_map in deltas.items():
+                self.conn.executemany(f"""
+                    INSERT INTO rollup_{name} (sensor_id, metric, bucket, n, total, vmin, vmax)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (sensor_id, metric, bucket) DO UPDATE SET
+                        n = n + excluded.n,
+                        total = total + excluded.total,
+                        vmin = MIN(vmin, excluded.vmin),
+                        vmax = MAX(vmax, excluded.vmax)""",
+                    [(s, m, b, a[0], a[1], a[2], a[3]) for (s, m, b), a in agg_map.items()])
+
+        if self._last_flush - self._last_prune > 3600:
+            self._last_prune = self._last_flush
+            with self.conn:
+                self.conn.execute("DELETE FROM raw WHERE ts < ?", (self._last_flush - RAW_RETENTION_S,))
+
+    # LETTURA
+
+    def query_range(self, sensor_id, metrics, start, end, resolution='auto'):
+        """
+        Restituisce {metrica: [{ts, min, max, mean, count}, ...]} letti dai rollup.
+        resolution: '1m', '1h' oppure 'auto' (scelta in base all'ampiezza dell'intervallo).
+        """
+        if resolution == 'auto':
+            resolution = '1m' if (end - start) <= AUTO_1M_MAX_SPAN_S else '1h'
+        if resolution not in ROLLUPS:
+            raise ValueError(f"Risoluzione non supportata: {resolution}")
+        width = ROLLUPS[resolution]
+        first_bucket = int(start // width) * width
+
+        self.flush()
+        out = {}
+        with self._lock:
+            for metric in metrics:
+                rows = self.conn.execute(f"""
+                    SELECT bucket, vmin, vmax, total / n, n FROM rollup_{resolution}
+                    WHERE sensor_id = ? AND metric = ? AND bucket >= ? AND bucket <= ?
+                    ORDER BY bucket""", (sensor_id, metric, first_bucket, end)).fetchall()
+                out[metric] = [{'ts': b, 'min': lo, 'max': hi, 'mean': mean, 'count': n}
+                               for b, lo, hi, mean, n in rows]
+        return out
+
+    def list_sensors(self):
+        self.flush()
+        with self._lock:
+            rows = self.conn.execute("SELECT DISTINCT sensor_id, metric FROM rollup_1h").fetchall()
+        sensors = {}
+        for sensor_id, metric in rows:
+            sensors.setdefault(sensor_id, []).append(metric)
+        return sensors
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -1,13 +1,26 @@
+import atexit
 import json
+import math
 import threading
 import time
 import os
+import uuid
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from flask_socketio import SocketIO
-from confluent_kafka import Consumer, Producer
+from flask_socketio import SocketIO, emit
+from message_bus import get_bus
 from werkzeug.utils import secure_filename
-from strategies_vision import DeepLearningVisionStrategy, GreenFieldImageAdvisor
+from strategies_vision import GreenFieldImageAdvisor, build_vision_strategy
+from sensor_store import SensorHistoryStore, ROLLUPS
+from thresholds import THRESHOLD_COLUMNS, ThresholdTable, validate_settings
+from strategies_model import RuleBasedStrategy
+from window_aggregation import is_window, window_to_reading
+from control_plane import SENT_TS_KEY
+from latest_state import LatestStateView, SNAPSHOT_EVENT, DELTA_EVENT, VERSION_KEY
+from vision_pool import VisionWorkerPool, VisionBusy, VisionUnavailable, VISION_REPLICAS
+from model_registry import ModelWatcher, artifact, canary_images, check_vision_canary, read_current
+import profiling
+import water_balance
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret_greenfield'
@@ -19,53 +32,164 @@ UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Kafka Producer (Per inviare i settings all'Analyzer)
-producer = Producer({'bootstrap.servers': 'localhost:9092'})
+# Bus (Per inviare i settings all'Analyzer e ricevere sensori/advice)
+bus = get_bus()
 
-# Vision AI Init (Caricata solo se presente)
+# Soglie per sensore/fase: voci per messaggio system-settings
+THRESHOLD_PATCH_CHUNK = 5000
+THRESHOLD_PATCH_MAX_BYTES = 64 * 1024  # sotto il limite dei datagrammi del bus locale (e di Kafka)
+
+# Copia delle soglie configurate (system-settings, da qualsiasi gateway) per il pianificatore irriguo:
+# parte dai default delle regole, come l'analyzer prima del primo aggiornamento
+_rules = RuleBasedStrategy('Irrigation')
+configured_thresholds = ThresholdTable({
+    "moisture_threshold": _rules.m_thr, "temp_min": _rules.tmin_thr, "temp_max": _rules.tmax_thr,
+    "n_threshold": _rules.n_thr, "p_threshold": _rules.p_thr, "k_threshold": _rules.k_thr})
+# Ultimo stato per sensore (lettura + advice): snapshot per i dashboard appena connessi,
+# poi i normali eventi 'sensor'/'ai_advice' con la versione in VERSION_KEY come delta
+state_view = LatestStateView()
+
+# Storico Sensori (SQLite WAL + rollup 1m/1h per i cruscotti)
+HISTORY_DB_PATH = "sensor_history.db"
+history_store = SensorHistoryStore(HISTORY_DB_PATH)
+
+# Vision AI Init (Caricata solo se presente): repliche in processi separati, o nel gateway con 0 repliche.
+# La versione corrente del registro dei modelli, se c'è, sostituisce il file di default.
+VISION_MODEL, VISION_LABELS = "greenfield_agri_brain.h5", "class_indices.json"
+vision_manifest = read_current('vision')
+if vision_manifest is not None:
+    VISION_MODEL, VISION_LABELS = artifact(vision_manifest, 'model'), artifact(vision_manifest, 'labels')
 vision_advisor = None
+vision_pool = None
 try:
-    if os.path.exists("greenfield_agri_brain.h5"):
-        vision_strat = DeepLearningVisionStrategy("greenfield_agri_brain.h5", "class_indices.json")
-        vision_advisor = GreenFieldImageAdvisor(vision_strat)
-        print("✅ VISION: Modello caricato nel Gateway.")
+    if os.path.exists(VISION_MODEL):
+        if VISION_REPLICAS > 0:
+            vision_pool = VisionWorkerPool(VISION_MODEL, VISION_LABELS,
+                                           version=vision_manifest['version'] if vision_manifest else None).start()
+            atexit.register(vision_pool.close)
+            vision_advisor = GreenFieldImageAdvisor(vision_pool)
+            print(f"✅ VISION: {VISION_REPLICAS} repliche del modello in avvio (warm-up in corso).")
+        else:
+            vision_strat = build_vision_strategy(VISION_MODEL, VISION_LABELS)
+            vision_advisor = GreenFieldImageAdvisor(vision_strat)
+            print("✅ VISION: Modello caricato nel Gateway.")
 except Exception as e:
     print(f"⚠️ Vision non attiva: {e}")
 
+# Cambio di modello a caldo: nuove versioni del registro caricate accanto a quella in servizio,
+# validate sulle immagini canary e scambiate fra una richiesta e l'altra (nessun client disconnesso)
+def load_vision_model(manifest):
+    model, labels = artifact(manifest, 'model'), artifact(manifest, 'labels')
+    if vision_pool is not None:
+        return vision_pool.stage(model, labels, manifest['version'], canary_images())
+    strategy = build_vision_strategy(model, labels)
+    if not strategy.is_custom_ready:
+        raise ValueError(f"modello {model} non caricato")
+    strategy.warm_up()
+    return strategy
+
+def validate_vision_model(candidate):
+    if vision_pool is not None:
+        return check_vision_canary(vision_pool.canary_results(candidate), candidate.labels_map)
+    return check_vision_canary([candidate.analyze(path) for path in canary_images()], candidate.labels_map)
+
+def install_vision_model(candidate):
+    global vision_advisor
+    if vision_pool is not None:
+        return vision_pool.install(candidate)
+    if vision_advisor is None or candidate is None:
+        # Primo modello senza un .h5 all'avvio, o rollback a nessun modello
+        previous = vision_advisor.vision_strategy if vision_advisor else None
+        vision_advisor = GreenFieldImageAdvisor(candidate) if candidate is not None else None
+        return previous
+    previous, vision_advisor.vision_strategy = vision_advisor.vision_strategy, candidate
+    return previous
+
+vision_models = ModelWatcher('vision', load_vision_model, validate_vision_model, install_vision_model,
+                             discard=vision_pool.discard if vision_pool is not None else None,
+                             errors=(lambda: vision_pool.failed) if vision_pool is not None else None)
+vision_models.version = vision_manifest['version'] if vision_manifest is not None else None
+vision_models.start(bus, 'gateway-models-v1', threading.Event())
+
+# Ultime metriche ricevute per servizio (es. lag e modalità dell'analyzer)
+METRICS_TOPIC = 'system-metrics'
+service_metrics = {}
+
 # GATEWAY LOOP: Ascolta Risultati e Sensori -> Invia al Frontend
 def gateway_listener():
-    # Gruppo diverso dall'analyzer così entrambi ricevono i messaggi
-    conf = {
-        'bootstrap.servers': 'localhost:9092', 
-        'group.id': 'gateway-frontend-v1', 
-        'auto.offset.reset': 'latest'
-    }
-    consumer = Consumer(conf)
-    
-    # Ascoltiamo:
+    # Ascoltiamo (gruppo diverso dall'analyzer così entrambi ricevono i messaggi):
     # 1. sensor-data: per aggiornare i grafici raw in tempo reale
     # 2. system-advice: per ricevere le decisioni elaborate dall'Analyzer
-    consumer.subscribe(['sensor-data', 'system-advice'])
-    print("🟢 GATEWAY: In ascolto su Kafka (Bridge verso WebSocket)...")
+    # 3. system-metrics: lag e modalità dei servizi (esposte su /api/metrics)
+    # 4. system-settings: soglie configurate, usate dal pianificatore irriguo
+    subscription = bus.subscribe(['sensor-data', 'system-advice', METRICS_TOPIC, 'system-settings'],
+                                 'gateway-frontend-v1')
+    print("🟢 GATEWAY: In ascolto sul bus (Bridge verso WebSocket)...")
 
     while True:
-        msg = consumer.poll(0.1)
-        if msg is None or msg.error(): continue
+        msg = subscription.poll(0.1)
+        history_store.maybe_flush()
+        if msg is None: continue
 
-        topic = msg.topic()
-        payload = json.loads(msg.value().decode('utf-8'))
+        topic = msg.topic
+        payload = json.loads(msg.value.decode('utf-8'))
 
-        if topic == 'sensor-data':
-            # Inoltra il dato grezzo al frontend per i grafici
+        if topic == 'sensor-data' and is_window(payload):
+            # Riassunto di finestra dal producer: grafici e storico ricevono l'ultima lettura
+            reading = window_to_reading(payload)
+            if reading is not None:
+                history_store.append_event(reading)
+                reading[VERSION_KEY] = state_view.update_reading(reading['sensor_id'], json.dumps(reading).encode('utf-8'))
+                socketio.emit('sensor', reading)
+
+        elif topic == 'sensor-data':
+            # Persistenza nello storico (scrittura a blocchi)
+            history_store.append_event(payload)
+            # Inoltra il dato grezzo al frontend per i grafici (byte originali nella vista)
+            payload[VERSION_KEY] = state_view.update_reading(payload.get('sensor_id', 'sensor'), msg.value)
             socketio.emit('sensor', payload)
+
+        elif topic == 'system-settings':
+            # Messaggi da qualsiasi produttore: uno non valido non deve fermare il listener
+            try:
+                validate_settings(payload)
+            except ValueError as e:
+                print(f"⚠️ Settings non validi ignorati dal gateway: {e}")
+                continue
+            entries = payload.get('thresholds')
+            if entries:
+                configured_thresholds.patch(entries)
+            configured_thresholds.set_default({k: v for k, v in payload.items() if k in THRESHOLD_COLUMNS})
         
+        elif topic == 'system-advice' and payload.get('heartbeat'):
+            # Lettura invariata: l'ultimo advice del sensore resta valido
+            socketio.emit('advice_heartbeat', payload)
+
         elif topic == 'system-advice':
             # Inoltra il consiglio elaborato (Regole + AI) al frontend
+            payload[VERSION_KEY] = state_view.update_advice(payload.get('sensor_id', 'sensor'), msg.value)
             socketio.emit('ai_advice', payload)
 
+        elif topic == METRICS_TOPIC:
+            service_metrics[payload.get('service', 'unknown')] = payload
+            socketio.emit('metrics', payload)
+
+# Profiling opzionale delle fasi (GREENFIELD_PROFILE=1, oppure /api/debug/profile)
+if profiling.PROFILE_ENABLED_AT_START:
+    profiling.enable()
+
 # Avvia il listener in background
 threading.Thread(target=gateway_listener, daemon=True).start()
 
+@socketio.on('connect')
+def send_state_snapshot():
+    # Dashboard appena connesso: tutto lo stato in un solo messaggio (JSON già codificato),
+    # più i sensori cambiati dopo lo snapshot se questo è una copia recente ma non aggiornata
+    version, body = state_view.snapshot()
+    emit(SNAPSHOT_EVENT, body.decode('utf-8'))
+    if state_view.version > version:
+        emit(DELTA_EVENT, state_view.delta(version)[1].decode('utf-8'))
+
 # API ENDPOINTS
 
 @app.route('/api/settings', methods=['POST'])
@@ -73,15 +197,155 @@ def update_settings():
     try:
         data = request.json
         print(f"🔄 UTENTE CAMBIA SETTINGS: {data}")
+        try:
+            validate_settings(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        producer.produce('system-settings', json.dumps(data).encode('utf-8'))
-        producer.flush()
+        # Istante di invio: l'analyzer misura dopo quanto la modifica diventa effettiva
+        bus.publish('system-settings', json.dumps({**data, SENT_TS_KEY: time.time()}).encode('utf-8'))
+        bus.flush()
         
         return jsonify({"status": "sent_to_queue"}), 200
     except Exception as e:
         print(f"❌ Errore API Settings: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/settings/thresholds', methods=['PATCH'])
+def patch_thresholds():
+    """
+    Soglie per sensore/campo e fase colturale: [{"sensor_id", "crop_stage", <soglia>: valore | null, "delete"}].
+    Le voci omesse restano invariate; inviate all'analyzer a blocchi (limite di dimensione dei messaggi Kafka).
+    """
+    data = request.json
+    entries = data.get('entries') if isinstance(data, dict) else data
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"error": "atteso un elenco non vuoto di voci"}), 400
+    # Stessa validazione del piano di controllo: una voce scartata là farebbe perdere l'intero blocco
+    try:
+        validate_settings({"thresholds": entries})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def send(chunk):
+        bus.publish('system-settings', json.dumps({"thresholds": chunk, SENT_TS_KEY: time.time()}).encode('utf-8'))
+
+    # Blocchi limitati sia per numero di voci sia per dimensione del messaggio
+    chunk, size = [], 0
+    for entry in entries:
+        entry_size = len(json.dumps(entry)) + 2
+        if chunk and (len(chunk) >= THRESHOLD_PATCH_CHUNK or size + entry_size > THRESHOLD_PATCH_MAX_BYTES):
+            send(chunk)
+            chunk, size = [], 0
+        chunk.append(entry)
+        size += entry_size
+    send(chunk)
+    bus.flush()
+    return jsonify({"status": "sent_to_queue", "entries": len(entries)}), 200
+
+@app.route('/api/plan/irrigation', methods=['POST'])
+def plan_irrigation():
+    """
+    Calendario irriguo a N giorni (bilancio idrico FAO-56) con le soglie configurate per sensore/fase:
+    {"days": 14, "fields": [lettura, ...], "max_event_mm": 40, "efficiency": 0.9, "daily": false}.
+    Senza "fields" pianifica l'ultima lettura di ogni sensore ricevuta dal gateway.
+    """
+    data = request.get_json(silent=True) or {}
+    fields = data.get('fields')
+    if fields is None:
+        fields = state_view.readings()
+    if not isinstance(fields, list) or not all(isinstance(f, dict) for f in fields):
+        return jsonify({"error": "fields deve essere un elenco di letture"}), 400
+    try:
+        days = int(data.get('days', water_balance.PLAN_DAYS))
+        max_event_mm = float(data.get('max_event_mm') or water_balance.MAX_EVENT_MM)
+        efficiency = float(data.get('efficiency', water_balance.IRRIGATION_EFFICIENCY))
+    except (TypeError, ValueError):
+        return jsonify({"error": "days, max_event_mm ed efficiency devono essere numerici"}), 400
+    if not 1 <= days <= water_balance.MAX_PLAN_DAYS or not 0 < efficiency <= 1 or not 0 < max_event_mm < float('inf'):
+        return jsonify({"error": f"days in [1, {water_balance.MAX_PLAN_DAYS}], efficiency in (0, 1], "
+                                 "max_event_mm > 0"}), 400
+
+    # Soglia per campo: quella della richiesta, altrimenti la configurata per (sensore, fase)
+    configured = configured_thresholds.column(configured_thresholds.lookup_readings(fields), 'moisture_threshold')
+    requested = [f.get('moisture_threshold') for f in fields]
+    thresholds = [float(r) if isinstance(r, (int, float)) and not isinstance(r, bool) else c
+                  for r, c in zip(requested, configured)]
+    if not all(math.isfinite(t) for t in thresholds):
+        return jsonify({"error": "moisture_threshold non numerica"}), 400
+    try:
+        plan = water_balance.plan_readings(fields, thresholds, days, max_event_mm, efficiency,
+                                           daily=bool(data.get('daily')))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"richiesta non valida: {e}"}), 400
+    return jsonify(plan)
+
+@app.route('/api/history', methods=['GET'])
+def sensor_history():
+    """Serie storica aggregata: ?sensor_id=&metrics=a,b&start=&end=&resolution=auto|1m|1h"""
+    try:
+        end = float(request.args.get('end', time.time()))
+        start = float(request.args.get('start', end - 24 * 3600))
+        sensor_id = request.args.get('sensor_id', 'sensor')
+        metrics = [m for m in request.args.get('metrics', 'Soil_moisture_pct').split(',') if m]
+        resolution = request.args.get('resolution', 'auto')
+        if resolution != 'auto' and resolution not in ROLLUPS:
+            return jsonify({"error": f"resolution must be one of auto, {', '.join(ROLLUPS)}"}), 400
+        if start >= end:
+            return jsonify({"error": "start must be before end"}), 400
+
+        series = history_store.query_range(sensor_id, metrics, start, end, resolution)
+        return jsonify({"sensor_id": sensor_id, "start": start, "end": end, "series": series})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/history/sensors', methods=['GET'])
+def sensor_history_index():
+    return jsonify(history_store.list_sensors())
+
+@app.route('/api/state', methods=['GET'])
+def latest_state():
+    """
+    Ultima lettura e ultimo advice per sensore. If-None-Match con l'ETag corrente -> 304;
+    ?since=<etag> -> solo i sensori cambiati da allora (snapshot completo se l'ETag è di un'altra epoca).
+    """
+    if request.headers.get('If-None-Match') == state_view.etag():
+        return '', 304, {'ETag': state_view.etag()}
+    since = state_view.parse_since(request.args.get('since'))
+    version, body = state_view.delta(since) if since is not None else state_view.snapshot()
+    return body, 200, {'Content-Type': 'application/json', 'ETag': state_view.etag(version),
+                       'Cache-Control': 'no-cache'}
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({**service_metrics, 'gateway': {'state': state_view.stats()}})
+
+@app.route('/api/debug/profile', methods=['GET', 'POST'])
+def debug_profile():
+    """GET: statistiche dei timer. POST {"enabled": bool, "reset": bool}: attiva/disattiva i timer."""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get('reset'):
+            profiling.reset()
+        if data.get('enabled') is True:
+            profiling.enable()
+        elif data.get('enabled') is False:
+            profiling.disable()
+    return jsonify(profiling.snapshot())
+
+@app.route('/api/debug/profile/sample', methods=['GET'])
+def debug_profile_sample():
+    """Profilo a campionamento di ?seconds=N (formato collapsed per flamegraph.pl / speedscope)."""
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval_ms', profiling.SAMPLE_INTERVAL_S * 1000)) / 1000
+    except ValueError:
+        return jsonify({"error": "seconds and interval_ms must be numbers"}), 400
+    if not 0 < seconds <= profiling.SAMPLE_MAX_S or interval <= 0:
+        return jsonify({"error": f"seconds must be in (0, {profiling.SAMPLE_MAX_S}]"}), 400
+    collapsed, samples = profiling.sample(seconds, interval)
+    return collapsed, 200, {'Content-Type': 'text/plain; charset=utf-8', 'X-Profile-Samples': str(samples)}
+
 @app.route('/upload-image', methods=['POST'])
 def upload_image():
     if not vision_advisor: return jsonify({"error": "Vision Service Unavailable"}), 503
@@ -90,16 +354,34 @@ def upload_image():
     file = request.files['image']
     if file.filename == '': return jsonify({"error": "Empty filename"}), 400
     
+    # Nome univoco: con più repliche due upload con lo stesso nome sono analizzati insieme
+    filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     try:
-        filename = secure_filename(file.filename)
-        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(path)
-        
         cat, adv = vision_advisor.consult(path)
-        os.remove(path) 
         return jsonify({"category": cat, "advice": adv})
+    except VisionBusy as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
+    except VisionUnavailable as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+@app.route('/api/vision/health', methods=['GET'])
+def vision_health():
+    """Repliche (pid, warm-up, richieste servite, riavvii), slot occupati, coda e latenza."""
+    registry = vision_models.snapshot()
+    if vision_pool is not None:
+        health = vision_pool.health()
+        return jsonify({'mode': 'pool', **health, 'registry': registry}), 200 if health['ready'] else 503
+    body = {'mode': 'in_process' if vision_advisor else 'unavailable', 'registry': registry}
+    if vision_advisor is not None and hasattr(vision_advisor.vision_strategy, 'stats'):
+        body['cascade'] = vision_advisor.vision_strategy.stats()
+    return jsonify(body), 200 if vision_advisor else 503
 
 if __name__ == '__main__':
     print("🚀 GATEWAY SERVER AVVIATO (Porta 8080)")
@@ -1,9 +1,14 @@
 from abc import ABC, abstractmethod
-from sklearn.linear_model import LogisticRegression
+import copy
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.preprocessing import StandardScaler
 import numpy as np
 import pandas as pd
 
 class ModelStrategy(ABC):
+    name = 'ML'  # etichetta mostrata nei pacchetti di advice
+
     @abstractmethod
     def train(self, X, y):
         pass
@@ -14,6 +19,8 @@ class ModelStrategy(ABC):
 
 class LogisticRegressionStrategy(ModelStrategy):
     """ Strategia ML: Richiede training e calcoliamo l'accuratezza. """
+    name = 'LogReg'
+
     def __init__(self, max_iter=2000):
         self.model = LogisticRegression(max_iter=max_iter)
         self.is_trained = False
@@ -31,10 +38,179 @@ class LogisticRegressionStrategy(ModelStrategy):
             X = df 
         return self.model.predict(X)
 
+class SGDLogisticStrategy(ModelStrategy):
+    """ Strategia ML online: regressione logistica via SGD, aggiornabile a batch con partial_fit. """
+    name = 'SGD'
+
+    def __init__(self, alpha=1e-4, epochs=5, batch_size=500, random_state=0):
+        self.alpha = alpha
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self.classes = np.array([0, 1])
+        self._reset()
+
+    def _reset(self):
+        self.scaler = StandardScaler()
+        self.model = SGDClassifier(loss='log_loss', alpha=self.alpha, learning_rate='optimal',
+                                   random_state=self.random_state)
+        self.is_trained = False
+
+    def train(self, X, y):
+        """Addestramento da zero: scaler sull'intero set, poi alcune epoche di mini-batch."""
+        self._reset()
+        X = np.asarray(X, dtype=float)
+        self.scaler.fit(X)
+        self.fit_epochs(X, y, self.epochs)
+
+    def fit_epochs(self, X, y, epochs):
+        """Epoche di mini-batch mescolati sopra i pesi correnti (warm start)."""
+        X = self.scaler.transform(np.asarray(X, dtype=float))
+        y = np.asarray(y)
+        rng = np.random.default_rng(self.random_state)
+        for _ in range(epochs):
+            order = rng.permutation(len(X))
+            for start in range(0, len(X), self.batch_size):
+                idx = order[start:start + self.batch_size]
+                self.model.partial_fit(X[idx], y[idx], classes=self.classes)
+        self.is_trained = True
+
+    def partial_fit(self, X, y):
+        """Aggiornamento incrementale con un batch etichettato dallo stream."""
+        X = np.asarray(X, dtype=float)
+        self.scaler.partial_fit(X)
+        self.model.partial_fit(self.scaler.transform(X), np.asarray(y), classes=self.classes)
+        self.is_trained = True
+
+    def clone(self):
+        """Copia indipendente, da aggiornare in background e poi scambiare."""
+        return copy.deepcopy(self)
+
+    def predict(self, df, features):
+        if not self.is_trained:
+            raise ValueError("Modello non addestrato.")
+        if set(features).issubset(df.columns):
+            X = df[features]
+        else:
+            X = df
+        return self.model.predict(self.scaler.transform(np.asarray(X, dtype=float)))
+
+class TreeEnsembleStrategy(ModelStrategy):
+    """
+    Strategia ML non lineare: gradient boosting ('gbt') o random forest ('rf') di sklearn,
+    compilata dopo il training in array NumPy piatti (feature, soglia, figli, valore)
+    e valutata per l'intero batch con un attraversamento vettorizzato livello per livello.
+    """
+    CHUNK_ROWS = 2048  # righe per blocco: la matrice dei nodi (righe x alberi) resta in cache
+
+    @property
+    def name(self):
+        return 'GBT' if self.kind == 'gbt' else 'RF'
+
+    def __init__(self, kind='gbt', n_estimators=100, max_depth=None, learning_rate=0.1, random_state=0):
+        if kind not in ('gbt', 'rf'):
+            raise ValueError(f"Ensemble sconosciuto: {kind} (gbt | rf)")
+        self.kind = kind
+        if kind == 'gbt':
+            self.model = GradientBoostingClassifier(n_estimators=n_estimators, max_depth=max_depth or 3,
+                                                    learning_rate=learning_rate, random_state=random_state)
+        else:
+            self.model = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth or 10,
+                                                n_jobs=-1, random_state=random_state)
+        self.is_trained = False
+
+    def train(self, X, y):
+        self.model.fit(np.asarray(X, dtype=float), y)
+        self._compile(np.asarray(X, dtype=float)[:1])
+        self.is_trained = True
+
+    def _trees(self):
+        if self.kind == 'gbt':
+            return [est[0].tree_ for est in self.model.estimators_]
+        return [est.tree_ for est in self.model.estimators_]
+
+    def _compile(self, X_probe):
+        """Concatena gli alberi in array piatti. Le foglie puntano a sé stesse, così ogni riga fa max_depth passi."""
+        self.classes_ = self.model.classes_
+        if len(self.classes_) != 2:
+            raise ValueError("TreeEnsembleStrategy supporta solo target binari.")
+        feature, threshold, left, right, value, roots = [], [], [], [], [], []
+        offset, depth = 0, 0
+        for tree in self._trees():
+            n = tree.node_count
+            idx = np.arange(n)
+            is_leaf = tree.children_left == -1
+            roots.append(offset)
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(np.where(is_leaf, idx, tree.children_left) + offset)
+            right.append(np.where(is_leaf, idx, tree.children_right) + offset)
+            if self.kind == 'gbt':
+                value.append(tree.value[:, 0, 0])
+            else:
+                counts = tree.value[:, 0, :]
+                value.append(counts[:, 1] / counts.sum(axis=1))  # P(classe 1) della foglia
+            offset += n
+            depth = max(depth, tree.max_depth)
+
+        self.feature = np.concatenate(feature).astype(np.intp)
+        self.threshold = np.concatenate(threshold)
+        # Figli interlacciati: children[2*i] = sinistro, children[2*i + 1] = destro
+        self.children = np.empty(2 * offset, dtype=np.intp)
+        self.children[0::2] = np.concatenate(left)
+        self.children[1::2] = np.concatenate(right)
+        self.value = np.concatenate(value)
+        self.roots = np.array(roots, dtype=np.intp)
+        self.depth = depth
+        self.n_features = X_probe.shape[1]
+
+        if self.kind == 'gbt':
+            # Punteggio iniziale (log-odds a priori) ricavato da API pubbliche su una riga
+            self.learning_rate = self.model.learning_rate
+            leaf_sum = sum(est[0].predict(X_probe)[0] for est in self.model.estimators_)
+            self.base_score = float(self.model.decision_function(X_probe)[0] - self.learning_rate * leaf_sum)
+
+    def _leaf_values(self, X):
+        """Valori delle foglie raggiunte, matrice righe x alberi."""
+        n = len(X)
+        flat = X.ravel()
+        row_base = (np.arange(n, dtype=np.intp) * self.n_features)[:, None]
+        node = np.broadcast_to(self.roots, (n, len(self.roots))).copy()
+        for _ in range(self.depth):
+            go_right = flat[row_base + self.feature[node]] > self.threshold[node]
+            node = self.children[2 * node + go_right]
+        return self.value[node]
+
+    def decision_scores(self, X):
+        """Log-odds (gbt) o probabilità media della classe positiva (rf) per riga."""
+        # Come sklearn: confronto delle feature in float32 con soglie float64
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+        out = np.empty(len(X))
+        for start in range(0, len(X), self.CHUNK_ROWS):
+            leaves = self._leaf_values(X[start:start + self.CHUNK_ROWS])
+            if self.kind == 'gbt':
+                out[start:start + len(leaves)] = self.base_score + self.learning_rate * leaves.sum(axis=1)
+            else:
+                out[start:start + len(leaves)] = leaves.mean(axis=1)
+        return out
+
+    def predict(self, df, features):
+        if not self.is_trained:
+            raise ValueError("Modello non addestrato.")
+        if set(features).issubset(df.columns):
+            X = df[features]
+        else:
+            X = df
+        scores = self.decision_scores(X)
+        positive = scores > 0 if self.kind == 'gbt' else scores > 0.5
+        return self.classes_[positive.astype(int)]
+
 class RuleBasedStrategy(ModelStrategy):
     """
     Strategia Regole Adattata.
     """
+    name = 'Regole'
+
     def __init__(self, 
                  target_name: str,
                  moisture_threshold_pct: float = 60.0,
@@ -1,5 +1,6 @@
 import os
 import json
+import time
 import numpy as np
 import traceback
 from abc import ABC, abstractmethod
@@ -8,11 +9,28 @@ try:
     from tensorflow.keras.applications.mobilenet_v2 import MobileNetV2, preprocess_input
     from tensorflow.keras.preprocessing import image
     from tensorflow.keras.models import load_model
+    from PIL import Image
     TF_AVAILABLE = True
 except ImportError:
     TF_AVAILABLE = False
     print("ATTENZIONE: TensorFlow non installato.")
 
+INPUT_SIZE = (224, 224)
+
+# Cascata: modello di smistamento a bassa risoluzione prima del classificatore completo.
+# Le classi che sa riconoscere da solo (piante sane, sfondo) non passano dalla rete a 44 classi.
+VISION_CASCADE = os.environ.get("GREENFIELD_VISION_CASCADE", "0") == "1"
+TRIAGE_MODEL_PATH = "greenfield_triage.h5"
+TRIAGE_LABELS_PATH = "triage_indices.json"
+TRIAGE_SIZE = (96, 96)
+TRIAGE_CLASSES = ('Tomato___healthy', 'Pepper,_bell___healthy', 'Potato___healthy', 'Plant___Potted_Healthy',
+                  'Z__Background_Noise')
+TRIAGE_DIAGNOSE = 'Needs_Diagnosis'   # tutte le altre classi: decide il classificatore completo
+TRIAGE_NOISE_CLASS = 'Z__Background_Noise'
+# Confidenza minima del triage per chiudere senza il classificatore completo (sotto: si prosegue)
+TRIAGE_CONFIDENCE = float(os.environ.get("GREENFIELD_TRIAGE_CONFIDENCE", 0.9))
+TRIAGE_NOISE_CONFIDENCE = float(os.environ.get("GREENFIELD_TRIAGE_NOISE_CONFIDENCE", 0.8))
+
 # BASE DI CONOSCENZA AGRONOMICA (Sincronizzata con class_indices.json)
 
 KNOWLEDGE_BASE = {
@@ -153,32 +171,131 @@ class DeepLearningVisionStrategy(ImageAnalysisStrategy):
         else:
             print(f"ERRORE CRITICO: File '{model_path}' o '{json_path}' non trovato.")
 
+    def warm_up(self, batch=1):
+        """Predizione su un batch fittizio: il tracing del grafo non ricade sulla prima richiesta reale."""
+        if self.is_custom_ready and self.model is not None:
+            self.model(np.zeros((batch, *INPUT_SIZE, 3), dtype=np.float32), training=False)
+
+    def load_image(self, image_path):
+        """Immagine RGB a dimensione originale (decodificata una volta anche in cascata)."""
+        return image.load_img(image_path)
+
+    def predict_image(self, img):
+        # 1. Preprocessing (Standard MobileNetV2/ResNet): resize nearest come load_img(target_size=...)
+        x = image.img_to_array(img.resize(INPUT_SIZE[::-1], Image.NEAREST))
+        x = np.expand_dims(x, axis=0)
+        x = x / 255.0  # Normalizzazione
+
+        # 2. Predizione (chiamata diretta: per una sola immagine predict() costa più della rete)
+        preds = self.model(x, training=False).numpy()
+
+        top_idx = np.argmax(preds[0])
+        confidence = float(preds[0][top_idx])
+        return top_idx, confidence
+
     def analyze(self, image_path):
+        """image_path: percorso del file oppure file-like (es. io.BytesIO con i byte caricati)."""
         try:
             if not self.is_custom_ready or self.model is None:
                 return -1, 0.0
+            return self.predict_image(self.load_image(image_path))
 
-            # 1. Caricamento e Preprocessing Immagine (Standard MobileNetV2/ResNet)
-            img = image.load_img(image_path, target_size=(224, 224))
-            x = image.img_to_array(img)
-            x = np.expand_dims(x, axis=0)
-            x = x / 255.0  # Normalizzazione
+        except Exception as e:
+            traceback.print_exc()
+            return -1, 0.0
 
-            # 2. Predizione
-            preds = self.model.predict(x, verbose=0)
-            
-            top_idx = np.argmax(preds[0])
-            confidence = float(preds[0][top_idx])
-            
-            return top_idx, confidence
+class CascadeVisionStrategy(ImageAnalysisStrategy):
+    """
+    Cascata a due stadi: un modello minuscolo a 96x96 classifica l'immagine fra le TRIAGE_CLASSES
+    (piante sane e sfondo) o 'da diagnosticare'. Se è sicuro di una classe che conosce, l'esito è
+    quello (stesso indice del classificatore completo, quindi consult non cambia); altrimenti
+    l'immagine, già decodificata, passa al classificatore completo a 44 classi.
+    """
+    def __init__(self, full, triage_path=TRIAGE_MODEL_PATH, labels_path=TRIAGE_LABELS_PATH,
+                 confidence=TRIAGE_CONFIDENCE, noise_confidence=TRIAGE_NOISE_CONFIDENCE):
+        self.full = full
+        self.labels_map = full.labels_map
+        self.is_custom_ready = full.is_custom_ready
+        self.triage = None
+        self.triaged = 0
+        self.escalated = 0
+        self.triage_s = 0.0
+        self.full_s = 0.0
+
+        with open(labels_path, 'r') as f:
+            triage_labels = json.load(f)
+        self.triage_size = tuple(triage_labels.get('input_size', TRIAGE_SIZE))
+        full_index = {name: idx for idx, name in full.labels_map.items()}
+        # Uscita del triage -> indice del classificatore completo (None = da diagnosticare)
+        self.to_full = [None if name == TRIAGE_DIAGNOSE else full_index[name] for name in triage_labels['classes']]
+        self.thresholds = np.array([noise_confidence if name == TRIAGE_NOISE_CLASS else confidence
+                                    for name in triage_labels['classes']])
+        self.triage = load_model(triage_path)
+        print(f"Sistema Visione: cascata attiva (triage {self.triage_size[0]}x{self.triage_size[1]}, "
+              f"soglie {confidence}/{noise_confidence}).")
+
+    def warm_up(self, batch=1):
+        self.full.warm_up(batch)
+        self.triage(np.zeros((batch, *self.triage_size, 3), dtype=np.float32), training=False)
+
+    def triage_scores(self, img):
+        x = image.img_to_array(img.resize(self.triage_size[::-1], Image.NEAREST))[None] / 255.0
+        return self.triage(x, training=False).numpy()[0]
+
+    def triage_image(self, img):
+        """(indice completo | None, confidenza) del triage."""
+        preds = self.triage_scores(img)
+        top = int(np.argmax(preds))
+        confidence = float(preds[top])
+        if self.to_full[top] is None or confidence < self.thresholds[top]:
+            return None, confidence
+        return self.to_full[top], confidence
+
+    def analyze(self, image_path):
+        try:
+            if not self.is_custom_ready:
+                return -1, 0.0
+            img = self.full.load_image(image_path)
+            t0 = time.perf_counter()
+            idx, confidence = self.triage_image(img)
+            t1 = time.perf_counter()
+            self.triage_s += t1 - t0
+            if idx is not None:
+                self.triaged += 1
+                return idx, confidence
+            self.escalated += 1
+            result = self.full.predict_image(img)
+            self.full_s += time.perf_counter() - t1
+            return result
 
         except Exception as e:
             traceback.print_exc()
             return -1, 0.0
 
+    def stats(self):
+        total = self.triaged + self.escalated
+        return {'images': total, 'triaged': self.triaged, 'escalated': self.escalated,
+                'triaged_pct': round(100.0 * self.triaged / total, 1) if total else None,
+                'triage_ms_avg': round(1000 * self.triage_s / total, 2) if total else None,
+                'full_ms_avg': round(1000 * self.full_s / self.escalated, 2) if self.escalated else None}
+
+def build_vision_strategy(model_path="greenfield_agri_brain.h5", json_path="class_indices.json", cascade=None):
+    """Classificatore completo, preceduto dal triage se GREENFIELD_VISION_CASCADE=1 e il modello esiste."""
+    full = DeepLearningVisionStrategy(model_path, json_path)
+    if not (VISION_CASCADE if cascade is None else cascade):
+        return full
+    if not (os.path.exists(TRIAGE_MODEL_PATH) and os.path.exists(TRIAGE_LABELS_PATH)):
+        print(f"ATTENZIONE: cascata richiesta ma '{TRIAGE_MODEL_PATH}' non trovato: solo classificatore completo.")
+        return full
+    try:
+        return CascadeVisionStrategy(full)
+    except Exception as e:
+        print(f"ATTENZIONE: triage non caricato ({e}): solo classificatore completo.")
+        return full
+
 class GreenFieldImageAdvisor:
     """Usa la strategia di visione e la Knowledge Base per dare consigli"""
-    def __init__(self, vision_strategy: DeepLearningVisionStrategy):
+    def __init__(self, vision_strategy: ImageAnalysisStrategy):
         self.vision_strategy = vision_strategy
 
     def consult(self, image_path):
@@ -0,0 +1,127 @@
+import time
+import numpy as np
+
+# Dead-band per feature: una lettura entro ±banda dall'ultima valutata riusa l'advice precedente.
+# Modificabili a runtime con la chiave "dead_bands" di system-settings.
+DEAD_BANDS = {
+    'Soil_moisture_pct': 0.5,
+    'Temperature_C': 0.2,
+    'Humidity_pct': 1.0,
+    'Nitrogen_mg_kg': 1.0,
+    'Phosphorus_mg_kg': 1.0,
+    'Potassium_mg_kg': 1.0,
+    'pH': 0.05,
+    'Temp_min_C': 0.2,
+    'Temp_max_C': 0.2,
+}
+MAX_SUPPRESS_S = 300.0  # oltre questo intervallo l'advice viene ricalcolato comunque
+COST_ALPHA = 0.1        # smoothing del costo CPU per lettura valutata
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ChangeSuppressor:
+    """
+    Tabella per sensore dell'ultima lettura valutata (una riga NumPy per sensore).
+    Una lettura è "invariata" se tutte le feature restano entro le dead-band rispetto
+    a quella riga: in tal caso l'analyzer pubblica un heartbeat invece di ricalcolare.
+    """
+    def __init__(self, dead_bands=None, max_suppress_s=MAX_SUPPRESS_S, capacity=256):
+        self.max_suppress_s = max_suppress_s
+        self.rows = {}
+        self.capacity = capacity
+        self.set_bands(dead_bands)
+
+        self.seen = 0
+        self.suppressed = 0
+        self.cost_s = 0.0  # secondi CPU medi per lettura valutata
+
+    def set_bands(self, dead_bands=None):
+        """Nuove dead-band (unite alle predefinite). Lo stato dei sensori viene azzerato."""
+        bands = dict(DEAD_BANDS)
+        bands.update({k: float(v) for k, v in (dead_bands or {}).items()})
+        self.features = list(bands)
+        self.bands = np.array([bands[f] for f in self.features])
+        self.ref = np.full((self.capacity, len(self.features)), np.nan)
+        self.ref_time = np.zeros(self.capacity)
+        self.advice_ts = np.zeros(self.capacity)
+        self.valid = np.zeros(self.capacity, dtype=bool)
+
+    def invalidate(self, sensor_ids=None):
+        """Forza il ricalcolo per i sensori indicati, o per tutti (nuove soglie, cambio di modalità o di modello)."""
+        if sensor_ids is None:
+            self.valid[:] = False
+            return
+        for sensor_id in sensor_ids:
+            row = self.rows.get(sensor_id)
+            if row is not None:
+                self.valid[row] = False
+
+    def _row(self, sensor_id):
+        row = self.rows.get(sensor_id)
+        if row is None:
+            row = self.rows[sensor_id] = len(self.rows)
+            if row >= self.capacity:
+                self._grow(2 * self.capacity)
+        return row
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        self.ref = np.vstack([self.ref, np.full((extra, len(self.features)), np.nan)])
+        self.ref_time = np.concatenate([self.ref_time, np.zeros(extra)])
+        self.advice_ts = np.concatenate([self.advice_ts, np.zeros(extra)])
+        self.valid = np.concatenate([self.valid, np.zeros(extra, dtype=bool)])
+        self.capacity = capacity
+
+    def classify(self, readings, now=None):
+        """
+        Restituisce (compute, advice_ts): compute[i] è True se la lettura i va valutata,
+        altrimenti advice_ts[i] è il ts dell'advice che resta valido. Le letture dello
+        stesso sensore nel batch sono confrontate in ordine di arrivo.
+        """
+        now = time.time() if now is None else now
+        n = len(readings)
+        values = np.array([[_to_float(r.get(f)) for f in self.features] for r in readings]).reshape(n, -1)
+        compute = np.ones(n, dtype=bool)
+        advice_ts = np.zeros(n)
+
+        for i, data in enumerate(readings):
+            row = self._row(data.get('sensor_id', 'sensor'))
+            v = values[i]
+            if self.valid[row] and now - self.ref_time[row] < self.max_suppress_s:
+                ref = self.ref[row]
+                nan_v, nan_ref = np.isnan(v), np.isnan(ref)
+                moved = (np.abs(v - ref) > self.bands) | (nan_v != nan_ref)
+                if not moved.any():
+                    compute[i] = False
+                    advice_ts[i] = self.advice_ts[row]
+                    continue
+            self.ref[row] = v
+            self.ref_time[row] = now
+            self.advice_ts[row] = advice_ts[i] = _to_float(data.get('ts', data.get('_ts', now)))
+            self.valid[row] = True
+
+        self.seen += n
+        self.suppressed += n - int(compute.sum())
+        return compute, advice_ts
+
+    def record_cost(self, computed, cpu_s):
+        """Costo CPU della valutazione di 'computed' letture (stima del risparmio degli heartbeat)."""
+        if computed:
+            per_reading = cpu_s / computed
+            self.cost_s = per_reading if self.cost_s == 0 else (1 - COST_ALPHA) * self.cost_s + COST_ALPHA * per_reading
+
+    def snapshot(self):
+        return {
+            'sensors': len(self.rows),
+            'seen': self.seen,
+            'suppressed': self.suppressed,
+            'suppression_ratio': round(self.suppressed / self.seen, 4) if self.seen else 0.0,
+            'cpu_saved_s': round(self.suppressed * self.cost_s, 3),
+            'cpu_per_reading_ms': round(self.cost_s * 1000, 3),
+        }
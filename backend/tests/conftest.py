@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Moduli del backend importati come negli script (python analyzer.py, python -m benchmarks...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
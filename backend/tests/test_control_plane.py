@@ -0,0 +1,57 @@
+import json
+import threading
+import time
+
+from control_plane import CONTROL_TOPIC, ConfigSnapshot, ControlPlane
+from message_bus import BusMessage, InProcessBus
+from thresholds import ThresholdTable
+
+DEFAULTS = {"moisture_threshold": 30.0, "temp_min": 10.0, "temp_max": 35.0,
+            "n_threshold": 50.0, "p_threshold": 20.0, "k_threshold": 100.0}
+
+
+def make_plane():
+    return ControlPlane(ConfigSnapshot(0, DEFAULTS, False, 0, ThresholdTable(DEFAULTS)))
+
+
+def message(offset, payload):
+    value = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+    return BusMessage(CONTROL_TOPIC, value, offset=offset)
+
+
+def test_bad_payloads_are_skipped_and_offsets_advance():
+    plane = make_plane()
+    snapshot = plane.build(plane.current, [
+        message(0, {"moisture_threshold": "abc"}),
+        message(1, b"{not json"),
+        message(2, {"thresholds": [{"sensor_id": "S1", "temp_max": "hot"}]}),
+        message(3, {"dead_bands": {"Soil_moisture_pct": "x"}}),
+        message(4, {"_sent_ts": "yesterday", "temp_min": 5}),
+        message(5, {"moisture_threshold": 42}),
+    ])
+    assert plane.rejected == 5
+    assert snapshot.config["moisture_threshold"] == 42
+    assert snapshot.config["temp_min"] == 10.0
+    assert snapshot.thresholds.default["moisture_threshold"] == 42.0
+    assert len(snapshot.thresholds) == 1  # nessuna voce dalla patch scartata
+    assert snapshot.offsets[(CONTROL_TOPIC, 0)] == 6
+
+
+def test_control_thread_survives_bad_message():
+    bus = InProcessBus()
+    plane = make_plane()
+    stop = threading.Event()
+    bus.subscribe([CONTROL_TOPIC], 'test-control')
+    bus.publish(CONTROL_TOPIC, json.dumps({"moisture_threshold": "abc"}).encode('utf-8'))
+    bus.publish(CONTROL_TOPIC, json.dumps({"moisture_threshold": 55}).encode('utf-8'))
+    thread = plane.start(bus, 'test-control', stop)
+    try:
+        deadline = time.monotonic() + 5
+        while plane.current.config["moisture_threshold"] != 55 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert plane.current.config["moisture_threshold"] == 55
+        assert thread.is_alive()
+        assert plane.snapshot()['rejected'] == 1
+    finally:
+        stop.set()
+        plane.join(5)
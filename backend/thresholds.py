@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+# Colonne della tabella (stesse chiavi di SYSTEM_CONFIG / system-settings)
+THRESHOLD_COLUMNS = ("moisture_threshold", "temp_min", "temp_max", "n_threshold", "p_threshold", "k_threshold")
+ANY = '*'          # jolly: qualsiasi sensore o qualsiasi fase colturale
+KEY_SEP = '\x1f'
+THRESHOLD_ENTRY_KEYS = {'sensor_id', 'crop_stage', 'delete', *THRESHOLD_COLUMNS}
+
+
+def make_key(sensor_id, crop_stage):
+    return f"{sensor_id}{KEY_SEP}{crop_stage}"
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and bool(np.isfinite(value))
+
+def validate_settings(payload):
+    """
+    Controlla un messaggio system-settings prima di applicarlo (ValueError se non valido):
+    soglie globali numeriche, voci 'thresholds' con chiavi note e valori numerici o null,
+    'dead_bands' come mappa di numeri. Le altre chiavi di configurazione passano invariate.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError(f"atteso un oggetto JSON, ricevuto {type(payload).__name__}")
+    for col in THRESHOLD_COLUMNS:
+        if col in payload and not _is_number(payload[col]):
+            raise ValueError(f"soglia non numerica: {col}={payload[col]!r}")
+    entries = payload.get('thresholds')
+    if entries is not None:
+        if not isinstance(entries, list):
+            raise ValueError("'thresholds' deve essere un elenco di voci")
+        for entry in entries:
+            if not isinstance(entry, dict) or set(entry) - THRESHOLD_ENTRY_KEYS:
+                raise ValueError(f"voce non valida: {entry!r}")
+            for col in THRESHOLD_COLUMNS:
+                if entry.get(col) is not None and not _is_number(entry[col]):
+                    raise ValueError(f"soglia non numerica: {entry!r}")
+    dead_bands = payload.get('dead_bands')
+    if dead_bands is not None and not (isinstance(dead_bands, dict) and all(map(_is_number, dead_bands.values()))):
+        raise ValueError(f"'dead_bands' deve essere una mappa di numeri: {dead_bands!r}")
+
+def normalize_stage(value):
+    """Fase colturale come nel dataset ('Mid stage', ...); mancante -> jolly."""
+    if value is None or value != value:  # None o NaN
+        return ANY
+    value = str(value).strip()
+    return value or ANY
+
+
+class ThresholdTable:
+    """
+    Soglie per (sensore/campo, fase colturale) in colonne NumPy: una riga per chiave,
+    NaN = valore ereditato. Ogni colonna si risolve in ordine da (sensore, fase),
+    (sensore, *), (*, fase) e infine dal default (*, *), sempre completo.
+    La ricerca di un batch risolve solo le chiavi distinte (tre livelli), poi le
+    soglie di ogni lettura sono un gather per indice.
+    """
+    def __init__(self, defaults, capacity=1024):
+        self.columns = THRESHOLD_COLUMNS
+        self.values = np.full((capacity, len(self.columns)), np.nan)
+        self.rows = {}     # chiave -> riga
+        self.keys = []
+        self.overrides = 0  # righe non di default con almeno un valore
+        self.version = 0
+        self._row(make_key(ANY, ANY))
+        self.set_default(defaults)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _row(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.keys)
+            self.keys.append(key)
+            if row >= len(self.values):
+                extra = np.full((len(self.values), len(self.columns)), np.nan)
+                self.values = np.vstack([self.values, extra])
+        return row
+
+    def _rows_of(self, keys):
+        """Riga di ogni chiave, -1 se assente (nessun indice da ricostruire dopo gli inserimenti)."""
+        get = self.rows.get
+        return np.fromiter((get(k, -1) for k in keys), dtype=np.intp, count=len(keys))
+
+    def copy(self):
+        """Copia indipendente: le modifiche del piano di controllo non toccano la tabella in uso."""
+        other = ThresholdTable.__new__(ThresholdTable)
+        other.columns = self.columns
+        other.values = self.values.copy()
+        other.rows = dict(self.rows)
+        other.keys = list(self.keys)
+        other.overrides = self.overrides
+        other.version = self.version
+        return other
+
+    @property
+    def default(self):
+        return dict(zip(self.columns, self.values[0].tolist()))
+
+    def set_default(self, config):
+        """Soglie globali (*, *): le chiavi mancanti in config restano invariate."""
+        new = np.array([float(config.get(c, self.values[0, j])) for j, c in enumerate(self.columns)])
+        if not np.array_equal(new, self.values[0]):
+            self.values[0] = new
+            self.version += 1
+
+    def patch(self, entries):
+        """
+        Aggiorna singole voci: {"sensor_id", "crop_stage", <colonna>: valore | None, "delete": bool}.
+        None toglie l'override della colonna, delete quelli dell'intera voce.
+        Restituisce i sensor_id coinvolti (ANY se la modifica vale per tutti i sensori).
+        """
+        n = len(entries)
+        rows = np.empty(n, dtype=np.intp)
+        vals = np.full((n, len(self.columns)), np.nan)
+        touched = np.zeros((n, len(self.columns)), dtype=bool)
+        sensors = set()
+        for i, entry in enumerate(entries):
+            sensor = str(entry.get('sensor_id') or ANY)
+            rows[i] = self._row(make_key(sensor, normalize_stage(entry.get('crop_stage'))))
+            sensors.add(sensor)
+            if entry.get('delete'):
+                touched[i] = rows[i] != 0  # il default non si cancella
+                continue
+            for j, col in enumerate(self.columns):
+                if col in entry:
+                    value = entry[col]
+                    if value is None:
+                        touched[i, j] = rows[i] != 0
+                    else:
+                        vals[i, j] = float(value)
+                        touched[i, j] = True
+
+        unique_rows = np.unique(rows[rows != 0])
+        before = int((~np.isnan(self.values[unique_rows])).any(axis=1).sum())
+        if len(np.unique(rows)) == n:
+            self.values[rows] = np.where(touched, vals, self.values[rows])
+        else:
+            # Stessa chiave ripetuta nella patch: applicazione in ordine
+            for i in range(n):
+                self.values[rows[i], touched[i]] = vals[i, touched[i]]
+        self.overrides += int((~np.isnan(self.values[unique_rows])).any(axis=1).sum()) - before
+        self.version += 1
+        return {ANY} if ANY in sensors else sensors
+
+    def lookup(self, sensor_ids, crop_stages):
+        """Matrice (n, colonne) con le soglie risolte per ogni lettura."""
+        n = len(sensor_ids)
+        if self.overrides == 0:
+            return np.broadcast_to(self.values[0], (n, len(self.columns)))
+
+        sensor_ids = [str(s) for s in sensor_ids]
+        crop_stages = [normalize_stage(s) for s in crop_stages]
+        codes, uniques = pd.factorize(np.array([f"{s}{KEY_SEP}{c}" for s, c in zip(sensor_ids, crop_stages)],
+                                               dtype=object))
+        first = np.unique(codes, return_index=True)[1]
+        u_sensors = [sensor_ids[i] for i in first]
+        u_stages = [crop_stages[i] for i in first]
+
+        resolved = np.full((len(uniques), len(self.columns)), np.nan)
+        for keys in (uniques,
+                     [f"{s}{KEY_SEP}{ANY}" for s in u_sensors],
+                     [f"{ANY}{KEY_SEP}{c}" for c in u_stages]):
+            rows = self._rows_of(keys)
+            found = rows >= 0
+            tier = np.where(found[:, None], self.values[np.where(found, rows, 0)], np.nan)
+            resolved = np.where(np.isnan(resolved), tier, resolved)
+        resolved = np.where(np.isnan(resolved), self.values[0], resolved)
+        return resolved[codes]
+
+    def lookup_readings(self, readings):
+        return self.lookup([r.get('sensor_id', 'sensor') for r in readings],
+                           [r.get('Crop_stage') for r in readings])
+
+    def column(self, thresholds, name):
+        return thresholds[:, self.columns.index(name)]
+
+    def snapshot(self):
+        return {
+            'keys': len(self.rows),
+            'overrides': self.overrides,
+            'version': self.version,
+            'default': self.default,
+            'memory_bytes': self.values[:len(self.keys)].nbytes,
+        }
@@ -1,115 +1,470 @@
 import tensorflow as tf
 from tensorflow.keras.applications.mobilenet_v2 import MobileNetV2, preprocess_input
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
+from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, Input
 from tensorflow.keras.models import Model
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.callbacks import EarlyStopping
+from tensorflow.keras.callbacks import EarlyStopping, Callback
+import argparse
+import hashlib
 import json
 import os
+import time
+import numpy as np
+from embedding_cache import EmbeddingCache, file_hash
+from strategies_vision import (TRIAGE_CLASSES, TRIAGE_DIAGNOSE, TRIAGE_SIZE, TRIAGE_MODEL_PATH,
+                               TRIAGE_LABELS_PATH, TRIAGE_CONFIDENCE)
 
-# CONFIGURAZIONE 
+# CONFIGURAZIONE
 IMG_SIZE = (224, 224)
 BATCH_SIZE = 32
-DATASET_DIR = "PlantVillage"  
-
-if not os.path.exists(DATASET_DIR):
-    raise FileNotFoundError(f"Errore: La cartella '{DATASET_DIR}' non esiste!")
-
-# 1. GENERATORI DI IMMAGINI ("Addestramento effettuato in modo difficile, in modo da far adattare la rete neurale")
-
-train_datagen = ImageDataGenerator(
-    rescale=1./255,
-    
-    rotation_range=50,              # Ruota molto
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    shear_range=0.2,
-    zoom_range=[0.5, 1.3],          # ZOOM ESTREMO: Dal 50% al 130%. 
-                                    
-    horizontal_flip=True,
-    vertical_flip=True,             # Utile per foto dall'alto (terreni)
-    
-    brightness_range=[0.6, 1.4],    # Simula ombra scura e sole forte
-    channel_shift_range=30.0,       # Simula fotocamere con colori diversi
-    
-    fill_mode='nearest',
-    validation_split=0.3            # 30% delle foto usate per l'esame finale
-)
-
-print("Caricamento Dataset...")
-# I Dati per lo Studio (70%)
-train_generator = train_datagen.flow_from_directory(
-    DATASET_DIR,
-    target_size=IMG_SIZE,
-    batch_size=BATCH_SIZE,
-    class_mode='categorical',
-    subset='training',
-    shuffle=True
-)
-
-# I Dati per l'Esame (30%)
-val_generator = train_datagen.flow_from_directory(
-    DATASET_DIR,
-    target_size=IMG_SIZE,
-    batch_size=BATCH_SIZE,
-    class_mode='categorical',
-    subset='validation',
-    shuffle=False
-)
-
-# SALVATAGGIO MAPPA CLASSI
-class_map_path = "class_indices.json"
-with open(class_map_path, "w") as f:
-    json.dump(train_generator.class_indices, f)
-print(f"Mappa classi salvata in '{class_map_path}'.")
+EPOCHS = 15
+DATASET_DIR = "PlantVillage"
+VALIDATION_SPLIT = 0.3            # 30% delle foto usate per l'esame finale
+CACHE_DIR = "tfdata_cache"        # immagini già decodificate e ridimensionate (disco locale)
+EMBEDDING_CACHE_DIR = "embedding_cache"  # embedding del backbone congelato (fast retrain)
+FAST_EPOCHS = 40
+TRIAGE_EPOCHS = 10
+TRIAGE_ALPHA = 0.35               # MobileNetV2 "stretta": ~0.4M parametri nel backbone
+MODEL_NAME = "greenfield_agri_brain.h5"
+SEED = 42
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+RESIZE_METHOD = 'nearest'         # come flow_from_directory e il serving (load_img / PIL NEAREST)
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+# 1a. GENERATORI DI IMMAGINI ("Addestramento effettuato in modo difficile, in modo da far adattare la rete neurale")
+
+def build_generators():
+    train_datagen = ImageDataGenerator(
+        rescale=1./255,
+
+        rotation_range=50,              # Ruota molto
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=[0.5, 1.3],          # ZOOM ESTREMO: Dal 50% al 130%.
+
+        horizontal_flip=True,
+        vertical_flip=True,             # Utile per foto dall'alto (terreni)
+
+        brightness_range=[0.6, 1.4],    # Simula ombra scura e sole forte
+        channel_shift_range=30.0,       # Simula fotocamere con colori diversi
+
+        fill_mode='nearest',
+        validation_split=VALIDATION_SPLIT
+    )
+
+    # I Dati per lo Studio (70%)
+    train_generator = train_datagen.flow_from_directory(
+        DATASET_DIR,
+        target_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='categorical',
+        subset='training',
+        shuffle=True
+    )
+
+    # I Dati per l'Esame (30%)
+    val_generator = train_datagen.flow_from_directory(
+        DATASET_DIR,
+        target_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='categorical',
+        subset='validation',
+        shuffle=False
+    )
+    return (train_generator, val_generator, train_generator.class_indices,
+            train_generator.samples, val_generator.samples)
+
+
+# 1b. PIPELINE tf.data (decodifica parallela, cache su disco, augmentation vettorizzata, prefetch)
+
+def list_image_files(dataset_dir=DATASET_DIR, validation_split=VALIDATION_SPLIT):
+    """
+    Stesse classi (sottocartelle in ordine alfabetico) e stesso split deterministico
+    di flow_from_directory: per ogni classe la prima quota di file (ordinati) va in validazione.
+    """
+    classes = sorted(d for d in os.listdir(dataset_dir) if os.path.isdir(os.path.join(dataset_dir, d)))
+    class_indices = {c: i for i, c in enumerate(classes)}
+    train, val = ([], []), ([], [])
+    for cls in classes:
+        cls_dir = os.path.join(dataset_dir, cls)
+        files = sorted(f for f in os.listdir(cls_dir) if f.lower().endswith(IMAGE_EXTS))
+        n_val = int(validation_split * len(files))
+        for i, f in enumerate(files):
+            target = val if i < n_val else train
+            target[0].append(os.path.join(cls_dir, f))
+            target[1].append(class_indices[cls])
+    return class_indices, train, val
+
+def build_augmentation():
+    """
+    Augmentation del generatore rifatta con layer Keras (eseguiti in batch nel grafo). Non è identica:
+    - lo shear (shear_range=0.2) non c'è: nessun layer Keras equivalente;
+    - zoom_range=[0.5, 1.3] di Keras scala le coordinate (0.5 = ingrandimento 2x, 1.3 = riduzione),
+      RandomZoom usa frazioni di altezza (negativo = ingrandisce): (-0.5, 0.3), fattore uniforme in
+      un'altra parametrizzazione;
+    - luminosità moltiplicativa in [0.6, 1.4] come brightness_range, ma per immagine e con clip a [0, 1];
+    - channel shift uguale per immagine (±30/255), anche qui con clip.
+    """
+    channel_shift = 30.0 / 255.0
+    return tf.keras.Sequential([
+        tf.keras.layers.RandomRotation(50 / 360, fill_mode='nearest', seed=SEED),
+        tf.keras.layers.RandomTranslation(0.2, 0.2, fill_mode='nearest', seed=SEED),
+        tf.keras.layers.RandomZoom((-0.5, 0.3), fill_mode='nearest', seed=SEED),
+        tf.keras.layers.RandomFlip("horizontal_and_vertical", seed=SEED),
+        tf.keras.layers.Lambda(lambda x: tf.clip_by_value(
+            x * tf.random.uniform([tf.shape(x)[0], 1, 1, 1], 0.6, 1.4), 0.0, 1.0)),
+        tf.keras.layers.Lambda(lambda x: tf.clip_by_value(
+            x + tf.random.uniform([tf.shape(x)[0], 1, 1, 3], -channel_shift, channel_shift), 0.0, 1.0)),
+    ], name="augmentation")
+
+def _decode_resize(path, label, num_classes, size=IMG_SIZE):
+    img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    img = tf.image.resize(img, size, method=RESIZE_METHOD)
+    # uint8 in cache: metà dello spazio rispetto a float16, un quarto rispetto a float32
+    img = tf.cast(tf.clip_by_value(tf.round(img), 0, 255), tf.uint8)
+    return img, tf.one_hot(label, num_classes)
+
+def cache_file(cache_dir, name, files, num_classes, size):
+    """
+    File di ds.cache() legato all'elenco esatto delle immagini (percorso, dimensione, mtime) e al
+    ridimensionamento: aggiungere, togliere o sostituire foto crea una cache nuova invece di riusare quella vecchia.
+    """
+    h = hashlib.sha1(RESIZE_METHOD.encode('utf-8'))
+    for path in sorted(files):
+        st = os.stat(path)
+        h.update(f"{path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+    return os.path.join(cache_dir, f"{name}_{num_classes}cls_{size[0]}_{h.hexdigest()[:12]}")
+
+def build_tfdata_datasets(cache_dir=CACHE_DIR):
+    """
+    Dataset di training (augmentation) e di validazione. Scelta voluta rispetto a build_generators:
+    la validazione qui non è aumentata (là usa train_datagen), quindi val_loss misura le immagini reali
+    e EarlyStopping reagisce a una curva meno rumorosa. Le val_loss dei due percorsi
+    non sono confrontabili; compare_input_pipelines misura solo il training, aumentato in entrambi.
+    """
+    class_indices, train, val = list_image_files()
+    num_classes = len(class_indices)
+    os.makedirs(cache_dir, exist_ok=True)
+    augment = build_augmentation()
+
+    def make(files, labels, name, training):
+        ds = tf.data.Dataset.from_tensor_slices((files, labels))
+        ds = ds.map(lambda p, l: _decode_resize(p, l, num_classes), num_parallel_calls=AUTOTUNE)
+        # Dalla seconda epoca in poi le immagini si leggono già decodificate dalla cache
+        ds = ds.cache(cache_file(cache_dir, name, files, num_classes, IMG_SIZE))
+        if training:
+            ds = ds.shuffle(min(len(files), 10_000), seed=SEED, reshuffle_each_iteration=True)
+        ds = ds.batch(BATCH_SIZE)
+        ds = ds.map(lambda x, y: (tf.cast(x, tf.float32) / 255.0, y), num_parallel_calls=AUTOTUNE)
+        if training:
+            ds = ds.map(lambda x, y: (augment(x, training=True), y), num_parallel_calls=AUTOTUNE)
+        return ds.prefetch(AUTOTUNE)
+
+    return (make(*train, "train", True), make(*val, "val", False), class_indices,
+            len(train[0]), len(val[0]))
+
+
+class ThroughputCallback(Callback):
+    """Registra tempo di ogni epoca e immagini/sec di training."""
+    def __init__(self, n_images):
+        super().__init__()
+        self.n_images = n_images
+        self.epochs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._t0 = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        wall = time.perf_counter() - self._t0
+        self.epochs.append({'epoch': epoch + 1, 'wall_s': round(wall, 2),
+                            'images_per_s': round(self.n_images / wall, 1)})
+        print(f"\n⏱️ Epoca {epoch + 1}: {wall:.1f}s, {self.n_images / wall:.1f} img/s")
+
+
+def measure_input_pipeline(dataset, n_batches=None):
+    """Immagini/sec della sola pipeline di input (nessun modello). n_batches=None = epoca intera."""
+    t0 = time.perf_counter()
+    n, i = 0, -1
+    for i, (x, _) in enumerate(dataset):
+        n += int(x.shape[0])
+        if n_batches is not None and i + 1 >= n_batches:
+            break
+    wall = time.perf_counter() - t0
+    return {'batches': i + 1, 'images': n, 'wall_s': round(wall, 2), 'images_per_s': round(n / wall, 1)}
+
+def compare_input_pipelines(n_batches):
+    print(f"Confronto pipeline di input su {n_batches} batch...")
+    train_gen = build_generators()[0]
+    train_ds = build_tfdata_datasets()[0]
+    report = {
+        'generator': measure_input_pipeline(train_gen, n_batches),
+        # La cache tf.data viene scritta solo a fine epoca: la prima passata è completa
+        'tfdata_first_epoch': measure_input_pipeline(train_ds),
+        'tfdata_cached': measure_input_pipeline(train_ds, n_batches),
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
 
 # 2. ARCHITETTURA (MobileNetV2 Fine-Tuning)
-print("Costruzione Modello...")
-base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
-
-base_model.trainable = True
-fine_tune_at = 100 
-for layer in base_model.layers[:fine_tune_at]:
-    layer.trainable = False
-
-# La "Testa" del modello (Potenziata per gestire il nuovo dataset complesso)
-x = base_model.output
-x = GlobalAveragePooling2D()(x)
-
-# Primo strato denso potente
-x = Dense(1024, activation='relu')(x) 
-x = Dropout(0.5)(x)  # Dropout aggressivo (50%) per evitare che impari a memoria
-
-# Secondo strato di rifinitura
-x = Dense(512, activation='relu')(x)
-x = Dropout(0.3)(x)
-
-predictions = Dense(train_generator.num_classes, activation='softmax')(x)
-
-model = Model(inputs=base_model.input, outputs=predictions)
-
-# 3. COMPILAZIONE
-model.compile(optimizer=Adam(learning_rate=1e-5), # Velocità bassa per precisione
-              loss='categorical_crossentropy', 
-              metrics=['accuracy'])
-
-# Callback
-early_stop = EarlyStopping(monitor='val_loss', patience=4, restore_best_weights=True)
-
-# 4. TRAINING
-print(f"\nInizio training su {train_generator.num_classes} classi...")
-print(f"Immagini di training: {train_generator.samples}")
-print(f"Immagini di test: {val_generator.samples}")
-
-history = model.fit(
-    train_generator, 
-    epochs=15, 
-    validation_data=val_generator,
-    callbacks=[early_stop]
-)
-
-# 5. SALVATAGGIO MODELLO
-model_name = "greenfield_agri_brain.h5"
-model.save(model_name)
-print(f"\nCOMPLETATO! Modello salvato come '{model_name}'")
\ No newline at end of file
+
+def build_model(num_classes):
+    base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
+
+    base_model.trainable = True
+    fine_tune_at = 100
+    for layer in base_model.layers[:fine_tune_at]:
+        layer.trainable = False
+
+    # La "Testa" del modello (Potenziata per gestire il nuovo dataset complesso)
+    x = base_model.output
+    x = GlobalAveragePooling2D()(x)
+
+    # Primo strato denso potente
+    x = Dense(1024, activation='relu')(x)
+    x = Dropout(0.5)(x)  # Dropout aggressivo (50%) per evitare che impari a memoria
+
+    # Secondo strato di rifinitura
+    x = Dense(512, activation='relu')(x)
+    x = Dropout(0.3)(x)
+
+    predictions = Dense(num_classes, activation='softmax')(x)
+
+    model = Model(inputs=base_model.input, outputs=predictions)
+
+    # 3. COMPILAZIONE
+    model.compile(optimizer=Adam(learning_rate=1e-5), # Velocità bassa per precisione
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    return model
+
+
+# 6. FAST RETRAIN: testa densa addestrata sugli embedding in cache del backbone congelato
+
+def load_backbone(model_path=MODEL_NAME):
+    """
+    Backbone congelato fino al GlobalAveragePooling: quello del modello attuale
+    (già fine-tuned) se esiste, altrimenti MobileNetV2 ImageNet.
+    L'id deriva dai pesi, quindi la cache resta valida finché il backbone non cambia.
+    """
+    if os.path.exists(model_path):
+        full = tf.keras.models.load_model(model_path)
+        gap = next(layer for layer in full.layers if isinstance(layer, GlobalAveragePooling2D))
+        backbone = Model(full.input, gap.output)
+    else:
+        backbone = MobileNetV2(weights='imagenet', include_top=False, input_shape=(224, 224, 3), pooling='avg')
+    backbone.trainable = False
+
+    h = hashlib.sha1()
+    for w in backbone.get_weights():
+        h.update(np.ascontiguousarray(w).tobytes())
+    return backbone, h.hexdigest()[:16]
+
+def embed_files(backbone, cache, files):
+    """Embedding per ogni file: calcola solo le immagini (hash) non ancora in cache."""
+    keys = [file_hash(f) for f in files]
+    todo = {}
+    for k, f in zip(keys, files):
+        if k not in cache and k not in todo:
+            todo[k] = f
+    print(f"Embedding: {len(files) - len(todo)} in cache, {len(todo)} da calcolare.")
+
+    if todo:
+        todo_keys, todo_files = list(todo), list(todo.values())
+        ds = tf.data.Dataset.from_tensor_slices(todo_files)
+        ds = ds.map(lambda p: tf.cast(_decode_resize(p, 0, 1)[0], tf.float32) / 255.0, num_parallel_calls=AUTOTUNE)
+        ds = ds.batch(BATCH_SIZE * 4).prefetch(AUTOTUNE)
+        done = 0
+        for batch in ds:
+            emb = backbone(batch, training=False).numpy()
+            cache.put_many(todo_keys[done:done + len(emb)], emb)
+            done += len(emb)
+        cache.save()
+    return cache.get_many(keys)
+
+def build_head(dim, num_classes):
+    """Stessa testa di build_model (Dense 1024 / Dense 512), su input di embedding."""
+    inputs = Input(shape=(dim,))
+    x = Dense(1024, activation='relu')(inputs)
+    x = Dropout(0.5)(x)
+    x = Dense(512, activation='relu')(x)
+    x = Dropout(0.3)(x)
+    outputs = Dense(num_classes, activation='softmax')(x)
+    head = Model(inputs, outputs)
+    head.compile(optimizer=Adam(learning_rate=1e-3), loss='categorical_crossentropy', metrics=['accuracy'])
+    return head
+
+def fast_retrain(epochs=FAST_EPOCHS, cache_root=EMBEDDING_CACHE_DIR):
+    t0 = time.perf_counter()
+    class_indices, train, val = list_image_files()
+    num_classes = len(class_indices)
+
+    backbone, backbone_id = load_backbone()
+    dim = int(backbone.output.shape[-1])
+    # Embedding validi solo per lo stesso backbone e lo stesso ridimensionamento delle immagini
+    cache = EmbeddingCache(os.path.join(cache_root, f"{backbone_id}-{RESIZE_METHOD}"), dim)
+
+    x_train = embed_files(backbone, cache, train[0])
+    x_val = embed_files(backbone, cache, val[0])
+    y_train = tf.keras.utils.to_categorical(train[1], num_classes)
+    y_val = tf.keras.utils.to_categorical(val[1], num_classes)
+    t_embed = time.perf_counter() - t0
+
+    head = build_head(dim, num_classes)
+    head.fit(x_train, y_train, validation_data=(x_val, y_val), epochs=epochs, batch_size=256,
+             callbacks=[EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)])
+
+    # Modello completo drop-in per DeepLearningVisionStrategy: immagine 224x224 /255 -> 44 classi
+    x = backbone.output
+    for layer in head.layers[1:]:
+        x = layer(x)
+    model = Model(backbone.input, x)
+    model.compile(optimizer=Adam(learning_rate=1e-5), loss='categorical_crossentropy', metrics=['accuracy'])
+
+    with open("class_indices.json", "w") as f:
+        json.dump(class_indices, f)
+    model.save(MODEL_NAME)
+    print(f"\nFAST RETRAIN COMPLETATO in {time.perf_counter() - t0:.0f}s "
+          f"(embedding: {t_embed:.0f}s). Modello salvato come '{MODEL_NAME}'")
+
+
+# 7. TRIAGE: modello minuscolo (96x96) che chiude da solo piante sane e sfondo, il resto va al completo
+
+def triage_labels(class_indices, labels):
+    """Etichette del dataset -> classi del triage (le TRIAGE_CLASSES, tutto il resto TRIAGE_DIAGNOSE)."""
+    classes = list(TRIAGE_CLASSES) + [TRIAGE_DIAGNOSE]
+    to_triage = {idx: classes.index(name) if name in TRIAGE_CLASSES else len(TRIAGE_CLASSES)
+                 for name, idx in class_indices.items()}
+    return classes, np.array([to_triage[label] for label in labels], dtype=np.int32)
+
+def build_triage_model(num_classes):
+    base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=(*TRIAGE_SIZE, 3),
+                             alpha=TRIAGE_ALPHA, pooling='avg')
+    base_model.trainable = False
+    x = Dropout(0.2)(base_model.output)
+    predictions = Dense(num_classes, activation='softmax')(x)
+    model = Model(inputs=base_model.input, outputs=predictions)
+    model.compile(optimizer=Adam(learning_rate=1e-3), loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+def train_triage(epochs=TRIAGE_EPOCHS, cache_dir=CACHE_DIR):
+    t0 = time.perf_counter()
+    class_indices, train, val = list_image_files()
+    classes, y_train = triage_labels(class_indices, train[1])
+    _, y_val = triage_labels(class_indices, val[1])
+    num_classes = len(classes)
+    os.makedirs(cache_dir, exist_ok=True)
+    augment = build_augmentation()
+
+    def make(files, labels, name, training):
+        ds = tf.data.Dataset.from_tensor_slices((files, labels))
+        ds = ds.map(lambda p, l: _decode_resize(p, l, num_classes, TRIAGE_SIZE), num_parallel_calls=AUTOTUNE)
+        ds = ds.cache(cache_file(cache_dir, f"triage_{name}", files, num_classes, TRIAGE_SIZE))
+        if training:
+            ds = ds.shuffle(min(len(files), 10_000), seed=SEED, reshuffle_each_iteration=True)
+        ds = ds.batch(BATCH_SIZE * 2)
+        ds = ds.map(lambda x, y: (tf.cast(x, tf.float32) / 255.0, y), num_parallel_calls=AUTOTUNE)
+        if training:
+            ds = ds.map(lambda x, y: (augment(x, training=True), y), num_parallel_calls=AUTOTUNE)
+        return ds.prefetch(AUTOTUNE)
+
+    train_data, val_data = make(train[0], y_train, "train", True), make(val[0], y_val, "val", False)
+    # "Da diagnosticare" è la grande maggioranza: pesi inversi alla frequenza per le classi piccole
+    counts = np.bincount(y_train, minlength=num_classes)
+    class_weight = {i: len(y_train) / (num_classes * max(c, 1)) for i, c in enumerate(counts)}
+
+    model = build_triage_model(num_classes)
+    print(f"\nTraining triage {TRIAGE_SIZE[0]}x{TRIAGE_SIZE[1]} su {num_classes} classi: {len(y_train)} immagini.")
+    model.fit(train_data, epochs=epochs, validation_data=val_data, class_weight=class_weight,
+              callbacks=[EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True)])
+
+    model.save(TRIAGE_MODEL_PATH)
+    with open(TRIAGE_LABELS_PATH, "w") as f:
+        json.dump({'classes': classes, 'input_size': list(TRIAGE_SIZE)}, f)
+
+    # Per soglia: quota di immagini chiuse dal triage e quante di queste hanno la classe giusta
+    preds = model.predict(val_data, verbose=0)
+    top, confidence = preds.argmax(axis=1), preds.max(axis=1)
+    closes = top != len(TRIAGE_CLASSES)
+    print(f"\nTRIAGE COMPLETATO in {time.perf_counter() - t0:.0f}s. Modello salvato come '{TRIAGE_MODEL_PATH}'")
+    print("soglia  chiuse dal triage  corrette")
+    for threshold in sorted({0.5, 0.7, 0.8, 0.9, 0.95, TRIAGE_CONFIDENCE}):
+        taken = closes & (confidence >= threshold)
+        precision = float((top[taken] == y_val[taken]).mean()) if taken.any() else float('nan')
+        print(f"{threshold:6.2f}  {taken.mean():17.1%}  {precision:8.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Training del classificatore visivo GreenField")
+    parser.add_argument('--input', choices=['tfdata', 'generator'], default='tfdata',
+                        help="pipeline di input (tfdata = decodifica parallela + cache + prefetch)")
+    parser.add_argument('--epochs', type=int, default=None,
+                        help=f"default {EPOCHS} (fine-tuning) / {FAST_EPOCHS} (--fast-retrain) / {TRIAGE_EPOCHS} (--triage)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--compare-input', type=int, metavar='N_BATCHES',
+                        help="misura solo le pipeline di input (generator vs tf.data) ed esce")
+    parser.add_argument('--fast-retrain', action='store_true',
+                        help="riaddestra solo la testa densa sugli embedding in cache del backbone congelato")
+    parser.add_argument('--triage', action='store_true',
+                        help=f"addestra il modello di triage della cascata ({TRIAGE_MODEL_PATH})")
+    args = parser.parse_args()
+
+    if not os.path.exists(DATASET_DIR):
+        raise FileNotFoundError(f"Errore: La cartella '{DATASET_DIR}' non esiste!")
+
+    if args.fast_retrain:
+        fast_retrain(epochs=args.epochs or FAST_EPOCHS)
+        return
+
+    if args.triage:
+        train_triage(epochs=args.epochs or TRIAGE_EPOCHS, cache_dir=args.cache_dir)
+        return
+
+    if args.compare_input:
+        compare_input_pipelines(args.compare_input)
+        return
+
+    print("Caricamento Dataset...")
+    if args.input == 'tfdata':
+        train_data, val_data, class_indices, n_train, n_val = build_tfdata_datasets(args.cache_dir)
+    else:
+        train_data, val_data, class_indices, n_train, n_val = build_generators()
+
+    # SALVATAGGIO MAPPA CLASSI
+    class_map_path = "class_indices.json"
+    with open(class_map_path, "w") as f:
+        json.dump(class_indices, f)
+    print(f"Mappa classi salvata in '{class_map_path}'.")
+
+    print("Costruzione Modello...")
+    model = build_model(len(class_indices))
+
+    # Callback
+    early_stop = EarlyStopping(monitor='val_loss', patience=4, restore_best_weights=True)
+    throughput = ThroughputCallback(n_train)
+
+    # 4. TRAINING
+    print(f"\nInizio training su {len(class_indices)} classi (input: {args.input})...")
+    print(f"Immagini di training: {n_train}")
+    print(f"Immagini di test: {n_val}")
+
+    history = model.fit(
+        train_data,
+        epochs=args.epochs or EPOCHS,
+        validation_data=val_data,
+        callbacks=[early_stop, throughput]
+    )
+
+    with open("training_throughput.json", "w") as f:
+        json.dump({'input': args.input, 'epochs': throughput.epochs}, f, indent=2)
+
+    # 5. SALVATAGGIO MODELLO
+    model.save(MODEL_NAME)
+    print(f"\nCOMPLETATO! Modello salvato come '{MODEL_NAME}'")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+import argparse
+import collections
+import io
+import json
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Connection
+
+import numpy as np
+from strategies_vision import ImageAnalysisStrategy
+
+# Repliche del modello di visione in processi separati (0 = modello nel processo del gateway)
+VISION_REPLICAS = int(os.environ.get("GREENFIELD_VISION_REPLICAS", 2))
+VISION_MAX_INFLIGHT = int(os.environ.get("GREENFIELD_VISION_MAX_INFLIGHT", 16))  # richieste in coda + in corso
+MAX_IMAGE_BYTES = 8 << 20     # dimensione di uno slot di memoria condivisa (immagine codificata)
+ACQUIRE_TIMEOUT_S = 0.5       # attesa massima di uno slot libero prima del 503
+REQUEST_TIMEOUT_S = 30.0
+READY_TIMEOUT_S = 300.0       # caricamento + warm-up di una replica
+RESTART_BACKOFF_S = 2.0
+ADOPT_POLL_S = 0.2            # una replica inattiva adotta il modello nuovo entro questo intervallo
+MAX_START_FAILURES = 3        # avvii falliti di fila prima di lasciare la replica ferma
+LATENCY_SAMPLES = 1000
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class VisionBusy(Exception):
+    """Tutti gli slot occupati: il gateway risponde 503 con Retry-After."""
+
+
+class VisionUnavailable(Exception):
+    """Nessuna replica ha completato la richiesta (timeout o replica terminata)."""
+
+
+class _Worker:
+    """Processo replica con il suo canale; pronto dopo il messaggio 'ready' (warm-up ed eventuale canary)."""
+    def __init__(self, proc, conn):
+        self.proc = proc
+        self.conn = conn
+        self.warmup_ms = None
+        self.canary = []   # [(classe, confidenza)] sulle immagini canary
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+
+class _Generation:
+    """Un modello (file .h5 + etichette) e i processi che lo servono, uno per replica."""
+    def __init__(self, model_path, json_path, replicas, version=None):
+        self.model_path = os.path.abspath(model_path)
+        self.json_path = os.path.abspath(json_path)
+        with open(self.json_path, 'r') as f:
+            self.labels_map = {int(v): k for k, v in json.load(f).items()}
+        self.workers = [None] * replicas
+        self.version = version
+
+
+class _Replica:
+    def __init__(self, replica_id):
+        self.id = replica_id
+        self.worker = None
+        self.staged = None   # processo del modello nuovo, adottato fra una richiesta e l'altra
+        self.ready = False
+        self.failed = False
+        self.busy = False
+        self.served = 0
+        self.restarts = 0
+        self.start_failures = 0
+        self.warmup_ms = None
+        self.last_error = None
+
+    def snapshot(self):
+        return {
+            'id': self.id,
+            'pid': self.worker.proc.pid if self.worker else None,
+            'alive': self.worker is not None and self.worker.alive,
+            'ready': self.ready,
+            'failed': self.failed,
+            'busy': self.busy,
+            'served': self.served,
+            'restarts': self.restarts,
+            'warmup_ms': self.warmup_ms,
+            'last_error': self.last_error,
+        }
+
+
+class VisionWorkerPool(ImageAnalysisStrategy):
+    """
+    N repliche del modello, ognuna in un processo con il proprio interprete (niente GIL condiviso
+    con Flask/Socket.IO), caricate e scaldate con un batch fittizio prima di ricevere richieste.
+    I byte dell'immagine passano da uno slot di memoria condivisa: sul socket viaggiano solo
+    (slot, lunghezza) e (classe, confidenza); decodifica e resize avvengono nella replica.
+    Gli slot liberi sono anche il limite di concorrenza: senza slot la richiesta è rifiutata.
+    Ogni replica ha un thread che preleva dalla coda comune, quindi la prima libera serve la richiesta.
+    Un modello nuovo (stage) parte in processi propri accanto a quelli in servizio; install li fa
+    adottare alle repliche fra una richiesta e l'altra, i vecchi restano pronti fino a discard (rollback).
+    """
+    def __init__(self, model_path, json_path, replicas=VISION_REPLICAS, max_inflight=VISION_MAX_INFLIGHT,
+                 slot_bytes=MAX_IMAGE_BYTES, threads=None, version=None):
+        self.generation = _Generation(model_path, json_path, replicas, version)
+        self.labels_map = self.generation.labels_map
+        self.slot_bytes = slot_bytes
+        self.max_inflight = max_inflight
+        # Thread TensorFlow per replica: N repliche non si contendono gli stessi core
+        self.threads = threads or max(1, (os.cpu_count() or 1) // max(1, replicas))
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max_inflight * slot_bytes)
+        self.free_slots = queue.Queue()
+        for slot in range(max_inflight):
+            self.free_slots.put(slot)
+        self.requests = queue.Queue()   # (future, slot, byte)
+        self.replicas = [_Replica(i) for i in range(replicas)]
+        self._threads = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+        self.served = 0
+        self.rejected = 0
+        self.failed = 0
+        self.latency_ms = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    # --- Gestione delle repliche ---
+
+    def start(self):
+        for replica in self.replicas:
+            thread = threading.Thread(target=self._serve, args=(replica,), name=f'vision-replica-{replica.id}',
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def wait_ready(self, timeout=READY_TIMEOUT_S):
+        """Attende che tutte le repliche abbiano finito il warm-up (o siano fallite)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(r.ready or r.failed for r in self.replicas):
+                break
+            time.sleep(0.05)
+        return sum(r.ready for r in self.replicas)
+
+    def _launch(self, generation, canary=()):
+        parent_sock, child_sock = socket.socketpair()
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(p for p in (BACKEND_DIR, env.get('PYTHONPATH')) if p)
+        # Processo nuovo con '-m': con spawn il figlio rieseguirebbe server.py come __mp_main__
+        cmd = [sys.executable, '-m', 'vision_pool', '--fd', str(child_sock.fileno()),
+               '--shm', self.shm.name, '--slot-bytes', str(self.slot_bytes), '--threads', str(self.threads),
+               '--model', generation.model_path, '--labels', generation.json_path]
+        for path in canary:
+            cmd += ['--canary', os.path.abspath(path)]
+        try:
+            proc = subprocess.Popen(cmd, pass_fds=(child_sock.fileno(),), env=env)
+        finally:
+            child_sock.close()
+        return _Worker(proc, Connection(parent_sock.detach()))
+
+    def _await(self, worker):
+        if not worker.conn.poll(READY_TIMEOUT_S):
+            raise TimeoutError(f"nessun warm-up entro {READY_TIMEOUT_S}s")
+        kind, info = worker.conn.recv()
+        if kind != 'ready':
+            raise RuntimeError(info)
+        worker.warmup_ms = info['warmup_ms']
+        worker.canary = info.get('canary', [])
+        return worker
+
+    def _stop(self, worker):
+        if worker is None:
+            return
+        worker.conn.close()  # la replica esce alla fine del canale
+        if worker.alive:
+            try:
+                worker.proc.wait(5)
+            except subprocess.TimeoutExpired:
+                worker.proc.kill()
+
+    def _serve(self, replica):
+        while not self._closed:
+            generation = self.generation
+            try:
+                if replica.staged is not None and replica.staged.alive:
+                    # Riavvio durante un cambio di modello: il processo nuovo è già pronto
+                    worker = replica.worker = replica.staged
+                    replica.staged = None
+                else:
+                    worker = replica.worker = self._launch(generation)
+                    self._await(worker)
+                    generation.workers[replica.id] = worker
+                replica.warmup_ms = worker.warmup_ms
+                replica.ready = True
+                replica.start_failures = 0
+                print(f"✅ VISION: replica {replica.id} pronta (pid {worker.proc.pid}, warm-up {worker.warmup_ms} ms)")
+                self._dispatch(replica)
+            except (EOFError, OSError, RuntimeError, TimeoutError) as e:
+                replica.last_error = str(e) or type(e).__name__
+                if not replica.ready:
+                    replica.start_failures += 1
+                replica.ready = False
+                self._stop(replica.worker)
+                if self._closed:
+                    break
+                if replica.start_failures >= MAX_START_FAILURES:
+                    replica.failed = True
+                    print(f"❌ VISION: replica {replica.id} non avviabile ({replica.last_error}): ferma")
+                    break
+                replica.restarts += 1
+                print(f"⚠️ VISION: replica {replica.id} terminata ({replica.last_error}): riavvio")
+                time.sleep(RESTART_BACKOFF_S)
+        replica.ready = False
+
+    def _dispatch(self, replica):
+        while True:
+            if replica.staged is not None:
+                # Modello nuovo: il processo precedente resta alla sua generazione (rollback o discard)
+                replica.worker, replica.staged = replica.staged, None
+                replica.warmup_ms = replica.worker.warmup_ms
+            try:
+                future, slot, nbytes = self.requests.get(timeout=ADOPT_POLL_S)
+            except queue.Empty:
+                continue
+            if future is None:   # chiusura del pool
+                return
+            if not future.set_running_or_notify_cancel():  # chiamante già andato in timeout
+                self.free_slots.put(slot)
+                continue
+            replica.busy = True
+            t0 = time.perf_counter()
+            try:
+                replica.worker.conn.send((slot, nbytes))
+                idx, confidence = replica.worker.conn.recv()
+            except (EOFError, OSError) as e:
+                with self._lock:
+                    self.failed += 1
+                future.set_exception(VisionUnavailable(f"replica {replica.id} terminata durante l'analisi"))
+                raise e
+            finally:
+                replica.busy = False
+                self.free_slots.put(slot)
+            replica.served += 1
+            with self._lock:
+                self.served += 1
+                self.latency_ms.append((time.perf_counter() - t0) * 1000)
+            future.set_result((idx, confidence))
+
+    # --- Cambio di modello a caldo (vedi model_registry.ModelWatcher) ---
+
+    def stage(self, model_path, json_path, version=None, canary=()):
+        """Avvia e scalda un processo per replica con il modello nuovo, senza toccare quelli in servizio."""
+        generation = _Generation(model_path, json_path, len(self.replicas), version)
+        workers = [self._launch(generation, canary) for _ in self.replicas]
+        try:
+            generation.workers = [self._await(worker) for worker in workers]
+        except (EOFError, OSError, RuntimeError, TimeoutError):
+            for worker in workers:
+                self._stop(worker)
+            raise
+        return generation
+
+    def canary_results(self, generation):
+        return [result for worker in generation.workers for result in worker.canary]
+
+    def install(self, generation, timeout=READY_TIMEOUT_S):
+        """Le repliche adottano 'generation' fra una richiesta e l'altra. Restituisce la generazione precedente."""
+        if any(worker is None or not worker.alive for worker in generation.workers):
+            raise RuntimeError("processi della generazione non più attivi")
+        previous = self.generation
+        self.labels_map = generation.labels_map
+        self.generation = generation
+        for replica, worker in zip(self.replicas, generation.workers):
+            replica.staged = worker
+        deadline = time.monotonic() + timeout
+        while any(r.staged is not None and not r.failed for r in self.replicas) and time.monotonic() < deadline:
+            time.sleep(ADOPT_POLL_S / 4)
+        return previous
+
+    def discard(self, generation):
+        """Ferma i processi di una generazione non più in servizio."""
+        if generation is self.generation:
+            return
+        in_use = {id(r.worker) for r in self.replicas}
+        for worker in generation.workers:
+            if worker is not None and id(worker) not in in_use:
+                self._stop(worker)
+
+    # --- ImageAnalysisStrategy ---
+
+    def analyze(self, image_path):
+        with open(image_path, 'rb') as f:
+            return self.analyze_bytes(f.read())
+
+    def analyze_bytes(self, data, timeout=REQUEST_TIMEOUT_S):
+        if len(data) > self.slot_bytes:
+            raise ValueError(f"Immagine di {len(data)} byte oltre il limite di {self.slot_bytes}")
+        if not any(r.ready for r in self.replicas):
+            raise VisionUnavailable("Nessuna replica del modello pronta")
+        try:
+            slot = self.free_slots.get(timeout=ACQUIRE_TIMEOUT_S)
+        except queue.Empty:
+            with self._lock:
+                self.rejected += 1
+            raise VisionBusy(f"{self.max_inflight} analisi già in corso") from None
+
+        offset = slot * self.slot_bytes
+        self.shm.buf[offset:offset + len(data)] = data
+        future = Future()
+        self.requests.put((future, slot, len(data)))
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()  # se ancora in coda la replica la salta e libera lo slot
+            raise VisionUnavailable(f"Analisi non completata entro {timeout}s") from None
+
+    # --- Stato e chiusura ---
+
+    def health(self):
+        def pct(samples, q):
+            return round(float(np.percentile(np.array(samples), q)), 2) if samples else None
+        with self._lock:
+            latency = list(self.latency_ms)
+            served, rejected, failed = self.served, self.rejected, self.failed
+        return {
+            'model': {'version': self.generation.version, 'path': self.generation.model_path},
+            'replicas': [r.snapshot() for r in self.replicas],
+            'ready': sum(r.ready for r in self.replicas),
+            'max_inflight': self.max_inflight,
+            'in_flight': self.max_inflight - self.free_slots.qsize(),
+            'queued': self.requests.qsize(),
+            'served': served,
+            'rejected': rejected,
+            'failed': failed,
+            'latency_ms_p50': pct(latency, 50),
+            'latency_ms_p99': pct(latency, 99),
+            'threads_per_replica': self.threads,
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self.replicas:
+            self.requests.put((None, None, None))
+        for thread in self._threads:
+            thread.join(5)
+        for replica in self.replicas:
+            self._stop(replica.staged)
+            self._stop(replica.worker)
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _worker(args):
+    """Processo replica: carica il modello, warm-up, poi serve (slot, byte) finché il gateway non chiude."""
+    conn = Connection(args.fd)
+    shm = shared_memory.SharedMemory(name=args.shm)
+    # La memoria appartiene al gateway: il resource tracker della replica non deve rimuoverla all'uscita
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    try:
+        try:
+            import tensorflow as tf
+            tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except ImportError:
+            pass
+        from strategies_vision import build_vision_strategy
+        strategy = build_vision_strategy(args.model, args.labels)
+        if not strategy.is_custom_ready:
+            raise RuntimeError(f"modello {args.model} non caricato")
+        t0 = time.perf_counter()
+        strategy.warm_up()
+        warmup_ms = round((time.perf_counter() - t0) * 1000, 1)
+        # Modello nuovo: predizioni sulle immagini canary, valutate dal gateway prima dello scambio
+        canary = [tuple(map(float, strategy.analyze(path))) for path in args.canary]
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+        return 1
+    conn.send(('ready', {'pid': os.getpid(), 'warmup_ms': warmup_ms, 'canary': canary}))
+
+    while True:
+        try:
+            slot, nbytes = conn.recv()
+        except (EOFError, OSError):  # gateway terminato o pool chiuso
+            break
+        offset = slot * args.slot_bytes
+        data = bytes(shm.buf[offset:offset + nbytes])
+        idx, confidence = strategy.analyze(io.BytesIO(data))
+        conn.send((int(idx), float(confidence)))
+    shm.close()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replica del modello di visione (avviata da VisionWorkerPool)")
+    parser.add_argument('--fd', type=int, required=True)
+    parser.add_argument('--shm', required=True)
+    parser.add_argument('--slot-bytes', type=int, required=True)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--labels', required=True)
+    parser.add_argument('--canary', action='append', default=[], help="immagine da classificare dopo il warm-up")
+    sys.exit(_worker(parser.parse_args()))
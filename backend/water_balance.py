@@ -0,0 +1,173 @@
+import numpy as np
+
+# Bilancio idrico del suolo (FAO-56, coefficiente colturale singolo) per la pianificazione multi-giorno
+PLAN_DAYS = 14
+MAX_PLAN_DAYS = 60
+FIELD_CAPACITY_PCT = 70.0      # umidità volumetrica a capacità di campo (massimo del dataset)
+WILTING_POINT_PCT = 15.0       # punto di appassimento
+DEPLETION_FRACTION = 0.4       # p del pomodoro (FAO-56 Tab. 22): oltre RAW = p * TAW la coltura è in stress
+IRRIGATION_EFFICIENCY = 0.9    # goccia: lordo = netto / efficienza
+# Lordo massimo per intervento (goccia, 20-50 mm tipici): con la scala di umidità del dataset un
+# ripristino completo a capacità di campo vale centinaia di mm, il resto si recupera nei giorni successivi
+MAX_EVENT_MM = 40.0
+# Pomodoro (FAO-56 Tab. 12 e 22): Kc e profondità radicale per fase, se la lettura non li riporta
+STAGE_KC = {'Initial Stage': 0.6, 'Development Stage': 0.85, 'Mid stage': 1.15, 'Last stage': 0.8}
+STAGE_ROOT_DEPTH_M = {'Initial Stage': 0.25, 'Development Stage': 0.5, 'Mid stage': 0.9, 'Last stage': 1.0}
+DEFAULT_KC = 1.0
+DEFAULT_ROOT_DEPTH_M = 0.6
+ROUND_DECIMALS = 1
+
+
+def _per_field(values, n):
+    return np.broadcast_to(np.asarray(values, dtype=float), (n,))
+
+
+def _per_day(values, n, days):
+    """Valore per campo (n,) ripetuto sui giorni, oppure già una previsione (n, days)."""
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    return np.broadcast_to(values, (n, days))
+
+
+def simulate(moisture, et0, kc, root_depth, threshold, days=PLAN_DAYS, rain=0.0,
+             field_capacity=FIELD_CAPACITY_PCT, wilting_point=WILTING_POINT_PCT,
+             depletion_fraction=DEPLETION_FRACTION, max_event_mm=MAX_EVENT_MM, efficiency=IRRIGATION_EFFICIENCY):
+    """
+    Proietta l'esaurimento idrico della zona radicale Dr di tutti i campi insieme, giorno per giorno:
+    Dr = Dr_prec - pioggia - irrigazione + Ks * Kc * ET0, con Dr in [0, TAW] (l'eccesso percola).
+    Un campo si irriga solo nel giorno in cui la sua umidità scenderebbe sotto la soglia, riportandolo
+    verso la capacità di campo con al più max_event_mm lordi: il calendario con il minor numero di
+    interventi che rispetta le soglie, entro la portata dell'impianto.
+    Ingressi per campo (n,); et0, kc e rain anche come previsione (n, days). Restituisce matrici (n, days).
+    """
+    moisture = np.asarray(moisture, dtype=float)
+    n = len(moisture)
+    et0, kc, rain = _per_day(et0, n, days), _per_day(kc, n, days), _per_day(rain, n, days)
+    fc, wp = _per_field(field_capacity, n), _per_field(wilting_point, n)
+    cap = _per_field(max_event_mm, n) * efficiency  # netto massimo per intervento
+
+    mm_per_pct = 10.0 * _per_field(root_depth, n)  # mm d'acqua per punto % nello strato radicale
+    taw = np.maximum(fc - wp, 0.0) * mm_per_pct
+    raw = depletion_fraction * taw
+    dr = np.clip((fc - moisture) * mm_per_pct, 0.0, taw)
+    dr_max = np.clip((fc - _per_field(threshold, n)) * mm_per_pct, 0.0, taw)  # esaurimento alla soglia
+
+    depletion = np.empty((n, days))
+    net = np.zeros((n, days))
+    percolation = np.zeros((n, days))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for d in range(days):
+            ks = np.where(dr > raw, np.clip((taw - dr) / ((1 - depletion_fraction) * taw), 0.0, 1.0), 1.0)
+            etc = ks * kc[:, d] * et0[:, d]
+            # Irrigazione all'inizio del giorno solo se a fine giorno si scenderebbe sotto la soglia
+            need = dr + etc - rain[:, d] > dr_max
+            net[:, d] = np.where(need, np.clip(dr - rain[:, d], 0.0, cap), 0.0)
+            etc = np.where(need, np.where(dr - net[:, d] > raw, etc, kc[:, d] * et0[:, d]), etc)  # niente stress dopo il ripristino
+            dr = dr - rain[:, d] - net[:, d] + etc
+            percolation[:, d] = np.maximum(-dr, 0.0)
+            dr = np.clip(dr, 0.0, taw)
+            depletion[:, d] = dr
+
+    projected = fc[:, None] - depletion / mm_per_pct[:, None]
+    return {
+        'moisture_pct': projected,
+        'depletion_mm': depletion,
+        'irrigation_net_mm': net,
+        'irrigation_mm': net / efficiency,
+        'percolation_mm': percolation,
+        'below_threshold': depletion > dr_max[:, None] + 1e-9,
+    }
+
+
+def _value(reading, key, default):
+    value = reading.get(key)
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else default
+
+
+def _forecast(readings, key, base, days):
+    """Previsione giornaliera (n, days) dalle liste 'key' delle letture; i giorni mancanti ripetono 'base'."""
+    out = np.repeat(np.asarray(base, dtype=float)[:, None], days, axis=1)
+    for i, reading in enumerate(readings):
+        series = reading.get(key)
+        if isinstance(series, list) and series:
+            values = np.array(series[:days], dtype=float)
+            out[i, :len(values)] = values
+    return out
+
+
+def _check(values, name, condition, message):
+    bad = ~np.isfinite(values) | ~condition
+    if bad.any():
+        raise ValueError(f"{name} {message} (campo {int(np.argmax(bad))})")
+
+
+def plan_readings(readings, moisture_thresholds, days=PLAN_DAYS, max_event_mm=MAX_EVENT_MM,
+                  efficiency=IRRIGATION_EFFICIENCY, daily=False):
+    """
+    Calendario irriguo per un elenco di campi (ultima lettura di ciascuno, stesse chiavi del dataset).
+    Facoltativi per campo: 'et0_mm' e 'rain_mm' (previsioni giornaliere), 'root_depth_m',
+    'field_capacity_pct', 'wilting_point_pct'. moisture_thresholds: soglia di umidità per campo.
+    ValueError se un ingresso porterebbe a NaN (profondità radicale non positiva, capacità di campo
+    non sopra il punto di appassimento, previsioni non numeriche).
+    """
+    n = len(readings)
+    stages = [reading.get('Crop_stage') for reading in readings]
+    moisture = np.array([_value(r, 'Soil_moisture_pct', np.nan) for r in readings])
+    et0_today = np.array([_value(r, 'Reference_ET_mm', 0.0) for r in readings])
+    kc = np.array([_value(r, 'Crop_Coefficient', STAGE_KC.get(s, DEFAULT_KC)) for r, s in zip(readings, stages)])
+    root = np.array([_value(r, 'root_depth_m', STAGE_ROOT_DEPTH_M.get(s, DEFAULT_ROOT_DEPTH_M))
+                     for r, s in zip(readings, stages)])
+    fc = np.array([_value(r, 'field_capacity_pct', FIELD_CAPACITY_PCT) for r in readings])
+    wp = np.array([_value(r, 'wilting_point_pct', WILTING_POINT_PCT) for r in readings])
+    # Umidità mancante: il campo parte dalla capacità di campo (nessun intervento anticipato)
+    moisture = np.where(np.isnan(moisture), fc, moisture)
+    et0 = _forecast(readings, 'et0_mm', et0_today, days)
+    rain = _forecast(readings, 'rain_mm', np.zeros(n), days)
+    _check(root, 'root_depth_m', root > 0, "deve essere positiva")
+    _check(fc - wp, 'field_capacity_pct', fc > wp, "deve superare wilting_point_pct")
+    _check(moisture, 'Soil_moisture_pct', moisture >= 0, "non valida")
+    _check(kc, 'Crop_Coefficient', kc >= 0, "non valido")
+    _check(et0.min(axis=1), 'et0_mm', et0.min(axis=1) >= 0, "non valida")
+    _check(rain.min(axis=1), 'rain_mm', rain.min(axis=1) >= 0, "non valida")
+
+    result = simulate(moisture, et0, kc, root, moisture_thresholds, days, rain, fc, wp,
+                      max_event_mm=max_event_mm, efficiency=efficiency)
+
+    gross = np.round(result['irrigation_mm'], ROUND_DECIMALS)
+    events = gross > 0
+    first_day = np.where(events.any(axis=1), events.argmax(axis=1), -1)
+    stress_days = result['below_threshold'].sum(axis=1)
+    final = np.round(result['moisture_pct'][:, -1], ROUND_DECIMALS)
+    totals = np.round(gross.sum(axis=1), ROUND_DECIMALS)
+    thresholds = np.broadcast_to(np.asarray(moisture_thresholds, dtype=float), (n,))
+    moisture_rows = np.round(result['moisture_pct'], ROUND_DECIMALS).tolist() if daily else None
+
+    fields = []
+    for i, reading in enumerate(readings):
+        days_i = np.flatnonzero(events[i])
+        field = {
+            'sensor_id': reading.get('sensor_id', 'sensor'),
+            'moisture_threshold': float(thresholds[i]),
+            'events': [{'day': int(d), 'mm': float(gross[i, d])} for d in days_i],
+            'total_mm': float(totals[i]),
+            'first_day': int(first_day[i]),
+            'stress_days': int(stress_days[i]),
+            'final_moisture_pct': float(final[i]),
+        }
+        if daily:
+            field['moisture_pct'] = moisture_rows[i]
+        fields.append(field)
+
+    return {
+        'days': days,
+        'fields': fields,
+        'summary': {
+            'fields': n,
+            'fields_to_irrigate': int((first_day >= 0).sum()),
+            'irrigate_today': int((first_day == 0).sum()),
+            'events': int(events.sum()),
+            'total_mm': float(np.round(totals.sum(), ROUND_DECIMALS)),
+            'stress_days': int(stress_days.sum()),
+        },
+    }
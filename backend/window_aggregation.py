@@ -0,0 +1,168 @@
+import json
+import numpy as np
+
+# Pre-aggregazione lato edge: riassunti per sensore a finestre fisse + eventi grezzi sui salti
+EVENT_WINDOW = "sensor_window"
+WINDOW_S = 60.0
+# Scostamento dall'ultimo valore inviato oltre il quale la lettura parte subito come evento grezzo.
+# Tarati su sensori reali (valori che variano lentamente): sulle righe indipendenti di data_test.csv
+# quasi ogni lettura li supera e parte grezza, il risparmio si vede solo con --no-deltas
+EDGE_DELTAS = {
+    'Soil_moisture_pct': 10.0,
+    'Temperature_C': 3.0,
+    'Nitrogen_mg_kg': 20.0,
+    'Phosphorus_mg_kg': 20.0,
+    'Potassium_mg_kg': 20.0,
+    'pH': 1.0,
+}
+MEAN_DECIMALS = 3
+COMPACT = (',', ':')
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _SensorWindow:
+    """Statistiche della finestra corrente di un sensore (vettori NumPy, una voce per colonna)."""
+    def __init__(self, columns, delta):
+        self.columns = columns
+        self.delta = delta
+        self.reference = np.full(len(columns), np.nan)  # ultimi valori inviati (grezzi o 'last')
+        self.window_id = None
+        self.reset()
+
+    def reset(self):
+        n = len(self.columns)
+        self.count = 0
+        self.raw_sent = 0
+        self.last_raw = False
+        self.minimum = np.full(n, np.inf)
+        self.maximum = np.full(n, -np.inf)
+        self.total = np.zeros(n)
+        self.valid = np.zeros(n, dtype=np.int64)
+        self.last = np.full(n, np.nan)
+        self.tags = {}
+        self.last_ts = None
+
+
+class WindowAggregator:
+    """
+    Riassume le letture di ogni sensore per finestre fisse di window_s secondi
+    (last/min/max/mean per colonna + count). Una lettura che si scosta dall'ultimo
+    valore inviato oltre EDGE_DELTAS viene anche inviata subito come evento grezzo.
+    add() e flush() restituiscono i payload (dict) da pubblicare, in ordine.
+    """
+    def __init__(self, window_s=WINDOW_S, deltas=None):
+        self.window_s = window_s
+        self.deltas = dict(EDGE_DELTAS if deltas is None else deltas)
+        self.sensors = {}
+        self.skipped = 0  # finestre senza riassunto (già coperte dagli eventi grezzi)
+
+    def _state(self, sensor_id, event):
+        state = self.sensors.get(sensor_id)
+        if state is None:
+            columns = [k for k, v in event.items() if not k.startswith('_') and k != 'sensor_id' and _is_number(v)]
+            delta = np.array([self.deltas.get(c, np.inf) for c in columns])
+            state = self.sensors[sensor_id] = _SensorWindow(columns, delta)
+        return state
+
+    def add(self, event):
+        sensor_id = event.get('sensor_id', 'sensor')
+        ts = float(event.get('_ts', 0.0))
+        state = self._state(sensor_id, event)
+        out = []
+
+        window_id = int(ts // self.window_s)
+        if state.window_id is not None and window_id != state.window_id and state.count:
+            out.extend(self._close(sensor_id, state))
+        state.window_id = window_id
+
+        values = np.array([event.get(c) if _is_number(event.get(c)) else np.nan for c in state.columns], dtype=float)
+        present = ~np.isnan(values)
+        state.count += 1
+        state.minimum = np.where(present, np.minimum(state.minimum, values), state.minimum)
+        state.maximum = np.where(present, np.maximum(state.maximum, values), state.maximum)
+        state.total += np.where(present, values, 0.0)
+        state.valid += present
+        state.last = values
+        state.tags = {k: v for k, v in event.items()
+                      if not k.startswith('_') and k != 'sensor_id' and not _is_number(v)}
+        state.last_ts = ts
+
+        # Salto rispetto all'ultimo valore inviato (prima lettura del sensore: sempre grezza)
+        moved = np.abs(values - state.reference) > state.delta
+        state.last_raw = bool(np.isnan(state.reference).all() or moved.any())
+        if state.last_raw:
+            state.raw_sent += 1
+            state.reference = np.where(present, values, state.reference)
+            out.append(event)
+        return out
+
+    def flush(self, now=None):
+        """Chiude le finestre terminate prima di 'now' (tutte se None): sensori silenziosi o fine stream."""
+        out = []
+        for sensor_id, state in self.sensors.items():
+            if state.count and (now is None or (state.window_id + 1) * self.window_s <= now):
+                out.extend(self._close(sensor_id, state))
+        return out
+
+    def _close(self, sensor_id, state):
+        """Riassunto della finestra, omesso se tutte le sue letture sono già partite grezze."""
+        if state.raw_sent == state.count:
+            self.skipped += 1
+            state.reset()
+            return []
+        return [self._summary(sensor_id, state)]
+
+    def _summary(self, sensor_id, state):
+        mean = np.where(state.valid > 0, state.total / np.maximum(state.valid, 1), np.nan)
+        summary = {
+            '_event_type': EVENT_WINDOW,
+            '_ts': state.last_ts,
+            'sensor_id': sensor_id,
+            'window': [state.window_id * self.window_s, (state.window_id + 1) * self.window_s],
+            'count': state.count,
+            'raw_sent': state.raw_sent,
+            'last_raw': state.last_raw,  # l'ultima lettura è già arrivata come evento grezzo
+            'columns': state.columns,
+            'last': _json_list(state.last),
+            'min': _json_list(np.where(state.valid > 0, state.minimum, np.nan)),
+            'max': _json_list(np.where(state.valid > 0, state.maximum, np.nan)),
+            'mean': _json_list(np.round(mean, MEAN_DECIMALS)),
+            'tags': state.tags,
+        }
+        if not state.last_raw:
+            state.reference = np.where(np.isnan(state.last), state.reference, state.last)
+        state.reset()
+        return summary
+
+
+def _json_list(values):
+    return [None if np.isnan(v) else v for v in values.tolist()]
+
+
+def encode_summary(summary):
+    return json.dumps(summary, separators=COMPACT).encode('utf-8')
+
+
+def is_window(payload):
+    return payload.get('_event_type') == EVENT_WINDOW
+
+
+def window_to_reading(payload):
+    """
+    Lettura equivalente all'ultima della finestra (valori 'last' + tag), con i metadati
+    della finestra in '_window'. None se quella lettura è già stata inviata grezza.
+    """
+    if payload.get('last_raw'):
+        return None
+    reading = {c: v for c, v in zip(payload['columns'], payload['last']) if v is not None}
+    reading.update(payload.get('tags', {}))
+    reading.update({
+        '_event_type': 'sensor_reading',
+        '_ts': payload['_ts'],
+        'sensor_id': payload.get('sensor_id', 'sensor'),
+        '_window': {'start': payload['window'][0], 'end': payload['window'][1], 'count': payload['count']},
+    })
+    return reading
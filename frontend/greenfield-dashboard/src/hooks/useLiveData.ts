@@ -11,6 +11,7 @@ export interface SensorData {
   Potassium_mg_kg?: number;
   pH?: number;
   _row_id?: number;
+  _version?: number;
 }
 
 export interface AdviceDetails {
@@ -23,6 +24,13 @@ export interface FullAdvice {
   rules: AdviceDetails;
   ai: AdviceDetails;
   ts: number;
+  _version?: number;
+}
+
+// Snapshot/delta dell'ultimo stato per sensore inviato dal gateway (JSON come stringa)
+interface StateSnapshot {
+  version: number;
+  sensors: Record<string, { version: number; reading: SensorData | null; advice: FullAdvice | null }>;
 }
 
 export function useLiveData(maxPoints: number = 50) {
@@ -32,6 +40,9 @@ export function useLiveData(maxPoints: number = 50) {
   const [isConnected, setIsConnected] = useState(false);
   
   const socketRef = useRef<Socket | null>(null);
+  // Versioni più recenti già mostrate: snapshot e messaggi live possono arrivare in qualsiasi ordine
+  const readingVersion = useRef(0);
+  const adviceVersion = useRef(0);
 
   useEffect(() => {
 
@@ -49,6 +60,9 @@ export function useLiveData(maxPoints: number = 50) {
     socket.on('connect', () => {
       console.log('✅ WebSocket Connesso!');
       setIsConnected(true);
+      // Il gateway riavviato riparte da versione 0: segue sempre un nuovo snapshot
+      readingVersion.current = 0;
+      adviceVersion.current = 0;
     });
 
     socket.on('disconnect', () => {
@@ -56,8 +70,29 @@ export function useLiveData(maxPoints: number = 50) {
       setIsConnected(false);
     });
 
+    // 0. Stato iniziale alla connessione (e recupero dei sensori cambiati nel frattempo)
+    const applyState = (raw: string) => {
+      const snapshot: StateSnapshot = JSON.parse(raw);
+      for (const entry of Object.values(snapshot.sensors)) {
+        if (entry.reading && entry.version > readingVersion.current) {
+          readingVersion.current = entry.version;
+          setLatest({ ...entry.reading, ts: entry.reading.ts || Date.now() });
+        }
+        if (entry.advice && entry.version > adviceVersion.current) {
+          adviceVersion.current = entry.version;
+          setAdvice(entry.advice);
+        }
+      }
+    };
+    socket.on('state_snapshot', applyState);
+    socket.on('state_delta', applyState);
+
     // 1. Ascolto Dati Sensori (Grafici)
     socket.on('sensor', (data: SensorData) => {
+      if (data._version) {
+        if (data._version <= readingVersion.current) return;
+        readingVersion.current = data._version;
+      }
       const point = { ...data, ts: data.ts || Date.now() };
       setLatest(point);
       setSeries(prev => {
@@ -71,6 +106,10 @@ export function useLiveData(maxPoints: number = 50) {
 
     // 2. Ascolto Consigli Intelligenti (AI + Rules)
     socket.on('ai_advice', (data: FullAdvice) => {
+      if (data._version) {
+        if (data._version <= adviceVersion.current) return;
+        adviceVersion.current = data._version;
+      }
       setAdvice(data);
     });
 